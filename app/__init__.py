@@ -8,11 +8,14 @@ Description:
 import os
 import json
 import stat
+import atexit
 
 from flask import Flask
 
 from settings import ConfigMapping
 from .extentions import mongo
+from utils.mongo import MongoRegistry, get_pool_options
+from utils.metrics import Metrics
 
 
 def register_extentions(app):
@@ -21,8 +24,102 @@ def register_extentions(app):
     from app.apis import api
     api.init_app(app)
 
+    # 接口性能指标
+    Metrics.init_app(app)
+
+    # 按请求统计Mongo命令（需要在创建MongoClient之前注册命令监听）
+    from utils.profiler import MongoProfiler
+    MongoProfiler.init_app(app)
+
     # 注册flask-pymongo
-    mongo.init_app(app)
+    mongo.init_app(app, **get_pool_options(app.config))
+
+    # 企业数据库连接注册表（连接在fork之后首次使用时创建）
+    MongoRegistry.init_app(app)
+
+    # 用户身份缓存
+    from utils.identity import IdentityCache
+    IdentityCache.init_app(app)
+
+    # 请求日志后台写入
+    from utils.log import RequestLogWriter, ResponseCapture
+    RequestLogWriter.init_app(app)
+    ResponseCapture.init_app(app)
+
+    # 批量生成二维码的进程池、按需生成二维码的缓存、二维码标签导出数量限制
+    from utils.qr import QRRenderPool
+    from utils.label import LabelExportLimit
+    from app.models.qr_code import QRCodeCache
+    QRRenderPool.init_app(app)
+    QRCodeCache.init_app(app)
+    LabelExportLimit.init_app(app)
+
+    # 后台任务（excel导入）
+    from utils.job import JobWorker
+    from app.models.document_data import DocumentDataModel
+    JobWorker.init_app(app)
+    JobWorker.register(DocumentDataModel.IMPORT_JOB_TYPE, DocumentDataModel.run_import_job,
+                       on_stale=DocumentDataModel.recover_import_job)
+
+    register_postfork()
+    register_shutdown()
+
+
+def postfork():
+    """worker fork之后、请求线程和后台线程启动之前调用：创建二维码渲染进程池（此时fork子进程是安全的）"""
+    from utils.qr import QRRenderPool
+    try:
+        QRRenderPool.start()
+    except Exception as e:
+        # 创建失败时不影响worker启动，批量渲染改为在当前线程中执行
+        print(f"二维码渲染进程池创建失败：{e}")
+
+
+def register_postfork():
+    """注册uwsgi的postfork回调（uwsgi先加载应用再fork出worker）。未使用uwsgi时不需要"""
+    try:
+        import uwsgi
+    except ImportError:
+        return
+
+    previous = getattr(uwsgi, "post_fork_hook", None)
+
+    def uwsgi_post_fork():
+        if previous:
+            previous()
+        postfork()
+
+    uwsgi.post_fork_hook = uwsgi_post_fork
+
+
+def shutdown():
+    """worker退出时调用：先等待执行中的任务、写完剩余日志，再关闭数据库连接"""
+    from utils.log import RequestLogWriter
+    from utils.qr import QRRenderPool
+    from utils.job import JobWorker
+    JobWorker.stop()
+    RequestLogWriter.stop()
+    QRRenderPool.shutdown()
+    MongoRegistry.close()
+
+
+def register_shutdown():
+    """注册worker退出回调。uwsgi的worker退出时不一定执行atexit，需要同时注册uwsgi.atexit"""
+    atexit.register(shutdown)
+
+    try:
+        import uwsgi
+    except ImportError:
+        return
+
+    previous = getattr(uwsgi, "atexit", None)
+
+    def uwsgi_atexit():
+        if previous:
+            previous()
+        shutdown()
+
+    uwsgi.atexit = uwsgi_atexit
 
 
 def init_db_admin_user():
@@ -121,6 +218,9 @@ def create_app(env='dev'):
 
     register_extentions(app)
 
+    from app.commands import register_commands
+    register_commands(app)
+
     init_db()
 
     return app
@@ -19,14 +19,15 @@ from .v1.enterprise import enterprise_api
 from .v1.image import image_api
 from .v1.banner import banner_api
 from .v1.workbench import workbench_api
-from .v1.stash import stash_api
-from .v1.seed import seed_api
+from .v1.stash import stash_api, stash_inventory_api
+from .v1.seed import seed_api, seed_pedigree_api
 from .v1.download import download_api
 from .v1.device import device_api
 from .v1.video import video_api
 from .v1.notify import notify_api
 from .v1.default_enter import default_enter_api
 from .v1.document_data import document_data_api
+from .v1.qr_code import qr_code_api
 from .wx_v1.auth import wx_auth_api
 from .wx_v1.workbench import wx_workbench_api
 from .wx_v1.enterprise import wx_enterprise_api
@@ -36,7 +37,7 @@ from .wx_v1.notify import wx_notify_api
 from .wx_v1.document import wx_document_api
 from .wx_v1.region import wx_region_api
 from .wx_v1.stash import wx_stash_api
-from .wx_v1.seed import wx_seed_api
+from .wx_v1.seed import wx_seed_api, wx_seed_search_api
 from .wx_v1.upload import wx_upload_api
 from .wx_v1.image import wx_image_api
 from .wx_v1.video import wx_video_api
@@ -47,6 +48,7 @@ from .admin_v1.auth import admin_auth_api
 from .admin_v1.admin_user import admin_user_api
 from .admin_v1.enterprise import admin_enterprise_api
 from .admin_v1.workbench import admin_workbench_api
+from .admin_v1.system import admin_system_api
 
 
 api = Api(
@@ -76,7 +78,9 @@ api.add_namespace(enterprise_api)
 # api.add_namespace(image_api)
 # api.add_namespace(workbench_api)
 # api.add_namespace(stash_api)
+api.add_namespace(stash_inventory_api)
 # api.add_namespace(seed_api)
+api.add_namespace(seed_pedigree_api)
 # api.add_namespace(download_api)
 # api.add_namespace(banner_api)
 # api.add_namespace(device_api)
@@ -84,6 +88,7 @@ api.add_namespace(enterprise_api)
 # api.add_namespace(notify_api)
 api.add_namespace(default_enter_api)
 api.add_namespace(document_data_api)
+api.add_namespace(qr_code_api)
 
 # 小程序 API
 api.add_namespace(wx_auth_api)
@@ -95,6 +100,7 @@ api.add_namespace(wx_user_api)
 api.add_namespace(wx_document_api)
 # api.add_namespace(wx_stash_api)
 # api.add_namespace(wx_seed_api)
+api.add_namespace(wx_seed_search_api)
 # api.add_namespace(wx_region_api)
 api.add_namespace(wx_upload_api)
 # api.add_namespace(wx_image_api)
@@ -107,4 +113,5 @@ api.add_namespace(wx_default_enter_api)
 api.add_namespace(admin_auth_api)
 api.add_namespace(admin_user_api)
 api.add_namespace(admin_enterprise_api)
-api.add_namespace(admin_workbench_api)
\ No newline at end of file
+api.add_namespace(admin_workbench_api)
+api.add_namespace(admin_system_api)
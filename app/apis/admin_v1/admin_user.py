@@ -16,6 +16,7 @@ from app.extentions import mongo
 from utils.response import ResponseMaker
 from utils.jwt import JWTUtil
 from utils.log import RequestLogUtil
+from utils.identity import IdentityCache
 
 
 admin_user_api = Namespace("admin", description="管理端API", path="/admin_api/v1/admin_user")
@@ -87,6 +88,8 @@ class ChangeAdminUserAPI(Resource):
             return ResponseMaker.can_not_delete_admin_user()
 
         mongo.db.admin_user.delete_one(condition)
+        IdentityCache.invalidate_user(user.get("_id"))
+
         return ResponseMaker.success()
 
     @admin_user_api.doc(description='查看管理员', params={'id': '用户id'})
@@ -151,6 +154,8 @@ class ChangeAdminUserAPI(Resource):
             return ResponseMaker.user_account_exist()
 
         mongo.db.admin_user.update_one({'_id': obj_id}, user_data)
+        IdentityCache.invalidate_user(obj_id)
+
         return ResponseMaker.success()
 
 
@@ -11,9 +11,9 @@ from flask import request
 from flask_restx import Resource, Namespace, fields
 from werkzeug.security import check_password_hash
 
-from app.extentions import mongo
 from utils.response import ResponseMaker
 from utils.jwt import JWTUtil
+from utils.identity import IdentityResolver
 
 
 admin_auth_api = Namespace("admin", description="管理端API", path="/admin_api/v1/auth")
@@ -33,9 +33,10 @@ class UserLoginAPI(Resource):
         password = data.get("password")
 
         # 检查账号是否存在
-        user = mongo.db.admin_user.find_one({"phone_number": phone_number})
-        if not user:
+        identity = IdentityResolver.find({"phone_number": phone_number}, collections=("admin_user",))
+        if not identity:
             return ResponseMaker.not_exist("用户", {"手机号": phone_number})
+        user = identity.get("user")
 
         # 检查密码正确性
         if user.get('password') != password:
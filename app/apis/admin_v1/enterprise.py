@@ -18,6 +18,7 @@ from utils.jwt import JWTUtil
 from utils.mongo import Mongo
 from app.models.banner import Banner
 from utils.log import RequestLogUtil
+from utils.identity import IdentityCache
 
 
 admin_enterprise_api = Namespace("admin", description="管理端API", path="/admin_api/v1/enterprise")
@@ -187,6 +188,9 @@ class ChangeEnterpriseAPI(Resource):
         }
         mongo.db.user.update_one(user_condition, user_info)
 
+        # 企业授权周期可能变更，清除该企业用户的身份缓存
+        IdentityCache.invalidate_enterprise(obj_id)
+
         return ResponseMaker.success()
 
 
@@ -264,4 +268,8 @@ class AdminEnterpriseStatusAPI(Resource):
             }
         }
         mongo.db.enterprise.update_one({"_id": ObjectId(enterprise_id)}, update_data)
+
+        # 企业状态变更，清除该企业用户的身份缓存
+        IdentityCache.invalidate_enterprise(enterprise_id)
+
         return ResponseMaker.success()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/2
+Last Modified: 2024/12/2
+Description: 系统运行状态
+"""
+import os
+
+from flask import request, Response
+from flask_restx import Resource, Namespace
+
+from utils.response import ResponseMaker
+from utils.jwt import JWTUtil
+from utils.mongo import MongoRegistry
+from utils.log import RequestLogWriter
+from utils.metrics import Metrics
+
+
+admin_system_api = Namespace("admin", description="管理端API", path="/admin_api/v1/system")
+
+
+@admin_system_api.route('/mongo_pool')
+class AdminMongoPoolAPI(Resource):
+    @admin_system_api.doc(description='当前worker进程的Mongo连接池统计')
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, *args, **kwargs):
+        resp_data = {
+            "pid": os.getpid(),
+            "pools": MongoRegistry.get_pool_stats()
+        }
+        return ResponseMaker.success(resp_data)
+
+
+@admin_system_api.route('/request_log')
+class AdminRequestLogAPI(Resource):
+    @admin_system_api.doc(description='当前worker进程的请求日志写入统计')
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, *args, **kwargs):
+        return ResponseMaker.success(RequestLogWriter.get_stats())
+
+
+@admin_system_api.route('/metrics')
+class AdminMetricsAPI(Resource):
+    @admin_system_api.doc(description='接口性能指标（所有worker合并），Prometheus文本格式')
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, *args, **kwargs):
+        return Response(Metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
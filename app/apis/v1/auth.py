@@ -5,17 +5,15 @@ Created Date: 2023/11/19
 Last Modified: 2023/11/19
 Description:
 """
-import datetime
 import json
 
 from flask import request
 from flask_restx import Resource, Namespace, fields
 from werkzeug.security import check_password_hash
-from bson import ObjectId
 
-from app.extentions import mongo
 from utils.response import ResponseMaker
 from utils.jwt import JWTUtil
+from utils.identity import IdentityResolver
 from utils.dt import DateTime
 
 
@@ -36,25 +34,28 @@ class UserAPI(Resource):
         phone_number = data.get("phone_number")
         password = data.get("password")
 
-        # 检查账号是否存在
-        user = mongo.db.user.find_one({"phone_number": phone_number})
-        if not user:
+        # 检查账号是否存在（用户和所在企业一次查询取回）
+        identity = IdentityResolver.find({"phone_number": phone_number}, collections=("user",))
+        if not identity:
             return ResponseMaker.not_exist("用户", {"手机号": phone_number})
+        user = identity.get("user")
 
         # 检查密码正确性
         if password != user.get("password"):
             return ResponseMaker.user_password_error()
 
         # 检查企业状态
-        enterprise_id = user.get("enterprise_id")
-        enterprise = mongo.db.enterprise.find_one({"_id": ObjectId(enterprise_id)})
+        enterprise = identity.get("enterprise")
+        if not enterprise:
+            return ResponseMaker.login_enterprise_deleted()
+
         if enterprise.get("status") == "DISABLE":
             return ResponseMaker.login_enterprise_disable()
 
         # 检查账号所在企业是否在授权周期内
         current_dt = DateTime.get_datetime_now()
-        start_dt = datetime.datetime.strptime(enterprise.get("start_date"), "%Y-%m-%d")
-        end_dt = datetime.datetime.strptime(enterprise.get("end_date"), "%Y-%m-%d")
+        start_dt = enterprise.get("start_dt")
+        end_dt = enterprise.get("end_dt")
         if current_dt < start_dt or current_dt > end_dt:
             return ResponseMaker.login_enterprise_deprecated()
 
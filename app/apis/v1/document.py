@@ -13,7 +13,6 @@ from flask_restx import Resource, Namespace, fields
 from utils.response import ResponseMaker
 from utils.jwt import JWTUtil
 from app.models.document import Document
-from app.models.land import Land
 from utils.log import RequestLogUtil
 
 
@@ -21,7 +20,9 @@ document_api = Namespace("client", description="客户端API", path="/client_api
 
 column_config_model = document_api.model("ColumnConfigModel", {
     "dataIndex": fields.String(required=True, description="字段名称"),
-    "dataType": fields.String(required=True, description="数据类型")
+    "dataType": fields.String(required=True, description="数据类型"),
+    "searchable": fields.Boolean(required=False, description="是否按此列搜索（创建索引）", default=False),
+    "sortable": fields.Boolean(required=False, description="是否按此列排序（创建索引）", default=False)
 })
 
 document_model = document_api.model("DocumentModel", {
@@ -171,15 +172,12 @@ class DocumentListAPI(Resource):
 
         document_datas = []
         for document in query_result.get("list"):
-            # 关联的土地
-            land = Land(req=request).get(document.get("land_id"))
-
             document_data = {
                 "id": str(document.get("_id")),
                 "document_name": document.get("document_name"),
                 "start_date": document.get("start_date"),
                 "end_date": document.get("end_date"),
-                "land_name": land.get("land_name")
+                "land_name": document.get("land_name")
             }
             document_datas.append(document_data)
 
@@ -6,21 +6,39 @@ Last Modified: 2024/9/16
 Description: 
 """
 from io import BytesIO
+from urllib import parse
 
-import requests
-from flask import request, send_file
+from flask import request, send_file, Response, stream_with_context, current_app
 from flask_restx import Resource, Namespace, fields
 import pandas as pd
+import pymongo
+from pymongo.errors import DuplicateKeyError
 
 from utils.response import ResponseMaker
 from utils.jwt import JWTUtil
 from app.models.document import Document
 from app.models.document_data import DocumentDataModel
+from app.models.document_index import DocumentIndex
+from app.models.qr_code import QRCode
 from utils.log import RequestLogUtil
+from utils.label import LabelLayout, LabelExportLimit, generate_label_pdf
+from utils.qr import QRRenderPool
+from utils.export import XlsxStreamWriter, generate_xlsx, generate_csv
+from utils.job import JobWorker
+from app.models.job import Job
 
 
 document_data_api = Namespace("client", description="客户端API", path="/client_api/v1/document")
 
+# 导出格式，{格式: (生成函数, Content-Type)}
+EXPORT_FORMATS = {
+    "xlsx": (generate_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": (generate_csv, "text/csv"),
+}
+
+# 数据列表排序方式
+SORT_ORDERS = {"ASC": pymongo.ASCENDING, "DESC": pymongo.DESCENDING}
+
 
 document_data_param_model = document_data_api.model("DocumentDataParamModel", {
     "document_id": fields.String(required=True, description="档案id"),
@@ -31,12 +49,16 @@ document_data_list_model = document_data_api.model('DocumentDataListModel', {
     'page_number': fields.Integer(required=True, description='页码', default=1),
     'page_size': fields.Integer(required=True, description='每页数量', default=10),
     'dataIndex': fields.String(required=False, description='列名，用哪一列匹配'),
-    'keyword': fields.String(required=False, description='关键字，匹配的值')
+    'keyword': fields.String(required=False, description='关键字，匹配的值'),
+    'sortIndex': fields.String(required=False, description='列名，按哪一列排序（档案配置中标记了sortable的列）'),
+    'sortOrder': fields.String(required=False, description='排序方式。枚举值：ASC（默认）, DESC', default="ASC")
 })
 
 document_data_import_model = document_data_api.model('DocumentDataImportModel', {
     'excel_url': fields.String(required=True, description='excel文件URL'),
-    'import_type': fields.String(required=True, description='导入类型。枚举值：APPEND, COVER', default="APPEND"),
+    'import_type': fields.String(required=True, description='导入类型。枚举值：APPEND（追加）, COVER（覆盖）, '
+                                                            'MERGE（按关键列合并）', default="APPEND"),
+    'key_columns': fields.List(fields.String, required=False, description='MERGE时必填，关键列（档案配置中的列名）'),
 })
 
 
@@ -127,9 +149,22 @@ class DocumentDataListAPI(Resource):
         page_size = data.get("page_size")
         data_index = data.get("dataIndex")
         keyword = data.get("keyword")  # 当前关键字为土地名称
+        sort_index = data.get("sortIndex")
+        sort_order = data.get("sortOrder") or "ASC"
+
+        document = Document(req=request).get(document_id)
+        if not document:
+            return ResponseMaker.not_exist("档案", {})
+
+        # 只能按已创建索引的列排序
+        if sort_order not in SORT_ORDERS:
+            return ResponseMaker.request_param_error("sortOrder必须为ASC或DESC")
+        if sort_index and not DocumentIndex.is_sortable(document.get("column_config_list"), sort_index):
+            return ResponseMaker.request_param_error("sortIndex必须是档案配置中可排序的列")
 
         doc_model = DocumentDataModel(req=request)
-        result = doc_model.query_list(document_id, page_number, page_size, data_index, keyword)
+        result = doc_model.query_list(document_id, page_number, page_size, data_index, keyword,
+                                      sort_index, SORT_ORDERS[sort_order])
 
         document_data_list = []
 
@@ -139,7 +174,7 @@ class DocumentDataListAPI(Resource):
             document_data_list.append(d)
 
         # 添加档案名称
-        document_name = Document(req=request).get(document_id).get("document_name")
+        document_name = document.get("document_name")
 
         resp = {
             "document_name": document_name,
@@ -183,40 +218,99 @@ class DocuemntTemplateAPI(Resource):
 
 @document_data_api.route('/export/<id>')
 class DocuemntExportAPI(Resource):
-    @document_data_api.doc(description='导出全部数据', params={"id": "档案id"})
+    @document_data_api.doc(description='导出全部数据', params={"id": "档案id", "format": "文件格式。枚举值：xlsx（默认）, csv"})
     @JWTUtil.verify_token_decorator(request)
     def get(self, *args, **kwargs):
         document_id = request.view_args.get("id")
+        file_format = request.args.get("format", "xlsx")
+        if file_format not in EXPORT_FORMATS:
+            return ResponseMaker.request_param_error("format必须为xlsx或csv")
 
         document_model = Document(req=request)
         document = document_model.get(document_id)
         if not document:
             return ResponseMaker.not_exist("档案", {})
 
+        # 列顺序与档案配置一致
+        column_config_list = document.get("column_config_list") or []
+        column_names = [c.get("dataIndex") for c in column_config_list]
+
+        # xlsx行数有上限（含表头），超出时流式输出已经开始，只能在生成前检查
         document_data_model = DocumentDataModel(req=request)
-        datas = document_data_model.get_all(document_id)
-        data_list = list(datas)
+        if file_format == "xlsx" and document_data_model.count(document_id) >= XlsxStreamWriter.MAX_ROWS:
+            return ResponseMaker.request_param_error(
+                f"数据超过xlsx最大行数（{XlsxStreamWriter.MAX_ROWS - 1}行），请使用format=csv导出")
 
-        # 根据档案名称，生成excel模板文件名
-        excel_name = f"{document.get('document_name')}.xlsx"
+        # 逐批读取、逐批输出，不在内存中生成整个文件
+        batch_size = current_app.config.get("EXPORT_BATCH_SIZE", 1000)
+        datas = document_data_model.get_all(document_id, batch_size=batch_size)
+        generate_func, mimetype = EXPORT_FORMATS[file_format]
+        content = generate_func(column_names, datas, batch_size)
 
-        # 将二进制数据写入内存对象
-        bytes_io = BytesIO()
+        file_name = parse.quote(f"{document.get('document_name')}.{file_format}")
+        response = Response(stream_with_context(content), mimetype=mimetype)
+        response.headers.set("Content-Disposition", f"attachment; filename*=UTF-8''{file_name}")
+        return response
 
-        # 生成excel
-        df = pd.DataFrame(data_list)
-        df.to_excel(bytes_io, index=False)
-        bytes_io.seek(0)
 
-        return send_file(bytes_io, download_name=excel_name, as_attachment=True)
+@document_data_api.route('/qr_labels/<id>')
+class DocumentQRLabelsAPI(Resource):
+    @document_data_api.doc(description='导出二维码标签（PDF，A4纸每页24个）', params={"id": "档案id"})
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, *args, **kwargs):
+        document_id = request.view_args.get("id")
+        if not Document.is_id_format_right(document_id):
+            return ResponseMaker.id_format_error()
+
+        document_model = Document(req=request)
+        document = document_model.get(document_id)
+        if not document:
+            return ResponseMaker.not_exist("档案", {})
+
+        # 逐页渲染（进程池）、逐页输出，不在内存中生成整个文件
+        labels = DocumentDataModel(req=request).iter_labels(document_id)
+        renderer = QRCode.get_renderer()
+        pdf = generate_label_pdf(renderer, LabelLayout(), labels, map_func=QRRenderPool.map)
+        pdf_name = parse.quote(f"{document.get('document_name')}二维码标签.pdf")
+
+        # 导出期间占用当前线程，限制每个worker同时导出的数量
+        if not LabelExportLimit.acquire():
+            return ResponseMaker.qr_label_exporting()
+
+        response = Response(stream_with_context(pdf), mimetype="application/pdf")
+        response.headers.set("Content-Disposition", f"attachment; filename*=UTF-8''{pdf_name}")
+        # 输出完成或客户端断开时释放（响应关闭时调用，未开始输出也会调用）
+        response.call_on_close(LabelExportLimit.release)
+        return response
+
+
+@document_data_api.route('/indexes/<id>')
+class DocumentDataIndexAPI(Resource):
+    @document_data_api.doc(description='档案数据索引及使用次数（ops为mongod进程启动以来的使用次数）', params={"id": "档案id"})
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, *args, **kwargs):
+        document_id = request.view_args.get("id")
+        if not Document.is_id_format_right(document_id):
+            return ResponseMaker.id_format_error()
+
+        document = Document(req=request).get(document_id)
+        if not document:
+            return ResponseMaker.not_exist("档案", {})
+
+        usage = DocumentIndex(req=request).get_usage(document_id, document.get("column_config_list"))
+        return ResponseMaker.success(usage)
 
 
 @document_data_api.route('/import/<id>')
 class DocuemntExportAPI(Resource):
-    @document_data_api.doc(description='通过excel导入数据', params={"id": "档案id"}, body=document_data_import_model)
+    @document_data_api.doc(description='通过excel导入数据（后台任务，返回job_id，通过/import_job/<job_id>查询进度）',
+                           params={"id": "档案id"}, body=document_data_import_model)
     @JWTUtil.verify_token_decorator(request)
+    @RequestLogUtil.log(request)
     def post(self, *args, **kwargs):
         document_id = request.view_args.get("id")
+        if not Document.is_id_format_right(document_id):
+            return ResponseMaker.id_format_error()
 
         data = request.get_json(force=True)
         excel_url = data.get("excel_url")
@@ -227,48 +321,65 @@ class DocuemntExportAPI(Resource):
         if not document:
             return ResponseMaker.not_exist("档案", {})
 
+        if import_type not in DocumentDataModel.IMPORT_TYPES:
+            return ResponseMaker.document_import_type_error()
+
+        # 合并导入的关键列
+        key_columns = data.get("key_columns") or []
+        if import_type == "MERGE":
+            column_names = [c.get("dataIndex") for c in document.get("column_config_list") or []]
+            if not isinstance(key_columns, list) or not key_columns:
+                return ResponseMaker.request_param_error("MERGE导入时key_columns不能为空")
+            if any(c not in column_names for c in key_columns):
+                return ResponseMaker.request_param_error("key_columns必须是档案配置中的列名")
+
+        enterprise_id = request.user.get("enterprise_id")
+        params = {"document_id": document_id, "excel_url": excel_url, "import_type": import_type}
+        if import_type == "MERGE":
+            params["key_columns"] = list(dict.fromkeys(key_columns))
+
+        # 同一档案同时只能有一个导入任务（jobs集合active_key唯一索引）
         try:
-            # 读取档案配置
-            column_config_list = document.get("column_config_list")
-            column_names = [c.get("dataIndex") for c in column_config_list]
-
-            # 从cos读取excel文件
-            resp = requests.get(excel_url)
-            content = resp.content
-            df = pd.read_excel(content)
-
-            # 生成数据
-            insert_data_list = []
-            for index, row in df.iterrows():
-                insert_data = {}
-                for column in column_names:
-                    # 判断列名是否存在
-                    if column not in column_names:
-                        msg = f"档案中并未配置‘{column}’列"
-                        return ResponseMaker.document_data_import_failed(msg)
-                    else:
-                        # 如果excel中该字段为空，置为空字符串
-                        if pd.isna(row[column]):
-                            value = ""
-                        else:
-                            value = row[column]
-
-                        insert_data[column] = value
-
-                insert_data_list.append(insert_data)
-
-            document_data_model = DocumentDataModel(req=request)
-
-            if import_type == "APPEND":
-                # 追加导入
-                document_data_model.import_append(document_id, insert_data_list)
-            elif import_type == "COVER":
-                # 覆盖导入
-                document_data_model.import_cover(document_id, insert_data_list)
-            else:
-                return ResponseMaker.document_import_type_error()
-
-            return ResponseMaker.success()
-        except Exception as e:
-            msg = str(e)
-            return ResponseMaker.document_data_import_failed(msg)
+            job_id = JobWorker.submit(DocumentDataModel.IMPORT_JOB_TYPE, enterprise_id, str(request.user.get("_id")),
+                                      params, active_key=f"{enterprise_id}:{document_id}")
+        except DuplicateKeyError:
+            return ResponseMaker.document_data_importing()
+
+        return ResponseMaker.success({"job_id": job_id})
+
+
+@document_data_api.route('/import_job/<job_id>')
+class DocumentImportJobAPI(Resource):
+    @document_data_api.doc(description='查询导入任务进度', params={"job_id": "任务id"})
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, *args, **kwargs):
+        job_id = request.view_args.get("job_id")
+        if not Job.is_id_format_right(job_id):
+            return ResponseMaker.id_format_error()
+
+        job = Job().get(job_id, request.user.get("enterprise_id"))
+        if not job:
+            return ResponseMaker.not_exist("导入任务", {})
+
+        return ResponseMaker.success(Job.to_dict(job))
+
+
+@document_data_api.route('/import_job/<job_id>/cancel')
+class DocumentImportJobCancelAPI(Resource):
+    @document_data_api.doc(description='取消导入任务（执行中的任务在写完当前一块数据后停止）', params={"job_id": "任务id"})
+    @JWTUtil.verify_token_decorator(request)
+    @RequestLogUtil.log(request)
+    def post(self, *args, **kwargs):
+        job_id = request.view_args.get("job_id")
+        if not Job.is_id_format_right(job_id):
+            return ResponseMaker.id_format_error()
+
+        job_model = Job()
+        if not job_model.get(job_id, request.user.get("enterprise_id")):
+            return ResponseMaker.not_exist("导入任务", {})
+
+        job = job_model.request_cancel(job_id)
+        if not job:
+            return ResponseMaker.job_finished()
+
+        return ResponseMaker.success(Job.to_dict(job))
@@ -7,10 +7,10 @@ Description:
 """
 import os
 
-from flask import request, send_from_directory, current_app
+from flask import request, send_from_directory
 from flask_restx import Resource, Namespace
 
-from utils.mongo import Mongo
+from utils.mongo import MongoRegistry
 from app.models.excel import Excel
 from app.models.document import Document
 
@@ -25,10 +25,8 @@ class DownloadDocumentAPI(Resource):
         document_id = request.args.get("id")
         enterprise_id = request.args.get("enterprise_id")
 
-        mongo_host = current_app.config["MONGO_HOST"]
-        mongo_port = current_app.config["MONGO_PORT"]
         db_name = f"NZY_{enterprise_id}"
-        db = Mongo(mongo_host, mongo_port).get_db(db_name)
+        db = MongoRegistry.get_db(db_name)
 
         document_m = Document(db=db)
         excel_fp = document_m.export_excel(document_id)
@@ -56,10 +54,8 @@ class DownloadDocumentTemplateAPI(Resource):
         excel_id = request.args.get("excel_id")
         enterprise_id = request.args.get("enterprise_id")
 
-        mongo_host = current_app.config["MONGO_HOST"]
-        mongo_port = current_app.config["MONGO_PORT"]
         db_name = f"NZY_{enterprise_id}"
-        db = Mongo(mongo_host, mongo_port).get_db(db_name)
+        db = MongoRegistry.get_db(db_name)
         excel = Excel(db=db).get(excel_id)
         excel_name = excel.get("name")
 
@@ -5,9 +5,9 @@ Created Date: 2023/11/28
 Last Modified: 2023/11/28
 Description: 
 """
-from flask import request, make_response, current_app
+from flask import request, make_response
 from flask_restx import Resource, Namespace
-from utils.mongo import Mongo
+from utils.mongo import MongoRegistry
 
 from utils.response import ResponseMaker
 from app.models.image import Image
@@ -18,7 +18,8 @@ image_api = Namespace("client", description="客户端API", path="/api/v1/image"
 content_type_mapping = {
     ".png": "image/png",
     ".jpg": "image/jpg",
-    ".jpeg": "image/jpeg"
+    ".jpeg": "image/jpeg",
+    ".svg": "image/svg+xml"
 }
 
 
@@ -36,10 +37,8 @@ class ImageAPI(Resource):
         if not short_name:
             return ResponseMaker.short_name_missing()
 
-        # 构造mongo连接
-        host = current_app.config["MONGO_HOST"]
-        port = current_app.config["MONGO_PORT"]
-        db = Mongo(host, port).get_db(short_name)
+        # 企业数据库连接
+        db = MongoRegistry.get_db(short_name)
 
         image_m = Image(db=db)
         if not image_m.is_exist(image_id):
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/15
+Last Modified: 2024/12/15
+Description: 二维码按需生成
+"""
+from flask import request, make_response
+from flask_restx import Resource, Namespace
+
+from utils.response import ResponseMaker
+from app.models.qr_code import QRCode, QRCodeCache
+
+
+qr_code_api = Namespace("client", description="客户端API", path="/client_api/v1/qr_code")
+
+# 地址中不包含渲染配置，修改配置（QR_CODE_FORMAT等）后同一地址的图片会变化：
+# 缓存1小时，过期后按ETag（内容+渲染配置的哈希）重新验证，未变化时返回304
+CACHE_CONTROL = "public, max-age=3600"
+
+
+@qr_code_api.route('/')
+class QRCodeAPI(Resource):
+    @qr_code_api.doc(description='种子二维码（第一次访问时生成）', params={'enterprise_id': '企业id', 'seed_id': '种子id'})
+    def get(self, *args, **kwargs):
+        enterprise_id = request.args.get("enterprise_id")
+        seed_id = request.args.get("seed_id")
+
+        if not QRCode.is_id_format_right(enterprise_id) or not QRCode.is_id_format_right(seed_id):
+            return ResponseMaker.id_format_error()
+
+        renderer = QRCode.get_renderer()
+        qr_code_data = QRCode.make_seed_data(enterprise_id, seed_id)
+
+        # 浏览器已缓存
+        etag = renderer.get_cache_key(qr_code_data)
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            exists = lambda: QRCode.is_seed_exist(enterprise_id, seed_id)
+            etag, img_bytes = QRCodeCache().get(renderer, qr_code_data, exists)
+            if img_bytes is None:
+                return ResponseMaker.not_exist("种子", {})
+
+            response = make_response(img_bytes)
+            response.headers.set('Content-Type', renderer.content_type)
+
+        response.set_etag(etag)
+        response.headers.set('Cache-Control', CACHE_CONTROL)
+        return response
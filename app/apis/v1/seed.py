@@ -15,6 +15,8 @@ from utils.log import RequestLogUtil
 
 
 seed_api = Namespace("client", description="客户端API", path="/api/v1/seed")
+# 系谱查询（seed_api中的旧接口未启用，只注册此命名空间）
+seed_pedigree_api = Namespace("client", description="客户端API", path="/client_api/v1/seed")
 
 seed_model = seed_api.model("SeedModel", {
     '种子名称': fields.String(required=True, description='种子名称'),
@@ -131,6 +133,57 @@ class SeedDetailAPI(Resource):
         return ResponseMaker.success()
 
 
+@seed_pedigree_api.route('/<id>/children')
+class SeedChildrenAPI(Resource):
+    @seed_pedigree_api.doc(description='子代种子（以该种子为父本/母本的种子）', params={'id': "种子id"})
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, params, *args, **kwargs):
+        seed_id = request.view_args.get("id")
+        if not Seed.is_id_format_right(seed_id):
+            return ResponseMaker.id_format_error()
+
+        seed_m = Seed(req=request)
+        if not seed_m.is_exist(seed_id):
+            return ResponseMaker.not_exist("种子", {})
+
+        children = seed_m.get_children(seed_id)
+        return ResponseMaker.success(children)
+
+
+@seed_pedigree_api.route('/<id>/ancestors')
+class SeedAncestorsAPI(Resource):
+    @seed_pedigree_api.doc(description='种子系谱（祖先）', params={'id': "种子id", 'depth': "向上查询的代数，默认3"})
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, params, *args, **kwargs):
+        seed_id = request.view_args.get("id")
+        if not Seed.is_id_format_right(seed_id):
+            return ResponseMaker.id_format_error()
+
+        depth = request.args.get("depth", "3")
+        if not depth.isdigit() or int(depth) < 1:
+            return ResponseMaker.request_param_error("depth必须为正整数")
+
+        ancestors = Seed(req=request).get_ancestors(seed_id, int(depth))
+        if ancestors is None:
+            return ResponseMaker.not_exist("种子", {})
+
+        return ResponseMaker.success(ancestors)
+
+
+@seed_pedigree_api.route('/<id>/ref')
+class SeedRefAPI(Resource):
+    @seed_pedigree_api.doc(description='种子是否被引用（作为父本/母本）', params={'id': "种子id"})
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, params, *args, **kwargs):
+        seed_id = request.view_args.get("id")
+        if not Seed.is_id_format_right(seed_id):
+            return ResponseMaker.id_format_error()
+
+        ref_list = Seed(req=request).has_ref(seed_id)
+        resp_data = {"is_referenced": bool(ref_list), "ref_list": ref_list}
+        return ResponseMaker.success(resp_data)
+
+
 @seed_api.route('/all')
 class SeedAllAPI(Resource):
     @seed_api.doc(description='所有种子')
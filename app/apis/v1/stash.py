@@ -5,6 +5,8 @@ Created Date: 2023/11/30
 Last Modified: 2023/11/30
 Description: 仓库
 """
+import math
+
 from flask import request
 from flask_restx import Resource, Namespace, fields
 
@@ -16,6 +18,8 @@ from utils.log import RequestLogUtil
 
 
 stash_api = Namespace("client", description="客户端API", path="/api/v1/stash")
+# 入库、出库、仓库种子列表（stash_api中的旧接口未启用，只注册此命名空间）
+stash_inventory_api = Namespace("client", description="客户端API", path="/client_api/v1/stash")
 
 stash_list_model = stash_api.model('StashListModel', {
     'pn': fields.String(required=True, description='页码'),
@@ -41,6 +45,18 @@ stash_model = stash_api.model('StashModel', {
     'inventory_list': fields.List(fields.Nested(inventory_item_model), required=True, description='描述'),
 })
 
+stash_stock_model = stash_inventory_api.model('StashStockModel', {
+    'seed_id': fields.String(required=True, description='种子id'),
+    'quantity': fields.Integer(required=False, description='数量，默认0'),
+    'weight': fields.Float(required=False, description='重量，默认0')
+})
+
+stash_inventory_list_model = stash_inventory_api.model('StashInventoryListModel', {
+    'pn': fields.Integer(required=True, description='页码'),
+    'pz': fields.Integer(required=True, description='每页数量'),
+    'keyword': fields.String(required=False, description='关键字（种子名称/种子编号）')
+})
+
 stash_status_model = stash_api.model('StashStatusModel', {
     'id': fields.String(required=True, description='仓库id'),
     'status': fields.String(required=True, description='仓库状态')
@@ -83,7 +99,7 @@ class StashDetailAPI(Resource):
             ],
             "detail_address": stash.get("detail_address"),
             "description": stash.get("description"),
-            "inventory_list": stash.get("inventory_list")
+            "inventory_list": stash_m.get_inventory_list(stash_id)
         }
 
         return ResponseMaker.success(stash_data)
@@ -193,3 +209,89 @@ class StashAllAPI(Resource):
     def get(self, *args, **kwargs):
         all_stash = Stash(req=request).get_all()
         return ResponseMaker.success(all_stash)
+
+
+def adjust_inventory(stash_id, direction):
+    """
+    入库/出库
+
+    :param direction: int. 1为入库，-1为出库
+    """
+    if not Stash.is_id_format_right(stash_id):
+        return ResponseMaker.id_format_error()
+
+    stash_m = Stash(req=request)
+    if not stash_m.is_exist(stash_id):
+        return ResponseMaker.not_exist("仓库", {})
+
+    data = request.get_json(force=True)
+    seed_id = data.get("seed_id")
+    if not seed_id:
+        return ResponseMaker.missing_params("seed_id")
+    if not Stash.is_id_format_right(seed_id):
+        return ResponseMaker.id_format_error()
+
+    try:
+        quantity = int(data.get("quantity") or 0)
+        weight = float(data.get("weight") or 0)
+    except (TypeError, ValueError, OverflowError):
+        return ResponseMaker.request_param_error("quantity、weight必须为数字")
+
+    # nan、inf可以通过大小比较，$inc后库存和汇总无法恢复
+    if not math.isfinite(weight):
+        return ResponseMaker.request_param_error("weight必须为有限的数字")
+
+    if quantity < 0 or weight < 0 or (quantity == 0 and weight == 0):
+        return ResponseMaker.request_param_error("quantity、weight不能为负数，且不能同时为0")
+
+    # 入库时仓库中没有该种子会新建记录，种子必须存在
+    if direction > 0 and not stash_m.get_inventory().is_seed_exist(seed_id):
+        return ResponseMaker.not_exist("种子", {})
+
+    row = stash_m.adjust_inventory(stash_id, seed_id, direction * quantity, direction * weight)
+    if row is None:
+        return ResponseMaker.inventory_insufficient()
+
+    resp_data = {
+        "seed_id": seed_id,
+        "quantity": row.get("quantity"),
+        "weight": row.get("weight")
+    }
+    return ResponseMaker.success(resp_data)
+
+
+@stash_inventory_api.route('/<id>/stock_in')
+class StashStockInAPI(Resource):
+    @stash_inventory_api.doc(description='入库', params={'id': "仓库id"}, body=stash_stock_model)
+    @JWTUtil.verify_token_decorator(request)
+    @RequestLogUtil.log(request)
+    def post(self, params, *args, **kwargs):
+        return adjust_inventory(request.view_args.get("id"), 1)
+
+
+@stash_inventory_api.route('/<id>/stock_out')
+class StashStockOutAPI(Resource):
+    @stash_inventory_api.doc(description='出库', params={'id': "仓库id"}, body=stash_stock_model)
+    @JWTUtil.verify_token_decorator(request)
+    @RequestLogUtil.log(request)
+    def post(self, params, *args, **kwargs):
+        return adjust_inventory(request.view_args.get("id"), -1)
+
+
+@stash_inventory_api.route('/<id>/inventory_list')
+class StashInventoryListAPI(Resource):
+    @stash_inventory_api.doc(description='仓库种子列表', params={'id': "仓库id"}, body=stash_inventory_list_model)
+    @JWTUtil.verify_token_decorator(request)
+    def post(self, params, *args, **kwargs):
+        stash_id = request.view_args.get("id")
+        if not Stash.is_id_format_right(stash_id):
+            return ResponseMaker.id_format_error()
+
+        data = request.get_json(force=True)
+        pn = data.get("pn")
+        pz = data.get("pz")
+        keyword = data.get("keyword")
+
+        result = Stash(req=request).seed_list(pn, pz, stash_id, keyword)
+
+        return ResponseMaker.success(result)
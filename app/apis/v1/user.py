@@ -16,6 +16,7 @@ from app.extentions import mongo
 from utils.response import ResponseMaker
 from utils.jwt import JWTUtil
 from utils.log import RequestLogUtil
+from utils.identity import IdentityCache
 
 
 user_api = Namespace("client", description="客户端API", path="/client_api/v1/user")
@@ -94,6 +95,8 @@ class ChangeUserAPI(Resource):
             return ResponseMaker.can_not_delete_root_user()
 
         mongo.db.user.delete_one(condition)
+        IdentityCache.invalidate_user(user.get("_id"))
+
         return ResponseMaker.success()
 
     @user_api.doc(description='查看用户', params={'id': '用户id'})
@@ -150,6 +153,7 @@ class ChangeUserAPI(Resource):
             return ResponseMaker.user_account_exist()
 
         mongo.db.user.update_one({'_id': obj_id}, user_data)
+        IdentityCache.invalidate_user(obj_id)
 
         # 企业root账号，同步更新账号信息到企业表
         if user.get("is_root"):
@@ -11,7 +11,6 @@ from flask_restx import Resource, Namespace, fields
 from utils.response import ResponseMaker
 from utils.jwt import JWTUtil
 from app.models.document import Document
-from app.models.land import Land
 from utils.log import RequestLogUtil
 
 
@@ -45,15 +44,12 @@ class DocumentListAPI(Resource):
 
         document_datas = []
         for document in query_result.get("list"):
-            # 关联的土地
-            land = Land(req=request).get(document.get("land_id"))
-
             document_data = {
                 "id": str(document.get("_id")),
                 "document_name": document.get("document_name"),
                 "start_date": document.get("start_date"),
                 "end_date": document.get("end_date"),
-                "land_name": land.get("land_name")
+                "land_name": document.get("land_name")
             }
             document_datas.append(document_data)
 
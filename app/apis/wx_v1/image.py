@@ -5,9 +5,9 @@ Created Date: 2023/11/28
 Last Modified: 2023/11/28
 Description: 
 """
-from flask import request, make_response, current_app
+from flask import request, make_response
 from flask_restx import Resource, Namespace
-from utils.mongo import Mongo
+from utils.mongo import MongoRegistry
 
 from utils.response import ResponseMaker
 from app.models.image import Image
@@ -30,10 +30,8 @@ class WXImageAPI(Resource):
         if not short_name:
             return ResponseMaker.short_name_missing()
 
-        # 构造mongo连接
-        host = current_app.config["MONGO_HOST"]
-        port = current_app.config["MONGO_PORT"]
-        db = Mongo(host, port).get_db(short_name)
+        # 企业数据库连接
+        db = MongoRegistry.get_db(short_name)
 
         image_m = Image(db=db)
         if not image_m.is_exist(image_id):
@@ -41,6 +39,8 @@ class WXImageAPI(Resource):
 
         image = image_m.get(image_id)
         response = make_response(image.get("data"))
-        response.headers.set('Content-Type', 'image/png')
+        # 二维码可能为svg格式，其他均为png
+        content_type = 'image/svg+xml' if image.get("type") == ".svg" else 'image/png'
+        response.headers.set('Content-Type', content_type)
 
         return response
@@ -15,6 +15,8 @@ from utils.log import RequestLogUtil
 
 
 wx_seed_api = Namespace("app", description="移动端API", path="/app_api/v1/seed")
+# 种子搜索（wx_seed_api中的旧接口未启用，只注册此命名空间）
+wx_seed_search_api = Namespace("app", description="移动端API", path="/app_api/v1/seed")
 
 wx_seed_list_model = wx_seed_api.model('WXSeedListModel', {
     'pn': fields.String(required=True, description='页码'),
@@ -42,6 +44,20 @@ class WXSeedListAPI(Resource):
         return ResponseMaker.success(resp_data)
 
 
+@wx_seed_search_api.route('/suggest')
+class WXSeedSuggestAPI(Resource):
+    @wx_seed_search_api.doc(description='种子搜索自动补全', params={'keyword': "关键字，种子名称/种子编号", 'limit': "返回数量，默认10"})
+    @JWTUtil.verify_token_decorator(request)
+    def get(self, *args, **kwargs):
+        keyword = request.args.get("keyword", "")
+        limit = request.args.get("limit", "10")
+        if not limit.isdigit() or not 1 <= int(limit) <= 50:
+            return ResponseMaker.request_param_error("limit必须为1~50的整数")
+
+        suggestions = Seed(req=request).suggest(keyword, int(limit))
+        return ResponseMaker.success(suggestions)
+
+
 @wx_seed_api.route('/<id>')
 class WXSeedDetailAPI(Resource):
     @wx_seed_api.doc(description='种子详情', params={'id': "种子id"})
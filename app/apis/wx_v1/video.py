@@ -7,12 +7,12 @@ Description:
 """
 import os
 
-from flask import request, current_app, send_file
+from flask import request, send_file
 from flask_restx import Resource, Namespace
 
 from utils.response import ResponseMaker
 from app.models.video import Video
-from utils.mongo import Mongo
+from utils.mongo import MongoRegistry
 
 
 wx_video_api = Namespace("app", description="移动端API", path="/app_api/v1/video")
@@ -32,10 +32,8 @@ class WXVideoAPI(Resource):
         if not short_name:
             return ResponseMaker.short_name_missing()
 
-        # 构造mongo连接
-        host = current_app.config["MONGO_HOST"]
-        port = current_app.config["MONGO_PORT"]
-        db = Mongo(host, port).get_db(short_name)
+        # 企业数据库连接
+        db = MongoRegistry.get_db(short_name)
 
         video_m = Video(db=db)
         if not video_m.is_exist(video_id):
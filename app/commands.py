@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/6
+Last Modified: 2024/12/6
+Description: 命令行任务（flask --app run <命令>）
+"""
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.extentions import mongo
+from app.models.log import RequestLogModel
+from app.models.seed_inventory import SeedInventory
+from app.models.inventory import Inventory
+from app.models.seed_search import SeedSearch
+from app.models.seed import Seed
+from app.models.document_index import DocumentIndex
+from utils.mongo import MongoRegistry
+
+
+request_log_cli = AppGroup("request-log", help="请求日志维护")
+seed_inventory_cli = AppGroup("seed-inventory", help="种子库存汇总维护")
+inventory_cli = AppGroup("inventory", help="仓库库存维护")
+seed_search_cli = AppGroup("seed-search", help="种子搜索索引维护")
+seed_cli = AppGroup("seed", help="种子维护")
+document_index_cli = AppGroup("document-index", help="档案数据索引维护")
+
+
+def get_all_enterprise_dbs():
+    """所有企业数据库"""
+    dbs = []
+    for enterprise in mongo.db.enterprise.find({"db_name": {"$exists": True}}, {"db_name": 1}):
+        dbs.append(MongoRegistry.get_db(enterprise.get("db_name")))
+
+    return dbs
+
+
+def get_all_log_dbs():
+    """所有会写入请求日志的数据库：主库（管理端请求）+ 各企业数据库"""
+    return [mongo.db] + get_all_enterprise_dbs()
+
+
+@request_log_cli.command("compact")
+@click.option("--retention-days", type=int, default=None, help="原始日志保留天数，默认REQUEST_LOG_RETENTION_DAYS")
+def compact_request_log(retention_days):
+    """汇总并删除过期的请求日志表"""
+    if retention_days is None:
+        retention_days = current_app.config["REQUEST_LOG_RETENTION_DAYS"]
+    summary_retention_days = current_app.config["REQUEST_LOG_SUMMARY_RETENTION_DAYS"]
+
+    for db in get_all_log_dbs():
+        dropped = RequestLogModel(db=db).compact(retention_days, summary_retention_days)
+        if dropped:
+            click.echo(f"{db.name}: 汇总并删除 {', '.join(dropped)}")
+
+
+@seed_inventory_cli.command("rebuild")
+@click.option("--db-name", default=None, help="只重建指定的企业数据库，默认全部")
+def rebuild_seed_inventory(db_name):
+    """根据仓库数据重建种子库存汇总"""
+    dbs = [MongoRegistry.get_db(db_name)] if db_name else get_all_enterprise_dbs()
+    for db in dbs:
+        SeedInventory(db=db).rebuild()
+        click.echo(f"{db.name}: 种子库存汇总已重建")
+
+
+@inventory_cli.command("migrate")
+@click.option("--db-name", default=None, help="只迁移指定的企业数据库，默认全部")
+def migrate_inventory(db_name):
+    """把仓库中的inventory_list拆分为库存明细（inventory）"""
+    dbs = [MongoRegistry.get_db(db_name)] if db_name else get_all_enterprise_dbs()
+    for db in dbs:
+        inventory = Inventory(db=db)
+        inventory.ensure_indexes()
+        click.echo(f"{db.name}: 迁移 {inventory.migrate()} 个仓库")
+
+
+@seed_search_cli.command("rebuild")
+@click.option("--db-name", default=None, help="只重建指定的企业数据库，默认全部")
+def rebuild_seed_search(db_name):
+    """根据种子列表和档案种子重建种子搜索索引"""
+    dbs = [MongoRegistry.get_db(db_name)] if db_name else get_all_enterprise_dbs()
+    for db in dbs:
+        count = SeedSearch(db=db).rebuild()
+        click.echo(f"{db.name}: 种子搜索索引已重建，共 {count} 个种子")
+
+
+@seed_cli.command("migrate-parent-ids")
+@click.option("--db-name", default=None, help="只迁移指定的企业数据库，默认全部")
+def migrate_seed_parent_ids(db_name):
+    """根据父本/母本补齐旧版本种子的parent_ids（系谱查询）"""
+    dbs = [MongoRegistry.get_db(db_name)] if db_name else get_all_enterprise_dbs()
+    for db in dbs:
+        Seed(db=db).migrate_parent_ids()
+        click.echo(f"{db.name}: 种子parent_ids已补齐")
+
+
+@document_index_cli.command("sync")
+@click.option("--db-name", default=None, help="只同步指定的企业数据库，默认全部")
+def sync_document_index(db_name):
+    """按档案列配置（searchable/sortable）同步档案数据索引"""
+    dbs = [MongoRegistry.get_db(db_name)] if db_name else get_all_enterprise_dbs()
+    for db in dbs:
+        count = DocumentIndex(db=db).sync_all()
+        click.echo(f"{db.name}: 档案数据索引已同步，共 {count} 个档案")
+
+
+def register_commands(app):
+    app.cli.add_command(request_log_cli)
+    app.cli.add_command(seed_inventory_cli)
+    app.cli.add_command(inventory_cli)
+    app.cli.add_command(seed_search_cli)
+    app.cli.add_command(seed_cli)
+    app.cli.add_command(document_index_cli)
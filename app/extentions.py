@@ -12,7 +12,7 @@ mongo = PyMongo()
 
 
 def get_mongo_client(host, port):
-    from pymongo import MongoClient
+    from utils.mongo import MongoRegistry
 
-    mongodb = MongoClient(host, port)
+    mongodb = MongoRegistry.get_client(host, port)
     return mongodb
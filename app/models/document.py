@@ -6,14 +6,16 @@ Last Modified: 2023/12/8
 Description: 档案模型
 """
 import os
-import json
 
 from flask import current_app
 from bson import ObjectId
+from pymongo import UpdateOne
 import pandas as pd
 
 from .basic import BasicModel
 from .land import Land
+from .seed_search import SeedSearch
+from .document_index import DocumentIndex
 from app.models.qr_code import QRCode
 from utils.dt import DateTime
 
@@ -22,6 +24,9 @@ class Document(BasicModel):
     # 默认6列
     DEFAULT_COLUMNS = ['种子名称', '种子编号', '父本', '母本', '审定', '审定编号']
 
+    # 档案列表只返回列表中展示的字段
+    LIST_PROJECTION = {"document_name": 1, "start_date": 1, "end_date": 1, "land_id": 1}
+
     def __init__(self, req=None, db=None):
         if db is not None:
             super(Document, self).__init__(db=db)
@@ -160,6 +165,9 @@ class Document(BasicModel):
         document_meta.update(self.get_create_meta())
         result = self.db[self.collection_name].insert_one(document_meta)
 
+        # 按列配置创建档案数据索引
+        DocumentIndex(db=self.db).reconcile(str(result.inserted_id), column_config_list)
+
         # 修改引用土地状态为"使用中"
         condition = {"_id": ObjectId(land_id)}
         update_data = {"$set": {"status": "USED"}}
@@ -198,6 +206,9 @@ class Document(BasicModel):
         update_data["$set"].update(update_meta)
         self.db[self.collection_name].update_one(condition, update_data)
 
+        # 列配置变更时同步档案数据索引
+        DocumentIndex(db=self.db).reconcile(document_id, data.get("column_config_list"))
+
         # 如果变更了地图，修改对应土地状态
         new_land_id = data.get("land_id")
         if new_land_id != raw_land_id:
@@ -228,7 +239,7 @@ class Document(BasicModel):
         :param end_date: str. 培育周期，结束时间
         :param land_id: str. 关联土地id
         :param keyword: str. 关键字（档案名称）
-        :return:
+        :return: dict. {'total': 总数, 'list': [档案, ...]}，档案中带有关联土地的名称land_name
         """
         # 查询条件
         condition = {}
@@ -246,10 +257,15 @@ class Document(BasicModel):
 
         start = (page_number - 1) * page_size
 
-        documents = self.db[self.collection_name].find(condition).skip(start).limit(page_size)
+        documents = self.db[self.collection_name].find(condition, self.LIST_PROJECTION).skip(start).limit(page_size)
         total = self.db[self.collection_name].count_documents(condition)
         document_list = list(documents)
 
+        # 关联土地的名称，整页一次查询
+        land_names = Land(db=self.db).get_names_by_ids([d.get("land_id") for d in document_list])
+        for document in document_list:
+            document["land_name"] = land_names.get(document.get("land_id"))
+
         result = {
             "total": total,
             "list": document_list
@@ -346,8 +362,11 @@ class Document(BasicModel):
 
         update_data = {"$set": {"column_config_list": column_config_list}}
         self.db[self.collection_name].update_one({"_id": ObjectId(document_id)}, update_data)
+        DocumentIndex(db=self.db).reconcile(document_id, column_config_list)
 
         # 2.将excel数据，根据列规则写入档案的育种列表中
+        enterprise_id = self.user.get("enterprise_id")
+        qr_code_ready = False
         seed_datas = []
         # 逐行遍历
         for row_idx, row_series in df.iterrows():
@@ -373,30 +392,21 @@ class Document(BasicModel):
             seed_data["excel_id"] = excel_id
             seed_data["excel_name"] = excel_filename
             seed_data.update(self.get_create_meta())
+            qr_code_ready = self.set_qr_code_url(enterprise_id, seed_data)
             seed_datas.append(seed_data)
 
         # 3.批量写入
         result = self.db[self.data_collection_name].insert_many(seed_datas)
         seed_ids = [str(i) for i in result.inserted_ids]
 
-        # 生成二维码
-        enterprise_id = self.user.get("enterprise_id")
-        short_name = f"NZY_{enterprise_id}"
-        for seed_id in seed_ids:
-            # 二维码data
-            qr_code_data = {
-                "type": "SEED",
-                "enterprise_id": enterprise_id,
-                "seed_id": seed_id
-            }
-            qr_code_data_str = json.dumps(qr_code_data)
+        # 种子搜索索引（insert_many已为每条数据补充_id）
+        SeedSearch(db=self.db).save_many(seed_datas, "DOCUMENT")
 
-            qr_code = QRCode(qr_code_data_str, req=self.req)
-            qr_img_id = qr_code.save()
-            api_domain = current_app.config['CLIENT_DOMAIN']
-            download_url = f"{api_domain}/api/v1/image/?image_id={qr_img_id}&short_name={short_name}"
-            # 更新数据库二维码
-            self.db[self.data_collection_name].update_one({"_id": ObjectId(seed_id)}, {"$set": {"二维码": download_url}})
+        # 4.批量生成二维码（按需生成时已填写二维码地址）
+        if qr_code_ready:
+            self.change_import_status(document_id, "IMPORTED")
+        else:
+            self.generate_qr_codes(document_id, enterprise_id, seed_ids)
 
     def export_excel(self, document_id):
         """
@@ -441,6 +451,7 @@ class Document(BasicModel):
         description = document.get("description")
         column_config_list = document.get("column_config_list")
         import_status = document.get("import_status")
+        import_progress = document.get("import_progress")
 
         # 2. 档案数据
         # 查询条件
@@ -488,7 +499,8 @@ class Document(BasicModel):
                 "end_date": end_date,
                 "land": land,
                 "description": description,
-                "import_status": import_status
+                "import_status": import_status,
+                "import_progress": import_progress
             },
             "column_config_list": column_config_list,
             "breeding_list": table_data_list
@@ -628,28 +640,15 @@ class Document(BasicModel):
                 row_data.update(self.get_create_meta())
 
                 # 新建数据
+                qr_code_ready = self.set_qr_code_url(enterprise_id, row_data)
                 result = self.db[self.data_collection_name].insert_one(row_data)
                 seed_id = str(result.inserted_id)
+                SeedSearch(db=self.db).save(result.inserted_id, "DOCUMENT", row_data.get("种子名称"),
+                                            row_data.get("种子编号"))
 
                 # 生成二维码
-                qr_code_data = {
-                    "type": "SEED",
-                    "enterprise_id": enterprise_id,
-                    "seed_id": seed_id
-                }
-                qr_code_data_str = json.dumps(qr_code_data)
-                qr_code = QRCode(qr_code_data_str, req=self.req)
-                qr_img_id = qr_code.save()
-
-                # 返回下载url
-                enterprise_id = self.user.get("enterprise_id")
-                short_name = f"NZY_{enterprise_id}"
-                api_domain = current_app.config['CLIENT_DOMAIN']
-                download_url = f"{api_domain}/api/v1/image/?image_id={qr_img_id}&short_name={short_name}"
-
-                # 更新种子二维码字段
-                update_qrcode = {"$set": {"二维码": download_url}}
-                self.db[self.data_collection_name].update_one({"_id": ObjectId(seed_id)}, update_qrcode)
+                if not qr_code_ready:
+                    self.generate_qr_code(enterprise_id, seed_id)
 
     def save_single_breeding_data(self, document_id, seed_id, seed_data):
         """
@@ -686,6 +685,11 @@ class Document(BasicModel):
             update_row = {"$set": update_data}
             seed_obj_id = ObjectId(seed_id)
             self.db[self.data_collection_name].update_one({"_id": seed_obj_id}, update_row)
+
+            # 修改了种子名称/编号时更新种子搜索索引
+            if "种子名称" in update_data or "种子编号" in update_data:
+                seed = self.db[self.data_collection_name].find_one({"_id": seed_obj_id}, {"种子名称": 1, "种子编号": 1})
+                SeedSearch(db=self.db).save(seed_obj_id, "DOCUMENT", seed.get("种子名称"), seed.get("种子编号"))
         else:
             # 新建育种数据
             seed_data_iters = list(seed_data.items())
@@ -705,10 +709,14 @@ class Document(BasicModel):
             seed_data['document_id'] = document_id
 
             # 写入
+            enterprise_id = self.req.user.get("enterprise_id")
+            qr_code_ready = self.set_qr_code_url(enterprise_id, seed_data)
             result = self.db[self.data_collection_name].insert_one(seed_data)
             inserted_id = str(result.inserted_id)
-            enterprise_id = self.req.user.get("enterprise_id")
-            self.generate_qr_code(enterprise_id, inserted_id)
+            SeedSearch(db=self.db).save(result.inserted_id, "DOCUMENT", seed_data.get("种子名称"),
+                                        seed_data.get("种子编号"))
+            if not qr_code_ready:
+                self.generate_qr_code(enterprise_id, inserted_id)
 
     def change_import_status(self, document_id, status):
         """修改导入状态"""
@@ -732,19 +740,75 @@ class Document(BasicModel):
 
         return False
 
+    @staticmethod
+    def set_qr_code_url(enterprise_id, seed_data):
+        """
+        按需生成二维码时（QR_CODE_LAZY），写入前为种子分配id并填写二维码地址，不生成图片
+
+        :param enterprise_id: str. 企业id
+        :param seed_data: dict. 待写入的种子数据
+        :return: bool. True表示已填写，False表示需要在写入后生成二维码
+        """
+        if not current_app.config.get("QR_CODE_LAZY", True):
+            return False
+
+        seed_data.setdefault("_id", ObjectId())
+        seed_data["二维码"] = QRCode.get_seed_url(enterprise_id, str(seed_data["_id"]))
+        return True
+
+    def generate_qr_codes(self, document_id, enterprise_id, seed_ids):
+        """
+        批量生成二维码（导入excel）
+
+        二维码在进程池中分批渲染，每批图片用一次insert_many写入，种子的二维码字段用一次bulk_write更新。
+        生成过程中档案的import_status为"IMPORTING"，import_progress记录进度，完成后import_status为"IMPORTED"，
+        失败时恢复为生成前的状态。
+
+        :param document_id: str. 档案id
+        :param enterprise_id: str. 企业id
+        :param seed_ids: list. 种子id
+        """
+        short_name = f"NZY_{enterprise_id}"
+        api_domain = current_app.config['CLIENT_DOMAIN']
+        document_condition = {"_id": ObjectId(document_id)}
+
+        qr_code_data_list = [QRCode.make_seed_data(enterprise_id, seed_id) for seed_id in seed_ids]
+
+        done = 0
+        total = len(seed_ids)
+        document = self.db[self.collection_name].find_one(document_condition, {"import_status": 1})
+        status = document.get("import_status") if document else None
+        self.db[self.collection_name].update_one(document_condition, {"$set": {
+            "import_status": "IMPORTING",
+            "import_progress": {"stage": "QR_CODE", "done": done, "total": total}
+        }})
+
+        try:
+            for qr_img_ids in QRCode(db=self.db).save_many(qr_code_data_list):
+                operations = []
+                for seed_id, qr_img_id in zip(seed_ids[done:done + len(qr_img_ids)], qr_img_ids):
+                    download_url = f"{api_domain}/api/v1/image/?image_id={qr_img_id}&short_name={short_name}"
+                    operations.append(UpdateOne({"_id": ObjectId(seed_id)}, {"$set": {"二维码": download_url}}))
+
+                self.db[self.data_collection_name].bulk_write(operations, ordered=False)
+
+                done += len(qr_img_ids)
+                self.db[self.collection_name].update_one(document_condition,
+                                                         {"$set": {"import_progress.done": done}})
+        except BaseException:
+            self.db[self.collection_name].update_one(document_condition, {"$set": {"import_status": status}})
+            raise
+
+        self.db[self.collection_name].update_one(document_condition, {"$set": {"import_status": "IMPORTED"}})
+
     def generate_qr_code(self, enterprise_id, seed_id):
         """
         为某一种子生成二维码
         :return:
         """
         # 生成二维码
-        qr_code_data = {
-            "type": "SEED",
-            "enterprise_id": enterprise_id,
-            "seed_id": seed_id
-        }
-        qr_code_data_str = json.dumps(qr_code_data)
-        qr_code = QRCode(qr_code_data_str, req=self.req)
+        qr_code_data_str = QRCode.make_seed_data(enterprise_id, seed_id)
+        qr_code = QRCode(qr_code_data_str, db=self.db)
         qr_img_id = qr_code.save()
 
         # 返回下载url
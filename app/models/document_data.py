@@ -7,21 +7,41 @@ Description:
 """
 import os
 import json
+import hashlib
 
 from flask import current_app
+import pymongo
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 import pandas as pd
 
 from .basic import BasicModel
 from .land import Land
+from .document import Document
+from .job import Job
 from app.models.qr_code import QRCode
 from utils.dt import DateTime
+from utils.mongo import MongoRegistry
+from utils.excel import download_excel, count_excel_rows, iter_excel_chunks
 
 
 class DocumentDataModel(BasicModel):
     """
     档案数据模型类
     """
+    # 从excel导入档案数据的后台任务类型
+    IMPORT_JOB_TYPE = "DOCUMENT_DATA_IMPORT"
+
+    # 导入类型：追加、覆盖、按关键列合并
+    IMPORT_TYPES = ["APPEND", "COVER", "MERGE"]
+
+    # 合并导入时，关键列的哈希保存在每条数据的此字段中（唯一索引）
+    MERGE_KEY_FIELD = "_merge_key"
+
+    # 合并导入每次bulk_write的数量
+    MERGE_BATCH_SIZE = 1000
+
     def __init__(self, req=None, db=None):
         if db is not None:
             super(DocumentDataModel, self).__init__(db=db)
@@ -49,7 +69,16 @@ class DocumentDataModel(BasicModel):
         if not check_result.get("result"):
             return check_result
 
-        self.db[self.data_name].insert_one(data)
+        # 档案使用过合并导入时，同步关键列哈希（关键列全部为空时为null，不参与合并）
+        key_columns = self._get_merge_key_columns(doc_id)
+        if key_columns:
+            data[self.MERGE_KEY_FIELD] = self.make_merge_key(data, key_columns)
+
+        try:
+            self.db[self.data_name].insert_one(data)
+        except DuplicateKeyError:
+            return self._merge_key_conflict(key_columns)
+
         resp = {"result": True}
         return resp
 
@@ -64,7 +93,7 @@ class DocumentDataModel(BasicModel):
         # 指定写入的表名
         self.data_name = f"data_{doc_id}"
 
-        data = self.db[self.data_name].find_one({"_id": ObjectId(data_id)})
+        data = self.db[self.data_name].find_one({"_id": ObjectId(data_id)}, {self.MERGE_KEY_FIELD: 0})
         return data
 
     def update(self, doc_id, data_id, data):
@@ -87,7 +116,16 @@ class DocumentDataModel(BasicModel):
         if not check_result.get("result"):
             return check_result
 
-        self.db[self.data_name].update_one(condition, update_data)
+        # 档案使用过合并导入时，同步关键列哈希
+        key_columns = self._get_merge_key_columns(doc_id)
+        if key_columns:
+            update_data["$set"] = dict(data, **{self.MERGE_KEY_FIELD: self.make_merge_key(data, key_columns)})
+
+        try:
+            self.db[self.data_name].update_one(condition, update_data)
+        except DuplicateKeyError:
+            return self._merge_key_conflict(key_columns)
+
         resp = {"result": True}
         return resp
 
@@ -98,7 +136,8 @@ class DocumentDataModel(BasicModel):
         condition = {"_id": ObjectId(data_id)}
         self.db[self.data_name].delete_one(condition)
 
-    def query_list(self, doc_id, page_number, page_size, data_index=None, keyword=None):
+    def query_list(self, doc_id, page_number, page_size, data_index=None, keyword=None, sort_index=None,
+                   sort_order=pymongo.ASCENDING):
         """
         查询数据列表
 
@@ -107,6 +146,8 @@ class DocumentDataModel(BasicModel):
         :param page_size: int. 每页数量
         :param data_index: str. 列名，根据哪一列进行匹配
         :param keyword: str. 关键字，用于匹配的值
+        :param sort_index: str. 列名，按哪一列排序（应为已创建索引的列，见DocumentIndex.is_sortable），默认按写入顺序
+        :param sort_order: int. 1升序，-1降序
         :return:
         """
         # 指定写入的表名
@@ -122,7 +163,12 @@ class DocumentDataModel(BasicModel):
 
         start = (page_number - 1) * page_size
 
-        document_datas = self.db[self.data_name].find(condition).skip(start).limit(page_size)
+        projection = {self.MERGE_KEY_FIELD: 0}
+        document_datas = self.db[self.data_name].find(condition, projection)
+        if sort_index:
+            # 值相同的行按_id排序，翻页时顺序稳定
+            document_datas = document_datas.sort([(sort_index, sort_order), ("_id", sort_order)])
+        document_datas = document_datas.skip(start).limit(page_size)
         total = self.db[self.data_name].count_documents(condition)
 
         document_data_list = list(document_datas)
@@ -133,27 +179,51 @@ class DocumentDataModel(BasicModel):
         }
         return result
 
-    def get_all(self, doc_id):
-        """获取全部数据"""
+    def count(self, doc_id):
+        """数据条数"""
+        return self.db[f"data_{doc_id}"].count_documents({})
+
+    def get_all(self, doc_id, batch_size=None):
+        """
+        获取全部数据
+
+        :param doc_id: str. 档案id
+        :param batch_size: int. 游标每次从数据库读取的数量，逐行遍历（导出）时指定
+        :return: cursor.
+        """
         # 指定写入的表名
         self.data_name = f"data_{doc_id}"
 
-        datas = self.db[self.data_name].find({}, {'_id': 0})
+        datas = self.db[self.data_name].find({}, {'_id': 0, self.MERGE_KEY_FIELD: 0}).sort("_id", 1)
+        if batch_size:
+            datas = datas.batch_size(batch_size)
         return datas
 
-    def import_append(self, doc_id, data_list):
+    def iter_labels(self, doc_id):
         """
-        多条数据批量导入(追加)
+        逐行读取二维码标签内容（打印标签）
 
         :param doc_id: str. 档案id
-        :param data_list: list. 档案数据列表
-        :return:
+        :return: generator. (二维码内容（见QRCode.get_document_data_url）, 种子名称, 种子编号)
         """
         # 指定写入的表名
         self.data_name = f"data_{doc_id}"
 
-        datas = self.db[self.data_name].insert_many(data_list)
-        return datas
+        projection = {"种子名称": 1, "种子编号": 1}
+        datas = self.db[self.data_name].find({}, projection).sort("_id", 1)
+        for data in datas:
+            qr_code_data = QRCode.get_document_data_url(doc_id, str(data.get("_id")))
+            yield qr_code_data, data.get("种子名称"), data.get("种子编号")
+
+    def import_append(self, doc_id, data_list):
+        """
+        多条数据批量导入(追加)
+
+        :param doc_id: str. 档案id
+        :param data_list: list. 档案数据列表
+        :return: int. 导入数量
+        """
+        return self.import_chunks(doc_id, [data_list])
 
     def import_cover(self, doc_id, data_list):
         """
@@ -161,16 +231,325 @@ class DocumentDataModel(BasicModel):
 
         :param doc_id: str. 档案id
         :param data_list: list. 档案数据列表
-        :return:
+        :return: int. 导入数量
+        """
+        return self.import_chunks(doc_id, [data_list], cover=True)
+
+    def import_chunks(self, doc_id, chunks, cover=False, on_chunk=None, staging_id=None):
+        """
+        分块导入，每块一次insert_many（不要求顺序，单条失败不影响其他数据写入）
+
+        覆盖导入先写入临时集合data_{doc_id}_staging_{staging_id}，写完后创建与原集合相同的索引，
+        再用renameCollection(dropTarget=True)原子替换原集合：
+            1. 导入过程中查询看到的始终是完整的旧数据，替换后立即看到完整的新数据；
+            2. 不需要逐条删除旧数据，替换的耗时与数据量无关；
+            3. 导入失败或取消时删除临时集合，原数据不变。
+        导入期间对原集合的修改（例如手动添加的数据）会随原集合一起被替换。
+        临时集合按导入区分，不会删除或写入其他导入的临时集合；异常退出遗留的临时集合见drop_staging_collections。
+
+        :param doc_id: str. 档案id
+        :param chunks: iterable. 每块为档案数据列表，可以是生成器（例如iter_excel_chunks）
+        :param cover: bool. True时替换原有数据
+        :param on_chunk: function. 每块写入后调用，参数为已导入数量（后台任务更新进度、检查取消）
+        :param staging_id: str. 临时集合名后缀（后台任务为任务id），默认新生成
+        :return: int. 导入数量
         """
         # 指定写入的表名
         self.data_name = f"data_{doc_id}"
 
-        # 清空表
-        self.db[self.data_name].delete_many({})
+        if not cover:
+            return self._insert_chunks(self.data_name, chunks, on_chunk)
 
-        datas = self.db[self.data_name].insert_many(data_list)
-        return datas
+        staging_name = self.get_staging_name(doc_id, staging_id or str(ObjectId()))
+        staging = self.db[staging_name]
+        self.db.create_collection(staging_name)
+        try:
+            count = self._insert_chunks(staging_name, chunks, on_chunk)
+
+            # 数据写完后再建索引（比逐条写入时维护索引快）
+            self._copy_indexes(self.data_name, staging_name)
+            staging.rename(self.data_name, dropTarget=True)
+        except BaseException:
+            staging.drop()
+            raise
+
+        return count
+
+    @staticmethod
+    def get_staging_name(doc_id, staging_id):
+        """覆盖导入的临时集合名"""
+        return f"data_{doc_id}_staging_{staging_id}"
+
+    def drop_staging_collections(self, doc_id):
+        """
+        删除档案所有覆盖导入的临时集合（异常退出遗留的），只能在档案没有其他执行中的导入时调用
+
+        :return: list. 删除的集合名
+        """
+        prefix = f"data_{doc_id}_staging"
+        names = [name for name in self.db.list_collection_names() if name.startswith(prefix)]
+        for name in names:
+            self.db.drop_collection(name)
+        return names
+
+    def _insert_chunks(self, collection_name, chunks, on_chunk=None):
+        count = 0
+        for data_list in chunks:
+            if not data_list:
+                continue
+
+            self.db[collection_name].insert_many(data_list, ordered=False)
+            count += len(data_list)
+            if on_chunk is not None:
+                on_chunk(count)
+
+        return count
+
+    def _copy_indexes(self, source_name, target_name):
+        """在target集合上创建与source集合相同的索引（_id除外），source不存在时不创建"""
+        index_models = []
+        for name, info in self.db[source_name].index_information().items():
+            if name == "_id_":
+                continue
+
+            options = {k: v for k, v in info.items() if k not in ("key", "v", "ns")}
+            index_models.append(pymongo.IndexModel(info["key"], name=name, **options))
+
+        if index_models:
+            self.db[target_name].create_indexes(index_models)
+
+    @staticmethod
+    def make_merge_key(data, key_columns):
+        """
+        关键列的哈希
+
+        值统一转为去掉首尾空白的字符串（excel中的数字123与手动填写的"123"相同，1.0与1相同）。
+
+        :return: str or None. 关键列全部为空时返回None
+        """
+        values = []
+        for column in key_columns:
+            value = data.get(column)
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            values.append("" if value is None else str(value).strip())
+
+        if not any(values):
+            return None
+
+        return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _get_merge_key_columns(self, doc_id):
+        """档案最近一次合并导入使用的关键列，没有使用过合并导入时为None"""
+        document = self.db[self.document_name].find_one({"_id": ObjectId(doc_id)}, {"merge_key_columns": 1})
+        return (document or {}).get("merge_key_columns")
+
+    @staticmethod
+    def _merge_key_conflict(key_columns):
+        resp = {
+            "result": False,
+            "desc": f"关键列（{'，'.join(key_columns)}）的值与已有数据重复。"
+        }
+        return resp
+
+    def _prepare_merge_key(self, doc_id, key_columns):
+        """
+        合并导入前，为还没有哈希的数据（追加/覆盖导入、合并之前的数据）计算关键列哈希，并确保唯一索引存在
+
+        说明：
+            1. 唯一索引只包含哈希为字符串的数据；关键列全部为空、或与已有数据重复的，哈希置为null，
+               保留但不参与合并，之后的合并导入不再重复计算。
+            2. 关键列变化时，全部数据重新计算。
+
+        :return: int. 本次新发现的关键列重复（或全部为空）的数量
+        """
+        collection = self.db[self.data_name]
+
+        if self._get_merge_key_columns(doc_id) != key_columns:
+            collection.update_many({self.MERGE_KEY_FIELD: {"$exists": True}}, {"$unset": {self.MERGE_KEY_FIELD: ""}})
+            self.db[self.document_name].update_one({"_id": ObjectId(doc_id)},
+                                                   {"$set": {"merge_key_columns": key_columns}})
+
+        collection.create_index(self.MERGE_KEY_FIELD, name=self.MERGE_KEY_FIELD, unique=True,
+                                partialFilterExpression={self.MERGE_KEY_FIELD: {"$type": "string"}})
+
+        skipped = 0
+        projection = dict.fromkeys(key_columns, 1)
+        datas = collection.find({self.MERGE_KEY_FIELD: {"$exists": False}}, projection).sort("_id", pymongo.ASCENDING)
+
+        def flush(data_ids, operations):
+            """写入哈希，与已有数据重复的（唯一索引冲突）改为null"""
+            try:
+                collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in write_errors):
+                    raise
+
+                duplicated_ids = [data_ids[error["index"]] for error in write_errors]
+                collection.update_many({"_id": {"$in": duplicated_ids}}, {"$set": {self.MERGE_KEY_FIELD: None}})
+                return len(duplicated_ids)
+            return 0
+
+        data_ids, operations = [], []
+        for data in datas:
+            merge_key = self.make_merge_key(data, key_columns)
+            if merge_key is None:
+                skipped += 1
+            data_ids.append(data["_id"])
+            operations.append(UpdateOne({"_id": data["_id"]}, {"$set": {self.MERGE_KEY_FIELD: merge_key}}))
+            if len(operations) >= self.MERGE_BATCH_SIZE:
+                skipped += flush(data_ids, operations)
+                data_ids, operations = [], []
+
+        if operations:
+            skipped += flush(data_ids, operations)
+
+        return skipped
+
+    def import_merge(self, doc_id, chunks, key_columns, on_chunk=None):
+        """
+        合并导入：按关键列匹配，已有的数据更新，没有的数据新增，excel中没有的数据保留
+
+        每块一次不要求顺序的bulk_write(UpdateOne(upsert=True))，匹配条件为关键列哈希（唯一索引）。
+        值没有变化的数据数据库不会写入，每天重复导入时只修改有变化的数据。
+
+        :param doc_id: str. 档案id
+        :param chunks: iterable. 每块为档案数据列表
+        :param key_columns: list. 关键列，档案配置中的列名
+        :param on_chunk: function. 每块写入后调用，参数为已处理数量
+        :return: dict. {'rows': excel行数, 'inserted': 新增, 'updated': 修改, 'unchanged': 未变化,
+                        'skipped': excel中关键列为空的行数, 'duplicated': excel中关键列重复的行数（后面的行生效）,
+                        'existing_duplicated': 已有数据中关键列重复、未参与合并的数量}
+        """
+        # 指定写入的表名
+        self.data_name = f"data_{doc_id}"
+        collection = self.db[self.data_name]
+
+        result = dict.fromkeys(["rows", "inserted", "updated", "unchanged", "skipped", "duplicated"], 0)
+        result["existing_duplicated"] = self._prepare_merge_key(doc_id, key_columns)
+
+        for data_list in chunks:
+            # 同一块中关键列重复的行，后面的行生效
+            rows = {}
+            for data in data_list:
+                merge_key = self.make_merge_key(data, key_columns)
+                if merge_key is None:
+                    result["skipped"] += 1
+                    continue
+                if merge_key in rows:
+                    result["duplicated"] += 1
+                rows[merge_key] = data
+
+            result["rows"] += len(data_list)
+            if rows:
+                operations = [
+                    UpdateOne({self.MERGE_KEY_FIELD: merge_key},
+                              {"$set": dict(data, **{self.MERGE_KEY_FIELD: merge_key})}, upsert=True)
+                    for merge_key, data in rows.items()
+                ]
+                bulk_result = collection.bulk_write(operations, ordered=False)
+                result["inserted"] += bulk_result.upserted_count
+                result["updated"] += bulk_result.modified_count
+                result["unchanged"] += bulk_result.matched_count - bulk_result.modified_count
+
+            if on_chunk is not None:
+                on_chunk(result["rows"])
+
+        return result
+
+    @classmethod
+    def run_import_job(cls, context):
+        """
+        后台任务：从excel导入档案数据（JobWorker调用，任务类型IMPORT_JOB_TYPE）
+
+        执行期间档案的import_status为"IMPORTING"，import_progress与任务进度相同；
+        成功后为"IMPORTED"，失败或取消时恢复为导入前的状态。
+        取消时追加导入已写入的前几块数据保留，覆盖导入不改变原数据（见import_chunks）。
+
+        档案的import_job记录当前导入任务id和导入前的状态：恢复状态时以import_job.job_id为条件，
+        任务被标记失败（见recover_import_job）后其他任务开始导入时，原任务不会覆盖其他任务设置的状态。
+
+        :param context: utils.job.JobContext. 参数{'document_id', 'excel_url', 'import_type', 'key_columns'}
+        """
+        params = context.params
+        document_id = params.get("document_id")
+        db = MongoRegistry.get_db(f"NZY_{context.job.get('enterprise_id')}")
+
+        document_model = Document(db=db)
+        document = document_model.get(document_id)
+        if not document:
+            raise Exception("档案不存在")
+
+        column_config_list = document.get("column_config_list") or []
+        column_names = [c.get("dataIndex") for c in column_config_list]
+        chunk_size = current_app.config.get("IMPORT_CHUNK_SIZE", 1000)
+        # 只修改本任务设置的导入状态
+        document_condition = {"_id": ObjectId(document_id), "import_job.job_id": context.job_id}
+        collection = db[document_model.collection_name]
+
+        def update_progress(done, total):
+            collection.update_one(document_condition, {"$set": {
+                "import_progress": {"stage": "DATA", "done": done, "total": total}
+            }})
+            context.update_progress("DATA", done, total)
+
+        status = document.get("import_status")
+        collection.update_one({"_id": ObjectId(document_id)}, {"$set": {
+            "import_status": "IMPORTING",
+            "import_job": {"job_id": context.job_id, "status": status}
+        }})
+        try:
+            # 下载和统计行数期间没有进度，定期更新heartbeat
+            with download_excel(params.get("excel_url"), on_chunk=context.heartbeat) as excel_file:
+                context.heartbeat()
+                total = count_excel_rows(excel_file)
+                update_progress(0, total)
+
+                chunks = iter_excel_chunks(excel_file, column_names, chunk_size)
+                on_chunk = lambda done: update_progress(done, total)
+                import_type = params.get("import_type")
+                if import_type == "MERGE":
+                    result = cls(db=db).import_merge(document_id, chunks, params.get("key_columns"), on_chunk)
+                else:
+                    # 遗留的临时集合只在档案没有其他导入任务时删除（不依赖提交时的检查）
+                    if import_type == "COVER" and not Job().get_active(
+                            cls.IMPORT_JOB_TYPE, context.job.get("enterprise_id"), document_id, context.job_id):
+                        cls(db=db).drop_staging_collections(document_id)
+
+                    count = cls(db=db).import_chunks(document_id, chunks, cover=import_type == "COVER",
+                                                     on_chunk=on_chunk, staging_id=context.job_id)
+                    result = {"rows": count}
+        except BaseException:
+            collection.update_one(document_condition, {"$set": {"import_status": status}})
+            raise
+
+        collection.update_one(document_condition, {"$set": {
+            "import_status": "IMPORTED",
+            "import_progress": {"stage": "DATA", "done": result["rows"], "total": result["rows"]}
+        }})
+        context.result = result
+
+    @classmethod
+    def recover_import_job(cls, job):
+        """
+        导入任务被标记失败（执行任务的worker异常退出）时，恢复档案导入前的状态（JobWorker调用）
+
+        :param job: dict. 任务
+        """
+        job_id = str(job.get("_id"))
+        document_id = (job.get("params") or {}).get("document_id")
+        db = MongoRegistry.get_db(f"NZY_{job.get('enterprise_id')}")
+
+        # 覆盖导入的临时集合
+        db.drop_collection(cls.get_staging_name(document_id, job_id))
+
+        collection = db[Document(db=db).collection_name]
+        condition = {"_id": ObjectId(document_id), "import_job.job_id": job_id}
+        document = collection.find_one(condition, {"import_job": 1})
+        if document:
+            status = document.get("import_job", {}).get("status")
+            collection.update_one(dict(condition, import_status="IMPORTING"), {"$set": {"import_status": status}})
 
     def _check_data_index(self, doc_id, data):
         """
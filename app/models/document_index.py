@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/20
+Last Modified: 2024/12/20
+Description: 档案数据索引（按档案列配置为data_{doc_id}创建索引）
+"""
+import pymongo
+from flask import current_app
+from pymongo.errors import OperationFailure
+
+from .basic import BasicModel
+
+
+class DocumentIndex(BasicModel):
+    """
+    档案数据索引管理
+
+    列配置中标记了searchable（按此列搜索）或sortable（按此列排序）的列，在data_{doc_id}上创建单列索引，
+    索引名为INDEX_PREFIX + 列名。
+
+    说明：
+        1. 修改档案列配置时同步（reconcile）：新增标记的列创建索引，取消标记或删除的列删除索引。
+           只管理INDEX_PREFIX开头的索引，_id和合并导入的_merge_key索引不受影响。
+        2. 每个档案最多DOCUMENT_DATA_MAX_INDEXES个列索引（按列配置顺序），超出的列不创建，在同步结果中返回。
+        3. 覆盖导入替换集合时复制原集合的索引（见DocumentDataModel.import_chunks），不需要重新同步。
+        4. 已有档案执行flask document-index sync同步。
+    """
+    INDEX_PREFIX = "col_"
+
+    def __init__(self, req=None, db=None):
+        if db is not None:
+            super(DocumentIndex, self).__init__(db=db)
+        else:
+            super(DocumentIndex, self).__init__(req=req)
+
+        self.document_collection_name = "document"
+
+    @staticmethod
+    def get_max_indexes():
+        return current_app.config.get("DOCUMENT_DATA_MAX_INDEXES", 10)
+
+    @classmethod
+    def get_index_name(cls, column):
+        return f"{cls.INDEX_PREFIX}{column}"
+
+    @classmethod
+    def get_indexed_columns(cls, column_config_list):
+        """
+        需要创建索引的列
+
+        :param column_config_list: list. 档案列配置
+        :return: tuple. (创建索引的列, 超出数量上限未创建的列)
+        """
+        columns = []
+        for column_config in column_config_list or []:
+            column = column_config.get("dataIndex")
+            if not column or column in columns:
+                continue
+            if column_config.get("searchable") or column_config.get("sortable"):
+                columns.append(column)
+
+        max_indexes = cls.get_max_indexes()
+        return columns[:max_indexes], columns[max_indexes:]
+
+    @classmethod
+    def is_sortable(cls, column_config_list, column):
+        """列是否允许排序：标记了sortable且已创建索引（超出上限的列排序需要在内存中排序全部数据，不允许）"""
+        sortable = any(c.get("dataIndex") == column and c.get("sortable") for c in column_config_list or [])
+        return sortable and column in cls.get_indexed_columns(column_config_list)[0]
+
+    def _get_managed_indexes(self, collection):
+        """已创建的列索引，{索引名: 列名}"""
+        managed = {}
+        for name, info in collection.index_information().items():
+            if name.startswith(self.INDEX_PREFIX):
+                managed[name] = list(info["key"])[0][0]
+        return managed
+
+    def reconcile(self, doc_id, column_config_list):
+        """
+        按列配置同步索引
+
+        :param doc_id: str. 档案id
+        :param column_config_list: list. 档案列配置
+        :return: dict. {'created': [列名], 'dropped': [列名], 'skipped': [超出数量上限的列名]}
+        """
+        collection = self.db[f"data_{doc_id}"]
+        columns, skipped = self.get_indexed_columns(column_config_list)
+
+        managed = self._get_managed_indexes(collection)
+        expected = {self.get_index_name(column): column for column in columns}
+
+        dropped = []
+        for name, column in managed.items():
+            if expected.get(name) != column:
+                collection.drop_index(name)
+                dropped.append(column)
+
+        created = []
+        index_models = []
+        for name, column in expected.items():
+            if managed.get(name) != column:
+                index_models.append(pymongo.IndexModel([(column, pymongo.ASCENDING)], name=name))
+                created.append(column)
+
+        if index_models:
+            collection.create_indexes(index_models)
+
+        result = {"created": created, "dropped": dropped, "skipped": skipped}
+        return result
+
+    def get_usage(self, doc_id, column_config_list):
+        """
+        索引使用情况（$indexStats，每个mongod进程重启后重新计数）
+
+        :return: dict. {'max_indexes': 上限, 'skipped': [超出上限未创建索引的列],
+                        'indexes': [{'name', 'columns', 'managed', 'ops', 'since'}, ...]}
+        """
+        collection = self.db[f"data_{doc_id}"]
+
+        stats = {}
+        try:
+            for item in collection.aggregate([{"$indexStats": {}}]):
+                accesses = item.get("accesses") or {}
+                stats[item.get("name")] = {"ops": accesses.get("ops"), "since": accesses.get("since")}
+        except (OperationFailure, NotImplementedError):
+            # 没有权限或不支持$indexStats时，只返回索引列表
+            pass
+
+        indexes = []
+        for name, info in collection.index_information().items():
+            usage = stats.get(name, {})
+            since = usage.get("since")
+            indexes.append({
+                "name": name,
+                "columns": [key for key, _ in info["key"]],
+                "managed": name.startswith(self.INDEX_PREFIX),
+                "ops": usage.get("ops"),
+                "since": since.strftime("%Y-%m-%d %H:%M:%S") if since else None
+            })
+
+        usage = {
+            "max_indexes": self.get_max_indexes(),
+            "skipped": self.get_indexed_columns(column_config_list)[1],
+            "indexes": indexes
+        }
+        return usage
+
+    def sync_all(self):
+        """
+        按列配置同步所有档案的索引
+
+        :return: int. 档案数量
+        """
+        count = 0
+        for document in self.db[self.document_collection_name].find({}, {"column_config_list": 1}):
+            self.reconcile(str(document.get("_id")), document.get("column_config_list"))
+            count += 1
+        return count
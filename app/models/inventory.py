@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/11
+Last Modified: 2024/12/11
+Description: 仓库库存明细
+"""
+import re
+import threading
+
+import pymongo
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne, DeleteOne
+
+from .basic import BasicModel
+from .seed_inventory import SeedInventory
+
+
+class Inventory(BasicModel):
+    """
+    仓库库存明细，集合inventory，每个(仓库, 种子)一条：
+        {
+            'stash_id': '仓库id',
+            'seed_id': '种子id',
+            'seed_name': 种子名称,
+            'seed_code': 种子编号,
+            'quantity': 数量,
+            'weight': 重量
+        }
+
+    说明：
+        1. 旧版本库存保存在仓库的inventory_list数组中，每个进程首次使用某个数据库的库存时迁移（见ensure_ready、migrate），
+           也可以部署后执行flask inventory migrate提前迁移。
+        2. 种子名称/编号冗余保存，用于按关键字搜索；修改种子时同步更新。
+        3. 库存变化同时更新种子库存汇总（SeedInventory）。
+    """
+    # 每个进程已创建过索引的数据库，{db_name}
+    _ready_dbs = set()
+    _ready_lock = threading.Lock()
+
+    def __init__(self, req=None, db=None):
+        if db is not None:
+            super(Inventory, self).__init__(db=db)
+        else:
+            super(Inventory, self).__init__(req=req)
+
+        self.collection_name = "inventory"
+        self.stash_collection_name = "stash"
+        self.seed_collection_name = "seed"
+        self.document_data_collection_name = "document_data"
+
+    def ensure_indexes(self):
+        self.db[self.collection_name].create_indexes([
+            pymongo.IndexModel([("stash_id", pymongo.ASCENDING), ("seed_id", pymongo.ASCENDING)], unique=True),
+            pymongo.IndexModel([("seed_id", pymongo.ASCENDING), ("stash_id", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("stash_id", pymongo.ASCENDING), ("seed_name", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("stash_id", pymongo.ASCENDING), ("seed_code", pymongo.ASCENDING)]),
+        ])
+
+    def ensure_ready(self):
+        """创建索引、迁移还没有迁移的旧版本库存，每个进程每个数据库只执行一次"""
+        if self.db.name in self._ready_dbs:
+            return
+
+        self.ensure_indexes()
+        self.migrate()
+
+        with self._ready_lock:
+            self._ready_dbs.add(self.db.name)
+
+    def _get_seed_names(self, seed_ids):
+        """
+        批量获取种子名称和编号（种子列表 + 档案种子）
+
+        :return: dict. {'seed_id': {'seed_name': str, 'seed_code': str}}
+        """
+        object_ids = [ObjectId(i) for i in set(seed_ids) if self.is_id_format_right(i)]
+
+        names = {}
+        projection = {"种子名称": 1, "种子编号": 1}
+        for collection_name in (self.seed_collection_name, self.document_data_collection_name):
+            missing_ids = [i for i in object_ids if str(i) not in names]
+            if not missing_ids:
+                break
+
+            for seed in self.db[collection_name].find({"_id": {"$in": missing_ids}}, projection):
+                names[str(seed.get("_id"))] = {"seed_name": seed.get("种子名称"), "seed_code": seed.get("种子编号")}
+
+        return names
+
+    def is_seed_exist(self, seed_id):
+        """种子是否存在（种子列表或档案种子）"""
+        return bool(self._get_seed_names([seed_id]))
+
+    def get_stash_rows(self, stash_id):
+        """仓库中所有库存记录"""
+        condition = {"stash_id": str(stash_id)}
+        projection = {"_id": 0, "seed_id": 1, "quantity": 1, "weight": 1}
+        return list(self.db[self.collection_name].find(condition, projection))
+
+    def get_stash_seed_ids(self, stash_id):
+        """仓库中所有种子的id"""
+        return self.db[self.collection_name].distinct("seed_id", {"stash_id": str(stash_id)})
+
+    def get_inventory_list(self, stash_id):
+        """
+        仓库库存（仓库详情使用）
+
+        :return: list. [{'seed_id', 'name', 'code', 'quantity', 'weight'}, ...]
+        """
+        rows = self.db[self.collection_name].find({"stash_id": str(stash_id)}).sort("_id", pymongo.ASCENDING)
+        inventory_list = [
+            {
+                "seed_id": row.get("seed_id"),
+                "name": row.get("seed_name"),
+                "code": row.get("seed_code"),
+                "quantity": row.get("quantity"),
+                "weight": row.get("weight")
+            }
+            for row in rows
+        ]
+        return inventory_list
+
+    def replace_stash(self, stash_id, stash_name, inventory_list):
+        """
+        用仓库表单中的inventory_list替换仓库库存（创建/修改仓库）
+
+        只写入有变化的记录，同一种子出现多次时数量、重量累加。
+
+        :param stash_id: str. 仓库id
+        :param stash_name: str. 仓库名称
+        :param inventory_list: list. [{'seed_id': str, 'quantity': int, 'weight': float}, ...]
+        """
+        stash_id = str(stash_id)
+        old_rows = self.get_stash_rows(stash_id)
+        old_summary = SeedInventory.summarize(old_rows)
+        new_summary = SeedInventory.summarize(inventory_list)
+        seed_names = self._get_seed_names([i for i in new_summary if i not in old_summary])
+
+        operations = []
+        for seed_id in old_summary.keys() - new_summary.keys():
+            operations.append(DeleteOne({"stash_id": stash_id, "seed_id": seed_id}))
+
+        for seed_id, item in new_summary.items():
+            old_item = old_summary.get(seed_id)
+            if old_item and (old_item["quantity"], old_item["weight"]) == (item["quantity"], item["weight"]):
+                continue
+
+            update_data = {"$set": {"quantity": item["quantity"], "weight": item["weight"]}}
+            if not old_item:
+                update_data["$set"].update(seed_names.get(seed_id, {"seed_name": None, "seed_code": None}))
+
+            operations.append(UpdateOne({"stash_id": stash_id, "seed_id": seed_id}, update_data, upsert=True))
+
+        if operations:
+            self.db[self.collection_name].bulk_write(operations, ordered=False)
+
+        new_rows = [dict(item, seed_id=seed_id) for seed_id, item in new_summary.items()]
+        SeedInventory(db=self.db).apply_change(stash_id, stash_name, old_rows, new_rows)
+
+    def delete_stash(self, stash_id):
+        """删除仓库的全部库存"""
+        stash_id = str(stash_id)
+        old_rows = self.get_stash_rows(stash_id)
+        self.db[self.collection_name].delete_many({"stash_id": stash_id})
+        SeedInventory(db=self.db).apply_change(stash_id, None, old_rows, [])
+
+    def adjust(self, stash_id, stash_name, seed_id, quantity=0, weight=0):
+        """
+        入库/出库（原子操作）
+
+        :param quantity: int. 数量变化，入库为正数，出库为负数
+        :param weight: float. 重量变化，入库为正数，出库为负数
+        :return: dict or None. 调整后的库存记录；出库时库存不足（或仓库中没有该种子）返回None
+        """
+        stash_id = str(stash_id)
+        condition = {"stash_id": stash_id, "seed_id": seed_id}
+        stock_out = quantity < 0 or weight < 0
+
+        if stock_out:
+            # 库存充足才扣减
+            condition.update({"quantity": {"$gte": -quantity}, "weight": {"$gte": -weight}})
+            row = self.db[self.collection_name].find_one_and_update(
+                condition, {"$inc": {"quantity": quantity, "weight": weight}},
+                return_document=ReturnDocument.AFTER
+            )
+            if row is None:
+                return None
+            is_new = False
+        else:
+            # 仓库中没有该种子时新建记录
+            seed_name = self._get_seed_names([seed_id]).get(seed_id, {"seed_name": None, "seed_code": None})
+            update_data = {"$inc": {"quantity": quantity, "weight": weight}, "$setOnInsert": seed_name}
+            raw_row = self.db[self.collection_name].find_one_and_update(
+                condition, update_data, upsert=True, return_document=ReturnDocument.BEFORE
+            )
+            is_new = raw_row is None
+            row = dict(condition, **seed_name, quantity=0, weight=0) if is_new else raw_row
+            row["quantity"] += quantity
+            row["weight"] += weight
+
+        SeedInventory(db=self.db).adjust(stash_id, stash_name, seed_id, quantity, weight, is_new)
+        return row
+
+    def update_seed_info(self, seed_id, seed_name, seed_code):
+        """修改种子名称/编号时，同步库存记录"""
+        self.db[self.collection_name].update_many(
+            {"seed_id": str(seed_id)}, {"$set": {"seed_name": seed_name, "seed_code": seed_code}}
+        )
+
+    def query_list(self, pn, pz, stash_id, keyword=None):
+        """
+        仓库库存列表（分页、关键字搜索在数据库中完成）
+
+        :param pn: int. 当前页数
+        :param pz: int. 每页数量
+        :param stash_id: str. 仓库id
+        :param keyword: str. 关键字（种子名称/种子编号）
+        :return: dict. {'total': int, 'list': [{'种子名称', '种子编号', 'quantity', 'weight'}, ...]}
+        """
+        condition = {"stash_id": str(stash_id)}
+        if keyword:
+            pattern = re.escape(keyword)
+            condition["$or"] = [{"seed_name": {"$regex": pattern}}, {"seed_code": {"$regex": pattern}}]
+
+        start = (pn - 1) * pz
+        rows = self.db[self.collection_name].find(condition).sort("_id", pymongo.ASCENDING).skip(start).limit(pz)
+        total = self.db[self.collection_name].count_documents(condition)
+
+        seed_list = [
+            {
+                "种子名称": row.get("seed_name"),
+                "种子编号": row.get("seed_code"),
+                "quantity": row.get("quantity"),
+                "weight": row.get("weight")
+            }
+            for row in rows
+        ]
+        return {"total": total, "list": seed_list}
+
+    def migrate_stash(self, stash):
+        """
+        把一个仓库的inventory_list拆分为库存记录，完成后删除inventory_list
+
+        库存记录只在不存在时写入（$setOnInsert），不覆盖已有的记录；库存汇总只累加本次新写入的记录。
+        多个进程同时迁移同一个仓库时，每条记录只有一个进程写入，结果与只迁移一次相同。
+
+        :param stash: dict. 仓库，包含_id、name、inventory_list
+        """
+        stash_id = str(stash.get("_id"))
+        summary = SeedInventory.summarize(stash.get("inventory_list"))
+        seed_names = self._get_seed_names(list(summary.keys()))
+
+        rows = {}
+        operations = []
+        for seed_id, item in summary.items():
+            row = {"quantity": item["quantity"], "weight": item["weight"]}
+            row.update(seed_names.get(seed_id, {"seed_name": None, "seed_code": None}))
+            rows[seed_id] = dict(row, seed_id=seed_id)
+            operations.append(UpdateOne({"stash_id": stash_id, "seed_id": seed_id}, {"$setOnInsert": row}, upsert=True))
+
+        if operations:
+            result = self.db[self.collection_name].bulk_write(operations, ordered=False)
+            # 按新写入记录的_id查出种子id（已存在的记录不计入汇总）
+            inserted = self.db[self.collection_name].find(
+                {"_id": {"$in": list(result.upserted_ids.values())}}, {"seed_id": 1}
+            )
+            inserted_rows = [rows[item.get("seed_id")] for item in inserted]
+            SeedInventory(db=self.db).apply_change(stash_id, stash.get("name"), [], inserted_rows)
+
+        self.db[self.stash_collection_name].update_one(
+            {"_id": stash.get("_id"), "inventory_list": {"$exists": True}}, {"$unset": {"inventory_list": ""}}
+        )
+
+    def migrate(self):
+        """
+        迁移所有还保存inventory_list的仓库（见migrate_stash），可重复执行
+
+        由ensure_ready或命令flask inventory migrate执行。
+
+        :return: int. 迁移的仓库数
+        """
+        stash_count = 0
+        stashes = self.db[self.stash_collection_name].find({"inventory_list": {"$exists": True}},
+                                                           {"name": 1, "inventory_list": 1})
+        for stash in stashes:
+            self.migrate_stash(stash)
+            stash_count += 1
+
+        return stash_count
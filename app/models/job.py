@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/19
+Last Modified: 2024/12/19
+Description: 后台任务（例如excel导入）
+"""
+import os
+import socket
+import datetime
+import threading
+
+import pymongo
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from .basic import BasicModel
+from app.extentions import mongo
+from utils.dt import DateTime
+
+
+class Job(BasicModel):
+    """
+    后台任务，保存在主库jobs集合，所有worker共享：
+        {
+            'job_type': 任务类型，例如'DOCUMENT_DATA_IMPORT',
+            'enterprise_id': 企业id,
+            'user_id': 提交任务的用户id,
+            'params': 任务参数,
+            'status': 'PENDING'/'RUNNING'/'SUCCESS'/'FAILED'/'CANCELLED',
+            'cancel_requested': 是否已请求取消,
+            'active_key': 等待中/执行中时设置，唯一索引，同一active_key同时只能有一个任务（结束时删除）,
+            'progress': {'stage': 阶段, 'done': 已处理行数, 'total': 总行数（未知时为None）},
+            'result': 任务结果,
+            'errors': [错误信息, ...],
+            'worker': 执行任务的'主机名:进程id',
+            'heartbeat': 最近一次更新进度的时间（UTC）,
+            'create_time'/'start_time'/'end_time': 北京时间字符串
+        }
+
+    说明：
+        1. 任务由JobWorker（utils.job）的后台线程领取执行，领取用find_one_and_update，同一任务只会被一个worker执行。
+        2. 同一对象（例如同一档案）同时只能有一个任务：提交时设置active_key，由唯一索引保证，
+           重复提交时create抛出DuplicateKeyError；任务结束、取消或标记失败时删除active_key。
+        3. 取消只是设置cancel_requested，执行中的任务在两块数据之间检查并退出。
+        4. 执行任务的worker异常退出时任务停留在RUNNING，heartbeat超过stale_seconds后标记为FAILED（不自动重试，
+           追加导入重复执行会产生重复数据）。
+        5. 更新进度和结束任务都以{'status': RUNNING, 'worker': 本worker}为条件：任务被标记失败后，原执行线程如果仍在执行，
+           下次更新进度时停止，也不会覆盖FAILED。
+    """
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    SUCCESS = "SUCCESS"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+
+    ACTIVE_STATUSES = [PENDING, RUNNING]
+
+    # 最多记录的错误条数
+    MAX_ERRORS = 20
+
+    # 每个进程只创建一次索引
+    _indexed = False
+    _indexed_lock = threading.Lock()
+
+    def __init__(self, req=None, db=None):
+        super(Job, self).__init__(db=db if db is not None else mongo.db, req=req)
+        self.collection_name = "jobs"
+
+    def ensure_indexes(self):
+        if Job._indexed:
+            return
+
+        self.db[self.collection_name].create_indexes([
+            pymongo.IndexModel([("status", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("enterprise_id", pymongo.ASCENDING), ("params.document_id", pymongo.ASCENDING),
+                                ("status", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("active_key", pymongo.ASCENDING)], name="active_key", unique=True, sparse=True),
+        ])
+
+        with Job._indexed_lock:
+            Job._indexed = True
+
+    @staticmethod
+    def get_worker_name():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def to_dict(job):
+        """返回给前端的任务信息"""
+        job_data = {
+            "id": str(job.get("_id")),
+            "job_type": job.get("job_type"),
+            "status": job.get("status"),
+            "cancel_requested": job.get("cancel_requested", False),
+            "progress": job.get("progress"),
+            "result": job.get("result"),
+            "errors": job.get("errors", []),
+            "create_time": job.get("create_time"),
+            "start_time": job.get("start_time"),
+            "end_time": job.get("end_time")
+        }
+        return job_data
+
+    def create(self, job_type, enterprise_id, user_id, params, active_key=None):
+        """
+        提交任务
+
+        :param active_key: str. 同一active_key同时只能有一个等待中/执行中的任务，不限制时为None
+        :return: str. 任务id
+        :raise DuplicateKeyError: 已有相同active_key的任务
+        """
+        self.ensure_indexes()
+
+        job_data = {
+            "job_type": job_type,
+            "enterprise_id": enterprise_id,
+            "user_id": user_id,
+            "params": params,
+            "status": self.PENDING,
+            "cancel_requested": False,
+            "progress": {"stage": None, "done": 0, "total": None},
+            "result": None,
+            "errors": [],
+            "worker": None,
+            "heartbeat": None,
+            "create_time": DateTime.get_datetime_now_str(),
+            "start_time": None,
+            "end_time": None
+        }
+        if active_key is not None:
+            job_data["active_key"] = active_key
+
+        result = self.db[self.collection_name].insert_one(job_data)
+        return str(result.inserted_id)
+
+    def get(self, job_id, enterprise_id=None):
+        condition = {"_id": ObjectId(job_id)}
+        if enterprise_id is not None:
+            condition["enterprise_id"] = enterprise_id
+        return self.db[self.collection_name].find_one(condition)
+
+    def get_active(self, job_type, enterprise_id, document_id, exclude_job_id=None):
+        """
+        档案是否有等待中/执行中的任务
+
+        :param exclude_job_id: str. 不包括此任务（例如任务自身）
+        """
+        condition = {
+            "job_type": job_type,
+            "enterprise_id": enterprise_id,
+            "params.document_id": document_id,
+            "status": {"$in": self.ACTIVE_STATUSES}
+        }
+        if exclude_job_id is not None:
+            condition["_id"] = {"$ne": ObjectId(exclude_job_id)}
+        return self.db[self.collection_name].find_one(condition, {"_id": 1})
+
+    def claim(self, job_types):
+        """
+        领取一个等待中的任务（按提交顺序）
+
+        :param job_types: list. 当前worker能执行的任务类型
+        :return: dict or None.
+        """
+        condition = {"status": self.PENDING, "job_type": {"$in": job_types}}
+        update_data = {"$set": {
+            "status": self.RUNNING,
+            "worker": self.get_worker_name(),
+            "heartbeat": datetime.datetime.utcnow(),
+            "start_time": DateTime.get_datetime_now_str()
+        }}
+        return self.db[self.collection_name].find_one_and_update(
+            condition, update_data, sort=[("_id", pymongo.ASCENDING)], return_document=ReturnDocument.AFTER
+        )
+
+    def _get_owned_condition(self, job_id):
+        """本worker执行中的任务"""
+        return {"_id": ObjectId(job_id), "status": self.RUNNING, "worker": self.get_worker_name()}
+
+    def heartbeat(self, job_id, progress=None):
+        """
+        更新heartbeat（和进度）
+
+        :param progress: dict. 进度，不更新时为None
+        :return: bool. 是否需要停止：已请求取消，或任务已不由本worker执行（例如已被fail_stale标记失败）
+        """
+        update_data = {"$set": {"heartbeat": datetime.datetime.utcnow()}}
+        if progress is not None:
+            update_data["$set"]["progress"] = progress
+
+        job = self.db[self.collection_name].find_one_and_update(
+            self._get_owned_condition(job_id), update_data, projection={"cancel_requested": 1}
+        )
+        return job is None or bool(job.get("cancel_requested"))
+
+    def update_progress(self, job_id, stage, done, total=None):
+        """
+        更新进度
+
+        :return: bool. 是否需要停止，见heartbeat
+        """
+        return self.heartbeat(job_id, {"stage": stage, "done": done, "total": total})
+
+    def finish(self, job_id, status, result=None, errors=None):
+        """
+        结束任务（只结束本worker执行中的任务）
+
+        :return: bool. 任务已被标记失败、不再由本worker执行时返回False
+        """
+        update_data = {"$set": {
+            "status": status,
+            "result": result,
+            "errors": (errors or [])[:self.MAX_ERRORS],
+            "heartbeat": datetime.datetime.utcnow(),
+            "end_time": DateTime.get_datetime_now_str()
+        }, "$unset": {"active_key": ""}}
+        result = self.db[self.collection_name].update_one(self._get_owned_condition(job_id), update_data)
+        return result.modified_count > 0
+
+    def request_cancel(self, job_id):
+        """
+        取消任务。等待中的任务直接取消，执行中的任务由执行线程在下一块数据前退出
+
+        :return: dict or None. 取消后的任务，任务已结束时返回None
+        """
+        collection = self.db[self.collection_name]
+        job = collection.find_one_and_update(
+            {"_id": ObjectId(job_id), "status": self.PENDING},
+            {"$set": {"status": self.CANCELLED, "cancel_requested": True,
+                      "end_time": DateTime.get_datetime_now_str()},
+             "$unset": {"active_key": ""}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job:
+            return job
+
+        return collection.find_one_and_update(
+            {"_id": ObjectId(job_id), "status": self.RUNNING},
+            {"$set": {"cancel_requested": True}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def fail_stale(self, stale_seconds):
+        """
+        执行任务的worker异常退出（没有更新heartbeat）时，标记任务失败
+
+        逐个标记（find_one_and_update），多个worker同时检查时每个任务只由一个worker标记并返回。
+
+        :return: list. 本次标记失败的任务（标记前的任务，调用方据此恢复任务修改过的状态）
+        """
+        deadline = datetime.datetime.utcnow() - datetime.timedelta(seconds=stale_seconds)
+        condition = {"status": self.RUNNING, "heartbeat": {"$lt": deadline}}
+        update_data = {
+            "$set": {"status": self.FAILED, "errors": ["任务中断（执行任务的进程已退出）"],
+                     "end_time": DateTime.get_datetime_now_str()},
+            "$unset": {"active_key": ""}
+        }
+
+        jobs = []
+        while True:
+            job = self.db[self.collection_name].find_one_and_update(condition, update_data)
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
@@ -27,6 +27,20 @@ class Land(BasicModel):
         land = self.db[self.collection_name].find_one(condition)
         return land
 
+    def get_names_by_ids(self, land_ids):
+        """
+        根据土地id批量获取土地名称（一次查询）
+
+        :param land_ids: list. 土地id列表，格式错误的id忽略
+        :return: dict. {'土地id': '土地名称', ...}
+        """
+        object_ids = list({ObjectId(land_id) for land_id in land_ids if land_id and self.is_id_format_right(land_id)})
+        if not object_ids:
+            return {}
+
+        lands = self.db[self.collection_name].find({"_id": {"$in": object_ids}}, {"land_name": 1})
+        return {str(land.get("_id")): land.get("land_name") for land in lands}
+
     def get_all(self):
         """
         获取全部土地，仅带有id和name
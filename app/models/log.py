@@ -5,32 +5,212 @@ Created Date: 2023/12/11
 Last Modified: 2023/12/11
 Description: 
 """
-from bson import ObjectId
+import datetime
+import threading
+
+import pymongo
+from pymongo.errors import CollectionInvalid
 
 from .basic import BasicModel
+from app.extentions import mongo
+from utils.dt import DateTime
 
 
 class RequestLogModel(BasicModel):
     """
     请求日志模型
+
+    日志按天分表：sys_log_request_{YYYYMMDD}，日期取自start_time（北京时间）。
+        1. 每张表只保存一天的日志，索引大小不随日志总量增长，写入成本固定。
+        2. 超过保留天数的表，先汇总到sys_log_request_summary（zstd压缩），再整表删除。
     """
+    # 每个进程已创建过索引的表，{(db_name, collection_name)}
+    _indexed_collections = set()
+    _indexed_lock = threading.Lock()
+
     def __init__(self, req=None, db=None):
         if db is not None:
             super(RequestLogModel, self).__init__(db=db)
         else:
             super(RequestLogModel, self).__init__(req=req)
 
+        # 旧版本日志表（不分表），保留不再写入
         self.collection_name = "sys_log_request"
+        self.bucket_prefix = "sys_log_request_"
+        self.summary_collection_name = "sys_log_request_summary"
+
+    def get_bucket_name(self, start_time):
+        """
+        根据请求时间获取日志表名
+
+        :param start_time: str. 格式"%Y-%m-%d %H:%M:%S"
+        :return: str. sys_log_request_{YYYYMMDD}
+        """
+        day = start_time[:10].replace("-", "")
+        return f"{self.bucket_prefix}{day}"
+
+    def _ensure_indexes(self, bucket_name):
+        """为日志表创建索引，每个进程每张表只执行一次"""
+        key = (self.db.name, bucket_name)
+        if key in self._indexed_collections:
+            return
+
+        collection = self.db[bucket_name]
+        collection.create_indexes([
+            pymongo.IndexModel([("start_time", pymongo.DESCENDING)]),
+            pymongo.IndexModel([("user_id", pymongo.ASCENDING), ("start_time", pymongo.DESCENDING)]),
+            pymongo.IndexModel([("url", pymongo.ASCENDING), ("start_time", pymongo.DESCENDING)]),
+        ])
+
+        with self._indexed_lock:
+            self._indexed_collections.add(key)
 
     def create(self, log_data):
         """创建请求记录"""
-        result = self.db[self.collection_name].insert_one(log_data)
+        bucket_name = self.get_bucket_name(log_data.get("start_time"))
+        self._ensure_indexes(bucket_name)
+
+        result = self.db[bucket_name].insert_one(log_data)
         return str(result.inserted_id)
 
-    def update(self, log_id, update_data):
-        """更新请求记录"""
-        condition = {"_id": ObjectId(log_id)}
-        update_info = {
-            "$set": update_data
+    def create_many(self, log_list):
+        """批量创建请求记录（后台写入线程调用）"""
+        buckets = {}
+        for log_data in log_list:
+            bucket_name = self.get_bucket_name(log_data.get("start_time"))
+            buckets.setdefault(bucket_name, []).append(log_data)
+
+        for bucket_name, bucket_log_list in buckets.items():
+            self._ensure_indexes(bucket_name)
+            self.db[bucket_name].insert_many(bucket_log_list, ordered=False)
+
+    def get_bucket_names(self):
+        """获取当前数据库中所有日志表，按日期升序"""
+        names = self.db.list_collection_names(filter={"name": {"$regex": f"^{self.bucket_prefix}\\d{{8}}$"}})
+        return sorted(names)
+
+    def _ensure_summary_collection(self):
+        """创建汇总表（zstd压缩）"""
+        try:
+            self.db.create_collection(
+                self.summary_collection_name,
+                storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+            )
+        except CollectionInvalid:
+            # 已存在
+            pass
+
+        self.db[self.summary_collection_name].create_index([("day", pymongo.DESCENDING)])
+
+    def summarize_bucket(self, bucket_name):
+        """
+        将一天的日志按(路由, http方法, 客户端类型)汇总到汇总表
+
+        汇总结果：请求数、失败数、用户数、平均/最大耗时(毫秒)。重复执行结果相同。
+        """
+        day = bucket_name[len(self.bucket_prefix):]
+        day = f"{day[:4]}-{day[4:6]}-{day[6:]}"
+
+        duration = {
+            "$subtract": [
+                {"$dateFromString": {"dateString": "$end_time", "format": DateTime.FORMAT,
+                                     "onError": None, "onNull": None}},
+                {"$dateFromString": {"dateString": "$start_time", "format": DateTime.FORMAT,
+                                     "onError": None, "onNull": None}}
+            ]
         }
-        self.db[self.collection_name].update_one(condition, update_info)
+        pipeline = [
+            {"$group": {
+                "_id": {
+                    "day": day,
+                    "url_rule": {"$ifNull": ["$url_rule", {"$arrayElemAt": [{"$split": ["$url", "?"]}, 0]}]},
+                    "http_method": "$http_method",
+                    "client_type": "$client_type"
+                },
+                "count": {"$sum": 1},
+                "error_count": {"$sum": {"$cond": [{"$eq": ["$is_success", False]}, 1, 0]}},
+                "users": {"$addToSet": "$user_id"},
+                "avg_duration_ms": {"$avg": duration},
+                "max_duration_ms": {"$max": duration}
+            }},
+            {"$project": {
+                "day": "$_id.day",
+                "url_rule": "$_id.url_rule",
+                "http_method": "$_id.http_method",
+                "client_type": "$_id.client_type",
+                "count": 1,
+                "error_count": 1,
+                "user_count": {"$size": "$users"},
+                "avg_duration_ms": 1,
+                "max_duration_ms": 1
+            }},
+            {"$merge": {"into": self.summary_collection_name, "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ]
+        self.db[bucket_name].aggregate(pipeline)
+
+    def compact(self, retention_days, summary_retention_days):
+        """
+        压缩过期日志
+
+        1. 超过retention_days天的日志表，汇总后删除
+        2. 超过summary_retention_days天的汇总数据删除
+
+        :param retention_days: int. 原始日志保留天数
+        :param summary_retention_days: int. 汇总数据保留天数
+        :return: list. 被删除的日志表
+        """
+        today = DateTime.get_datetime_now().date()
+        cutoff = (today - datetime.timedelta(days=retention_days)).strftime("%Y%m%d")
+        cutoff_bucket = f"{self.bucket_prefix}{cutoff}"
+
+        expired_buckets = [name for name in self.get_bucket_names() if name < cutoff_bucket]
+        if expired_buckets:
+            self._ensure_summary_collection()
+
+        for bucket_name in expired_buckets:
+            self.summarize_bucket(bucket_name)
+            self.db.drop_collection(bucket_name)
+            with self._indexed_lock:
+                self._indexed_collections.discard((self.db.name, bucket_name))
+
+        summary_cutoff = (today - datetime.timedelta(days=summary_retention_days)).strftime("%Y-%m-%d")
+        self.db[self.summary_collection_name].delete_many({"day": {"$lt": summary_cutoff}})
+
+        return expired_buckets
+
+
+class SlowRequestLogModel(BasicModel):
+    """
+    慢请求日志模型（主库sys_log_slow_request，所有企业共用）
+
+    记录耗时过长、数据库往返次数超出预算、或重复执行同一形状查询（N+1）的请求，
+    created_at上建TTL索引，超过保留天数自动删除。
+    """
+    # 每个进程已创建过索引的数据库，{db_name}
+    _indexed_dbs = set()
+    retention_days = 30
+
+    def __init__(self, db=None):
+        super(SlowRequestLogModel, self).__init__(db=db if db is not None else mongo.db)
+        self.collection_name = "sys_log_slow_request"
+
+    def _ensure_indexes(self):
+        if self.db.name in self._indexed_dbs:
+            return
+
+        collection = self.db[self.collection_name]
+        collection.create_indexes([
+            pymongo.IndexModel([("created_at", pymongo.ASCENDING)],
+                               expireAfterSeconds=self.retention_days * 86400),
+            pymongo.IndexModel([("url_rule", pymongo.ASCENDING), ("start_time", pymongo.DESCENDING)]),
+        ])
+        self._indexed_dbs.add(self.db.name)
+
+    def create(self, log_data):
+        self._ensure_indexes()
+        result = self.db[self.collection_name].insert_one(log_data)
+        return str(result.inserted_id)
+
+    def create_many(self, log_list):
+        self._ensure_indexes()
+        self.db[self.collection_name].insert_many(log_list, ordered=False)
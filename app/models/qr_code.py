@@ -5,16 +5,24 @@ Created Date: 2023/12/6
 Last Modified: 2023/12/6
 Description: 二维码
 """
-import os
+import json
+import datetime
 
-import qrcode
 from bson import ObjectId
+from flask import current_app
 
 from .basic import BasicModel
+from app.extentions import mongo
+from utils.cache import TTLCache
+from utils.qr import QRRenderer, QRRenderPool
+from utils.mongo import MongoRegistry
 
 
 class QRCode(BasicModel):
-    def __init__(self, data, req=None, db=None):
+    # 每种输出格式一个渲染配置，进程内复用，{格式: QRRenderer}
+    _renderers = {}
+
+    def __init__(self, data=None, req=None, db=None):
         if db is not None:
             super(QRCode, self).__init__(db=db)
         else:
@@ -23,39 +31,150 @@ class QRCode(BasicModel):
         self.collection_name = "image"
 
         self.data = data
-        self.version = 2
-        self.box_size = 6
-        self.border = 2
-        self.qr_code = qrcode.QRCode(
-            version=self.version,
-            error_correction=qrcode.constants.ERROR_CORRECT_Q,
-            box_size=self.box_size,
-            border=self.border
-        )
+        self.renderer = self.get_renderer()
 
-    def save(self):
+    @classmethod
+    def get_renderer(cls, image_format=None):
         """
-        将生成好的二维码图片，保存到mongodb，返回图片url
+        获取渲染配置
+
+        :param image_format: str. 输出格式，默认为配置中的QR_CODE_FORMAT
+        :return: QRRenderer
         """
-        file_name = "QR.png"
-        img_fp = os.path.join(os.getcwd(), "data", file_name)
+        if image_format is None:
+            image_format = current_app.config.get("QR_CODE_FORMAT", "png")
 
-        self.qr_code.clear()
-        self.qr_code.add_data(self.data)
-        self.qr_code.make(fit=True)
+        renderer = cls._renderers.get(image_format)
+        if renderer is None:
+            renderer = QRRenderer(image_format, mask_pattern=current_app.config.get("QR_CODE_MASK_PATTERN"))
+            cls._renderers[image_format] = renderer
 
-        # 保存图片到服务器本地
-        img = self.qr_code.make_image()
-        img.save(img_fp)
+        return renderer
 
-        # 读取并写入mongo
-        with open(img_fp, 'rb') as f:
-            img_bytes = f.read()
+    def save(self):
+        """
+        在内存中生成二维码图片，保存到mongodb，返回图片id
+        """
+        img_bytes = self.renderer.render(self.data)
 
         img_data = {
-            "name": file_name,
+            "name": f"QR{self.renderer.extension}",
+            "type": self.renderer.extension,
             "data": img_bytes
         }
         result = self.db[self.collection_name].insert_one(img_data)
 
         return str(result.inserted_id)
+
+    def save_many(self, data_list):
+        """
+        批量生成二维码（进程池渲染），每批用一次insert_many写入
+
+        :param data_list: list. 二维码内容
+        :return: generator. 每次返回一批图片id，list of str，与data_list顺序一致
+        """
+        name = f"QR{self.renderer.extension}"
+        for images in QRRenderPool.render_chunks(self.renderer, data_list):
+            img_datas = [{"name": name, "type": self.renderer.extension, "data": img_bytes} for img_bytes in images]
+            result = self.db[self.collection_name].insert_many(img_datas)
+            yield [str(i) for i in result.inserted_ids]
+
+    @staticmethod
+    def make_seed_data(enterprise_id, seed_id):
+        """种子二维码的内容"""
+        qr_code_data = {
+            "type": "SEED",
+            "enterprise_id": enterprise_id,
+            "seed_id": seed_id
+        }
+        return json.dumps(qr_code_data)
+
+
+    @staticmethod
+    def is_seed_exist(enterprise_id, seed_id):
+        """按需生成地址中的种子是否存在（档案种子，企业数据库document_data）"""
+        db = MongoRegistry.get_db(f"NZY_{enterprise_id}")
+        return db["document_data"].find_one({"_id": ObjectId(seed_id)}, {"_id": 1}) is not None
+
+    @staticmethod
+    def get_document_data_url(document_id, data_id):
+        """档案数据（data_{档案id}中的一行）二维码的内容：小程序获取数据接口的地址，扫码后登录用户可直接请求"""
+        app_domain = current_app.config['APP_DOMAIN']
+        return f"{app_domain}/app_api/v1/document/{document_id}/document_data/{data_id}"
+
+    @staticmethod
+    def get_seed_url(enterprise_id, seed_id):
+        """种子二维码的按需生成地址（见QRCodeCache）"""
+        api_domain = current_app.config['CLIENT_DOMAIN']
+        return f"{api_domain}/client_api/v1/qr_code/?enterprise_id={enterprise_id}&seed_id={seed_id}"
+
+
+class QRCodeCache(BasicModel):
+    """
+    按需生成的二维码缓存
+
+    说明：
+        1. 种子二维码不在创建种子时生成，第一次访问时根据二维码内容生成，按内容+渲染配置的哈希缓存。
+        2. 进程内LRU缓存（QR_CODE_CACHE_MAX_SIZE），未命中时生成；
+           QR_CODE_CACHE_PERSIST为True时，同时保存到主库qr_code_cache，其他worker和重启后可直接读取，
+           QR_CODE_CACHE_PERSIST_DAYS天后自动删除。
+        3. 二维码内容只由企业id和种子id决定；地址不需要登录，未命中缓存时先检查种子是否存在再生成，
+           随意构造的地址不会占用渲染和缓存。
+    """
+    _memory = TTLCache(ttl=86400, max_size=10000)
+    _indexed = False
+
+    persist = False
+    persist_days = 30
+
+    @classmethod
+    def init_app(cls, app):
+        cls._memory = TTLCache(ttl=app.config.get("QR_CODE_CACHE_TTL_SECONDS", 86400),
+                               max_size=app.config.get("QR_CODE_CACHE_MAX_SIZE", 10000))
+        cls.persist = app.config.get("QR_CODE_CACHE_PERSIST", cls.persist)
+        cls.persist_days = app.config.get("QR_CODE_CACHE_PERSIST_DAYS", cls.persist_days)
+
+    def __init__(self, db=None):
+        super(QRCodeCache, self).__init__(db=db if db is not None else mongo.db)
+        self.collection_name = "qr_code_cache"
+
+    def ensure_indexes(self):
+        """过期自动删除，每个进程只执行一次"""
+        if QRCodeCache._indexed:
+            return
+
+        self.db[self.collection_name].create_index("created_at", expireAfterSeconds=self.persist_days * 86400)
+        QRCodeCache._indexed = True
+
+    def get(self, renderer, data, exists=None):
+        """
+        获取二维码图片，没有缓存时生成
+
+        :param renderer: QRRenderer. 渲染配置
+        :param data: str. 二维码内容
+        :param exists: function. 没有缓存时、生成前调用，无参数，返回False时不生成
+        :return: tuple. (缓存key, 图片数据)，exists返回False时图片数据为None
+        """
+        key = renderer.get_cache_key(data)
+        img_bytes = self._memory.get(key)
+        if img_bytes is not None:
+            return key, img_bytes
+
+        if self.persist:
+            self.ensure_indexes()
+            cached = self.db[self.collection_name].find_one({"_id": key}, {"data": 1})
+            if cached:
+                self._memory.set(key, cached.get("data"))
+                return key, cached.get("data")
+
+        if exists is not None and not exists():
+            return key, None
+
+        img_bytes = renderer.render(data)
+        self._memory.set(key, img_bytes)
+
+        if self.persist:
+            cache_data = {"data": img_bytes, "created_at": datetime.datetime.utcnow()}
+            self.db[self.collection_name].update_one({"_id": key}, {"$setOnInsert": cache_data}, upsert=True)
+
+        return key, img_bytes
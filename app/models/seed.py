@@ -5,15 +5,29 @@ Created Date: 2023/12/9
 Last Modified: 2023/12/9
 Description: 种子模型
 """
+import re
+import threading
+
+import pymongo
 from bson import ObjectId
 
 from .basic import BasicModel
+from .inventory import Inventory
+from .seed_inventory import SeedInventory
+from .seed_search import SeedSearch
 
 
 class Seed(BasicModel):
     # 默认6列
     DEFAULT_COLUMNS = ['种子名称', '种子编号', '父本', '母本', '审定', '审定编号']
 
+    # 系谱查询的最大代数
+    PEDIGREE_MAX_DEPTH = 10
+
+    # 每个进程已创建过索引的数据库，{db_name}
+    _indexed_dbs = set()
+    _indexed_lock = threading.Lock()
+
     def __init__(self, req=None, db=None):
         if db is not None:
             super(Seed, self).__init__(db=db)
@@ -23,56 +37,7 @@ class Seed(BasicModel):
         self.collection_name = "seed"
         self.stash_collection_name = "stash"
         self.document_data_collection_name = "document_data"
-
-    def __get_all_stash_inventory_dict(self):
-        """
-        获取所有仓库中的种子和种子信息的映射
-
-        :return: dict.
-            {
-                'stash_id': {
-                    'seed_id': {object of inventory_list}
-                }
-            }
-        """
-        stash_mapping = {}
-        stashes = list(self.db[self.stash_collection_name].find({}))
-
-        for stash in stashes:
-            stash_id = str(stash.get("_id"))
-            stash_name = stash.get("name")
-            stash_mapping[stash_id] = {}
-
-            inventory_list = stash.get("inventory_list")
-
-            for seed in inventory_list:
-                seed_id = seed.get("seed_id")
-
-                # 在种子信息中，挂载仓库信息，避免多次查询
-                seed["stash_id"] = stash_id
-                seed["stash_name"] = stash_name
-
-                if seed_id in stash_mapping[stash_id].keys():
-                    # 如果同一种子在仓库出现多次，将种子数量和重量累加
-                    quantity = seed.get("quantity")
-                    stash_mapping[stash_id][seed_id]["quantity"] += quantity
-                    weight = seed.get("weight")
-                    stash_mapping[stash_id][seed_id]["weight"] += weight
-                else:
-                    stash_mapping[stash_id][seed_id] = seed
-
-        return stash_mapping
-
-    def __get_stash_info_mapping(self):
-        """获取key为仓库id，value为仓库信息的字典"""
-        all_stash = self.db[self.stash_collection_name].find({})
-        stash_id_mapping = {}
-        for stash in all_stash:
-            stash_id = str(stash.get("_id"))
-            stash_info = {"id": stash_id, "name": stash.get("name")}
-            stash_id_mapping[stash_id] = stash_info
-
-        return stash_id_mapping
+        self.inventory_collection_name = "seed_inventory"
 
     def is_exist(self, seed_id):
         return super(Seed, self).is_exist(self.collection_name, seed_id)
@@ -95,10 +60,13 @@ class Seed(BasicModel):
             "母本": maternal,
             "审定": is_approve,
             "审定编号": approve_code,
+            "parent_ids": self.make_parent_ids(paternal, maternal),
             "source": source
         }
         seed_data.update(self.get_create_meta())
-        self.db[self.collection_name].insert_one(seed_data)
+        result = self.db[self.collection_name].insert_one(seed_data)
+
+        SeedSearch(db=self.db).save(result.inserted_id, source, name, code)
 
     def get(self, seed_id):
         condition = {"_id": ObjectId(seed_id)}
@@ -142,6 +110,20 @@ class Seed(BasicModel):
         count = self.db[self.collection_name].count_documents(condition)
         return count
 
+    @classmethod
+    def make_parent_ids(cls, paternal, maternal):
+        """
+        父本/母本id（字符串）转为ObjectId列表，保存在parent_ids中用于系谱查询
+
+        :return: list. [ObjectId, ...]，没有父本/母本时为[]
+        """
+        parent_ids = []
+        for parent_id in (paternal, maternal):
+            if parent_id and cls.is_id_format_right(parent_id) and ObjectId(parent_id) not in parent_ids:
+                parent_ids.append(ObjectId(parent_id))
+
+        return parent_ids
+
     def get_name_by_id(self, seed_id):
         """
         根据种子id获取种子名称，如果seed_id=None，返回None。否则返回种子名称
@@ -173,122 +155,201 @@ class Seed(BasicModel):
                 "母本": maternal,
                 "审定": is_approve,
                 "审定编号": approve_code,
+                "parent_ids": self.make_parent_ids(paternal, maternal),
             }
         }
         seed_data['$set'].update(self.get_update_meta())
 
         self.db[self.collection_name].update_one({"_id": ObjectId(seed_id)}, seed_data)
 
+        # 库存明细中冗余的种子名称/编号
+        Inventory(db=self.db).update_seed_info(seed_id, name, code)
+
+        seed = self.db[self.collection_name].find_one({"_id": ObjectId(seed_id)}, {"source": 1})
+        SeedSearch(db=self.db).save(ObjectId(seed_id), seed.get("source"), name, code)
+
     def delete(self, seed_id):
         self.db[self.collection_name].delete_one({'_id': ObjectId(seed_id)})
+        SeedSearch(db=self.db).delete(ObjectId(seed_id))
 
-    def query_list(self, pn, pz, source, is_approve, q_stash_id, keyword):
+    def ensure_indexes(self):
         """
-        查询种子列表
+        创建种子列表、系谱查询用到的索引、库存汇总表，每个进程每个数据库只执行一次
 
-        :param pn: int. 当前页数
-        :param pz: int. 每页数量
-        :param source: str. 数据源。枚举字符串，'CREATE'/'DOCUMENT'
-        :param is_approve: bool. 审定
-        :param q_stash_id: str. 仓库id
-        :param keyword: str. 关键字（种子名称/种子编号）
-        :return:
+        旧版本种子的parent_ids不在请求中补齐，部署后执行flask seed migrate-parent-ids
         """
-        # 1.种子列表数据
-        # 加载所有种子
-        seeds = list(self.db[self.collection_name].find({}))
-
-        # 仓库中的种子id-仓库信息映射
-        stash_mapping = self.__get_all_stash_inventory_dict()
-
-        # 所有仓库
-        stash_info_mapping = self.__get_stash_info_mapping()
-
-        seed_list = []
-        for seed in seeds:
-            # 种子基础信息
-            seed_id = str(seed.get("_id"))
-            seed_data = {
-                "id": seed_id,
-                "种子名称": seed.get("种子名称"),
-                "种子编号": seed.get("种子编号"),
-                "父本": self.get_name_by_id(seed.get("父本")),
-                "母本": self.get_name_by_id(seed.get("母本")),
-                "审定": seed.get("审定"),
-                "审定编号": seed.get("审定编号"),
-                "source": seed.get("source"),
-                "total_quantity": 0,
-                "total_weight": 0,
-                "stash_list": []
-            }
-
-            # 遍历仓库信息
-            for stash_id, seed_dict in stash_mapping.items():
-                if seed_id in seed_dict.keys():
-                    # 如果再仓库中，将仓库信息加入
-                    stash_info = {
-                        "id": stash_info_mapping.get(stash_id).get("id"),
-                        "name": stash_info_mapping.get(stash_id).get("name")
-                    }
-                    seed_data["stash_list"].append(stash_info)
-                    # 获取仓库种子映射
-                    stash_seed_dict = seed_dict.get(seed_id)
-                    # 累加数量
-                    seed_data["total_quantity"] += stash_seed_dict.get("quantity") if stash_seed_dict else 0
-                    # 累加重量
-                    seed_data["total_weight"] += stash_seed_dict.get("weight") if stash_seed_dict else 0
-
-            seed_list.append(seed_data)
-
-        # 2.档案种子
-        document_seed_datas = []
-        document_seeds = self.db[self.document_data_collection_name].find({})
+        if self.db.name in self._indexed_dbs:
+            return
+
+        self.db[self.collection_name].create_indexes([
+            pymongo.IndexModel([("source", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("审定", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("父本", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("母本", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("parent_ids", pymongo.ASCENDING)]),
+        ])
+        self.db[self.document_data_collection_name].create_index([("审定", pymongo.ASCENDING)])
+
+        # 先迁移旧版本库存，再检查库存汇总
+        Inventory(db=self.db).ensure_ready()
+        SeedInventory(db=self.db).ensure_ready()
+        SeedSearch(db=self.db).ensure_indexes()
+
+        with self._indexed_lock:
+            self._indexed_dbs.add(self.db.name)
+
+    def migrate_parent_ids(self):
+        """旧版本种子没有parent_ids，根据父本/母本补齐（flask seed migrate-parent-ids）"""
+        parent_ids = {"$filter": {
+            "input": [self._to_object_id("$父本"), self._to_object_id("$母本")],
+            "cond": {"$ne": ["$$this", None]}
+        }}
+        self.db[self.collection_name].update_many(
+            {"parent_ids": {"$exists": False}}, [{"$set": {"parent_ids": {"$setUnion": [parent_ids]}}}]
+        )
+
+    def __get_stash_seed_ids(self, stash_id):
+        """仓库中所有种子的id"""
+        seed_ids = Inventory(db=self.db).get_stash_seed_ids(stash_id)
+        return [ObjectId(i) for i in seed_ids if i and self.is_id_format_right(i)]
+
+    def _make_catalog_pipeline(self, source=None, is_approve=None, q_stash_id=None, keyword=None):
+        """
+        构造"种子列表"+"档案种子"的过滤管道
 
-        for seed in document_seeds:
-            seed_id = str(seed.get("_id"))
-            seed_data = {
-                "id": seed_id,
-                "种子名称": seed.get("种子名称"),
-                "种子编号": seed.get("种子编号"),
-                "父本": self.get_name_by_id(seed.get("父本")),
-                "母本": self.get_name_by_id(seed.get("母本")),
-                "审定": seed.get("审定"),
-                "审定编号": seed.get("审定编号"),
-                "source": "DOCUMENT",
-                "stash_list": [],
-                "total_quantity": 0,
-                "total_weight": 0
-            }
-            document_seed_datas.append(seed_data)
+        种子列表(seed)为入口，通过$unionWith合并档案种子(document_data)，过滤条件在各自集合中执行，可以使用索引。
+        档案种子的source统一为"DOCUMENT"，且不在仓库中。
 
-        # 3. 合并"种子列表"和"档案育种列表"
-        seed_list.extend(document_seed_datas)
+        :return: tuple. (入口集合名, pipeline)，不可能有数据时返回(None, None)
+        """
+        seed_condition = {}
+        document_condition = {}
 
-        # 4. 过滤条件
-        if source:
-            seed_list = list(filter(lambda x: x["source"] == source, seed_list))
+        include_seed = source != "DOCUMENT"
+        include_document = not source or source == "DOCUMENT"
+        if source and include_seed:
+            seed_condition["source"] = source
 
         if is_approve is not None:
-            seed_list = list(filter(lambda x: x["审定"] == is_approve, seed_list))
+            seed_condition["审定"] = is_approve
+            document_condition["审定"] = is_approve
 
+        seed_ids = None
         if q_stash_id:
-            seed_list = list(filter(lambda x: stash_id in [i.get("id") for i in x["stash_list"]], seed_list))
+            include_document = False
+            seed_ids = self.__get_stash_seed_ids(q_stash_id)
 
         if keyword:
-            seed_list = list(filter(lambda x: keyword in x["种子名称"] or keyword in x["种子编号"], seed_list))
+            # 优先使用搜索索引（见SeedSearch），索引还没有重建过或匹配的种子过多时使用正则（与搜索索引一样不区分大小写）
+            keyword_ids = SeedSearch(db=self.db).match_ids(keyword)
+            if keyword_ids is None:
+                pattern = re.escape(keyword)
+                keyword_condition = [{"种子名称": {"$regex": pattern, "$options": "i"}},
+                                     {"种子编号": {"$regex": pattern, "$options": "i"}}]
+                seed_condition["$or"] = keyword_condition
+                document_condition["$or"] = keyword_condition
+            else:
+                seed_ids = keyword_ids if seed_ids is None else list(set(seed_ids) & set(keyword_ids))
+                document_condition["_id"] = {"$in": keyword_ids}
+
+        if seed_ids is not None:
+            seed_condition["_id"] = {"$in": seed_ids}
+
+        document_pipeline = [
+            {"$match": document_condition},
+            {"$addFields": {"source": "DOCUMENT"}}
+        ]
+
+        if include_seed:
+            pipeline = [{"$match": seed_condition}]
+            if include_document:
+                pipeline.append({"$unionWith": {"coll": self.document_data_collection_name,
+                                                "pipeline": document_pipeline}})
+            return self.collection_name, pipeline
+
+        if include_document:
+            return self.document_data_collection_name, document_pipeline
+
+        return None, None
+
+    def _aggregate_page(self, pn, pz, collection_name, pipeline, page_pipeline):
+        """
+        一次查询返回总数和当前页
+
+        :param page_pipeline: list. 只对当前页执行的阶段（关联查询、字段投影）
+        :return: dict. {'total': int, 'list': list}
+        """
+        if collection_name is None:
+            return {"total": 0, "list": []}
 
         start = (pn - 1) * pz
-        end = start + pz
+        pipeline = pipeline + [
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "list": [{"$skip": start}, {"$limit": pz}] + page_pipeline
+            }}
+        ]
+        result = list(self.db[collection_name].aggregate(pipeline))[0]
+
         resp_data = {
-            'total': len(seed_list),
-            'list': seed_list[start: end]
+            "total": result["total"][0]["count"] if result["total"] else 0,
+            "list": result["list"]
         }
-
         return resp_data
 
-    def wx_query_list(self, pn, pz, source, keyword):
+    @staticmethod
+    def _to_object_id(field):
+        """父本/母本等字段中的种子id为字符串，转为ObjectId，格式错误时为null"""
+        return {"$convert": {"input": field, "to": "objectId", "onError": None, "onNull": None}}
+
+    def _make_detail_stages(self):
+        """
+        当前页的关联查询：父本/母本名称、所在仓库及库存合计
+
+        :return: list.
         """
-        查询种子列表
+        return [
+            {"$addFields": {
+                "_seed_id": {"$toString": "$_id"},
+                "_paternal_id": self._to_object_id("$父本"),
+                "_maternal_id": self._to_object_id("$母本"),
+            }},
+            {"$lookup": {"from": self.collection_name, "localField": "_paternal_id",
+                         "foreignField": "_id", "as": "_paternal"}},
+            {"$lookup": {"from": self.collection_name, "localField": "_maternal_id",
+                         "foreignField": "_id", "as": "_maternal"}},
+            # 库存从汇总表读取（见SeedInventory）
+            {"$lookup": {"from": self.inventory_collection_name, "localField": "_seed_id",
+                         "foreignField": "_id", "as": "_inventory"}},
+            # 档案种子不在仓库中
+            {"$addFields": {
+                "_inventory": {"$cond": [{"$eq": ["$source", "DOCUMENT"]}, {}, {"$first": "$_inventory"}]}
+            }},
+            {"$project": {
+                "_id": 0,
+                "id": "$_seed_id",
+                # 字段不存在时返回null（与改造前逐条组装的结果一致，键总是存在）
+                "种子名称": {"$ifNull": ["$种子名称", None]},
+                "种子编号": {"$ifNull": ["$种子编号", None]},
+                "父本": {"$ifNull": [{"$first": "$_paternal.种子名称"}, None]},
+                "母本": {"$ifNull": [{"$first": "$_maternal.种子名称"}, None]},
+                "审定": {"$ifNull": ["$审定", None]},
+                "审定编号": {"$ifNull": ["$审定编号", None]},
+                "source": 1,
+                "total_quantity": {"$ifNull": ["$_inventory.total_quantity", 0]},
+                "total_weight": {"$ifNull": ["$_inventory.total_weight", 0]},
+                "stash_list": {"$map": {
+                    "input": {"$objectToArray": {"$ifNull": ["$_inventory.stashes", {}]}}, "as": "s",
+                    "in": {"id": "$$s.k", "name": "$$s.v.name"}
+                }}
+            }}
+        ]
+
+    def query_list(self, pn, pz, source, is_approve, q_stash_id, keyword):
+        """
+        查询种子列表（种子列表+档案种子）
+
+        过滤、计数、分页在一次聚合查询中完成，父本/母本名称、仓库信息只对当前页关联查询。
 
         :param pn: int. 当前页数
         :param pz: int. 每页数量
@@ -296,56 +357,41 @@ class Seed(BasicModel):
         :param is_approve: bool. 审定
         :param q_stash_id: str. 仓库id
         :param keyword: str. 关键字（种子名称/种子编号）
-        :return:
+        :return: dict. {'total': int, 'list': list}
         """
-        # 1.种子列表数据
-        # 加载所有种子
-        seeds = list(self.db[self.collection_name].find({}))
+        self.ensure_indexes()
 
-        seed_list = []
-        for seed in seeds:
-            # 种子基础信息
-            seed_id = str(seed.get("_id"))
-            seed_data = {
-                "id": seed_id,
-                "source": seed.get("source"),
-                "种子名称": seed.get("种子名称"),
-                "种子编号": seed.get("种子编号")
-            }
-            seed_list.append(seed_data)
+        collection_name, pipeline = self._make_catalog_pipeline(source, is_approve, q_stash_id, keyword)
+        return self._aggregate_page(pn, pz, collection_name, pipeline, self._make_detail_stages())
 
-        # 2.档案种子
-        document_seed_datas = []
-        document_seeds = self.db[self.document_data_collection_name].find({})
-
-        for seed in document_seeds:
-            seed_id = str(seed.get("_id"))
-            seed_data = {
-                "id": seed_id,
-                "source": "DOCUMENT",
-                "种子名称": seed.get("种子名称"),
-                "种子编号": seed.get("种子编号")
-            }
-            document_seed_datas.append(seed_data)
-
-        # 3. 合并"种子列表"和"档案育种列表"
-        seed_list.extend(document_seed_datas)
+    def wx_query_list(self, pn, pz, source, keyword):
+        """
+        查询种子列表（移动端）
 
-        # 4. 过滤条件
-        if source:
-            seed_list = list(filter(lambda x: x["source"] == source, seed_list))
+        :param pn: int. 当前页数
+        :param pz: int. 每页数量
+        :param source: str. 数据源。枚举字符串，'CREATE'/'DOCUMENT'
+        :param keyword: str. 关键字（种子名称/种子编号）
+        :return: dict. {'total': int, 'list': list}
+        """
+        self.ensure_indexes()
 
-        if keyword:
-            seed_list = list(filter(lambda x: keyword in x["种子名称"] or keyword in x["种子编号"], seed_list))
+        collection_name, pipeline = self._make_catalog_pipeline(source=source, keyword=keyword)
+        page_pipeline = [
+            {"$project": {"_id": 0, "id": {"$toString": "$_id"}, "source": 1, "种子名称": 1, "种子编号": 1}}
+        ]
+        return self._aggregate_page(pn, pz, collection_name, pipeline, page_pipeline)
 
-        start = (pn - 1) * pz
-        end = start + pz
-        resp_data = {
-            'total': len(seed_list),
-            'list': seed_list[start: end]
-        }
+    def suggest(self, keyword, limit=10):
+        """
+        种子搜索框自动补全（种子列表+档案种子）
 
-        return resp_data
+        :param keyword: str. 关键字（种子名称/种子编号）
+        :param limit: int. 返回数量
+        :return: list. [{'id', '种子名称', '种子编号', 'source'}, ...]
+        """
+        self.ensure_indexes()
+        return SeedSearch(db=self.db).suggest(keyword, limit)
 
     def name_count(self, name):
         """种子名称的数量"""
@@ -365,22 +411,92 @@ class Seed(BasicModel):
         """
         检查种子是否被引用
 
-        1. 检查种子列表中的父本或母本
+        1. 检查种子列表中的父本或母本（按父本、母本索引查询）
         2. 检查档案种子数据中父本或母本
         :return: list. 如果ref_list为空表示没有引用。
         """
+        self.ensure_indexes()
+
         ref_list = []
+        projection = {"种子名称": 1}
 
         # 检查种子列表中的父本
-        seed_condition = {"父本": seed_id}
-        seed = self.db[self.collection_name].find_one(seed_condition)
+        seed = self.db[self.collection_name].find_one({"父本": seed_id}, projection)
         if seed:
             ref_list.append(f"正在被{seed.get('种子名称')}作为父本使用")
 
         # 检查种子列表中的母本
-        seed_condition = {"母本": seed_id}
-        seed = self.db[self.collection_name].find_one(seed_condition)
+        seed = self.db[self.collection_name].find_one({"母本": seed_id}, projection)
         if seed:
             ref_list.append(f"正在被{seed.get('种子名称')}作为母本使用")
 
         return ref_list
+
+    def get_children(self, seed_id):
+        """
+        以该种子为父本或母本的种子（子代）
+
+        :param seed_id: str. 种子id
+        :return: list. [{'id', '种子名称', '种子编号', 'role'}, ...]，role为'父本'/'母本'/'父本,母本'
+        """
+        self.ensure_indexes()
+
+        projection = {"种子名称": 1, "种子编号": 1, "父本": 1, "母本": 1}
+        seeds = self.db[self.collection_name].find({"parent_ids": ObjectId(seed_id)}, projection)
+
+        children = []
+        for seed in seeds:
+            roles = [role for role in ("父本", "母本") if seed.get(role) == seed_id]
+            children.append({
+                "id": str(seed.get("_id")),
+                "种子名称": seed.get("种子名称"),
+                "种子编号": seed.get("种子编号"),
+                "role": ",".join(roles)
+            })
+
+        return children
+
+    def get_ancestors(self, seed_id, depth):
+        """
+        祖先（父本、母本逐代向上），一次$graphLookup查询
+
+        :param seed_id: str. 种子id
+        :param depth: int. 向上查询的代数，1表示只查父本/母本，最大PEDIGREE_MAX_DEPTH
+        :return: list or None. [{'id', '种子名称', '种子编号', '父本', '母本', 'depth'}, ...]，按代数排序；
+                 父本/母本为种子id，前端据此组装系谱树。种子不存在返回None
+        """
+        self.ensure_indexes()
+
+        depth = max(1, min(depth, self.PEDIGREE_MAX_DEPTH))
+        pipeline = [
+            {"$match": {"_id": ObjectId(seed_id)}},
+            {"$graphLookup": {
+                "from": self.collection_name,
+                "startWith": "$parent_ids",
+                "connectFromField": "parent_ids",
+                "connectToField": "_id",
+                "as": "ancestors",
+                "maxDepth": depth - 1,
+                "depthField": "depth"
+            }},
+            {"$project": {"_id": 0, "ancestors._id": 1, "ancestors.种子名称": 1, "ancestors.种子编号": 1,
+                          "ancestors.父本": 1, "ancestors.母本": 1, "ancestors.depth": 1}}
+        ]
+        result = list(self.db[self.collection_name].aggregate(pipeline))
+        if not result:
+            return None
+
+        ancestors = [
+            {
+                "id": str(ancestor.get("_id")),
+                "种子名称": ancestor.get("种子名称"),
+                "种子编号": ancestor.get("种子编号"),
+                "父本": ancestor.get("父本"),
+                "母本": ancestor.get("母本"),
+                # depthField从0开始，0为父本/母本
+                "depth": ancestor.get("depth") + 1
+            }
+            for ancestor in result[0]["ancestors"]
+        ]
+        ancestors.sort(key=lambda item: item["depth"])
+        return ancestors
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/10
+Last Modified: 2024/12/10
+Description: 种子库存汇总（物化视图）
+"""
+from pymongo import UpdateOne
+
+from .basic import BasicModel
+
+
+class SeedInventory(BasicModel):
+    """
+    种子库存汇总，集合seed_inventory，每个种子一条：
+        {
+            '_id': 'seed_id',
+            'total_quantity': 所有仓库数量合计,
+            'total_weight': 所有仓库重量合计,
+            'stashes': {
+                'stash_id': {'name': 仓库名称, 'quantity': 数量, 'weight': 重量, 'items': 该仓库中的记录条数}
+            }
+        }
+
+    说明：
+        1. 仓库的创建/修改/删除时，比较修改前后的库存，按差值$inc更新；入库/出库时直接$inc，不重新计算。
+        2. 首次使用时汇总表为空则自动重建（见ensure_ready）；数据不一致时（例如直接修改了数据库），
+           执行flask seed-inventory rebuild重建。
+    """
+    def __init__(self, db):
+        super(SeedInventory, self).__init__(db=db)
+        self.collection_name = "seed_inventory"
+        self.stash_collection_name = "stash"
+        self.inventory_collection_name = "inventory"
+
+    @staticmethod
+    def summarize(inventory_list):
+        """
+        按种子汇总仓库中的库存
+
+        :param inventory_list: list. 仓库中的inventory_list
+        :return: dict. {'seed_id': {'quantity': 数量, 'weight': 重量, 'items': 记录条数}}
+        """
+        summary = {}
+        for inventory in inventory_list or []:
+            seed_id = inventory.get("seed_id")
+            if not seed_id:
+                continue
+
+            item = summary.setdefault(seed_id, {"quantity": 0, "weight": 0, "items": 0})
+            item["quantity"] += inventory.get("quantity") or 0
+            item["weight"] += inventory.get("weight") or 0
+            item["items"] += 1
+
+        return summary
+
+    def apply_change(self, stash_id, stash_name, old_inventory_list, new_inventory_list):
+        """
+        仓库库存变化时，更新汇总（一次批量写入）
+
+        :param stash_id: str. 仓库id
+        :param stash_name: str. 仓库名称（修改后）
+        :param old_inventory_list: list. 修改前的inventory_list，新建仓库时为[]
+        :param new_inventory_list: list. 修改后的inventory_list，删除仓库时为[]
+        """
+        stash_id = str(stash_id)
+        old_summary = self.summarize(old_inventory_list)
+        new_summary = self.summarize(new_inventory_list)
+        empty = {"quantity": 0, "weight": 0, "items": 0}
+
+        operations = []
+        for seed_id in old_summary.keys() | new_summary.keys():
+            old_item = old_summary.get(seed_id, empty)
+            new_item = new_summary.get(seed_id, empty)
+            delta_quantity = new_item["quantity"] - old_item["quantity"]
+            delta_weight = new_item["weight"] - old_item["weight"]
+
+            update_data = {"$inc": {"total_quantity": delta_quantity, "total_weight": delta_weight}}
+            if new_item["items"]:
+                update_data["$inc"].update({
+                    f"stashes.{stash_id}.quantity": delta_quantity,
+                    f"stashes.{stash_id}.weight": delta_weight,
+                    f"stashes.{stash_id}.items": new_item["items"] - old_item["items"],
+                })
+                update_data["$set"] = {f"stashes.{stash_id}.name": stash_name}
+            else:
+                # 种子已从仓库中移除
+                update_data["$unset"] = {f"stashes.{stash_id}": ""}
+
+            operations.append(UpdateOne({"_id": seed_id}, update_data, upsert=True))
+
+        if operations:
+            self.db[self.collection_name].bulk_write(operations, ordered=False)
+
+    def adjust(self, stash_id, stash_name, seed_id, quantity, weight, is_new=False):
+        """
+        入库/出库时更新汇总
+
+        :param quantity: int. 数量变化
+        :param weight: float. 重量变化
+        :param is_new: bool. 是否为该仓库中新增的种子
+        """
+        stash_id = str(stash_id)
+        update_data = {
+            "$inc": {
+                "total_quantity": quantity,
+                "total_weight": weight,
+                f"stashes.{stash_id}.quantity": quantity,
+                f"stashes.{stash_id}.weight": weight,
+                f"stashes.{stash_id}.items": 1 if is_new else 0,
+            },
+            "$set": {f"stashes.{stash_id}.name": stash_name}
+        }
+        self.db[self.collection_name].update_one({"_id": seed_id}, update_data, upsert=True)
+
+    def rename_stash(self, stash_id, stash_name):
+        """修改仓库名称"""
+        stash_id = str(stash_id)
+        self.db[self.collection_name].update_many(
+            {f"stashes.{stash_id}": {"$exists": True}}, {"$set": {f"stashes.{stash_id}.name": stash_name}}
+        )
+
+    def rebuild(self):
+        """根据库存记录（inventory）重新计算汇总，结果整体替换seed_inventory"""
+        pipeline = [
+            {"$match": {"seed_id": {"$nin": [None, ""]}}},
+            {"$addFields": {"_stash_id": {"$convert": {"input": "$stash_id", "to": "objectId",
+                                                       "onError": None, "onNull": None}}}},
+            {"$lookup": {"from": self.stash_collection_name, "localField": "_stash_id",
+                         "foreignField": "_id", "as": "_stash"}},
+            {"$group": {
+                "_id": {"seed_id": "$seed_id", "stash_id": "$stash_id"},
+                "name": {"$first": {"$first": "$_stash.name"}},
+                "quantity": {"$sum": "$quantity"},
+                "weight": {"$sum": "$weight"},
+                "items": {"$sum": 1}
+            }},
+            {"$group": {
+                "_id": "$_id.seed_id",
+                "total_quantity": {"$sum": "$quantity"},
+                "total_weight": {"$sum": "$weight"},
+                "stashes": {"$push": {
+                    "k": "$_id.stash_id",
+                    "v": {"name": "$name", "quantity": "$quantity", "weight": "$weight", "items": "$items"}
+                }}
+            }},
+            {"$addFields": {"stashes": {"$arrayToObject": "$stashes"}}},
+            {"$out": self.collection_name}
+        ]
+        self.db[self.inventory_collection_name].aggregate(pipeline)
+
+    def ensure_ready(self):
+        """
+        汇总表中没有记录时（首次部署，或$out时库存记录还是空的）重建
+
+        由Seed.ensure_indexes调用，每个进程每个数据库只检查一次；库存记录为空时重建只是一次空的聚合。
+        """
+        if self.db[self.collection_name].find_one({}, {"_id": 1}) is None:
+            self.rebuild()
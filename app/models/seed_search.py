@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/13
+Last Modified: 2024/12/13
+Description: 种子搜索索引（种子名称/种子编号的子串匹配）
+"""
+import re
+import threading
+
+import pymongo
+from pymongo import ReplaceOne
+
+from utils.dt import DateTime
+from .basic import BasicModel
+
+
+class SeedSearch(BasicModel):
+    """
+    种子搜索索引，集合seed_search，种子列表(seed)和档案种子(document_data)中每个种子一条：
+        {
+            '_id': 种子的ObjectId（与seed/document_data中的_id相同）,
+            'source': 'CREATE'/'DOCUMENT',
+            'name': 种子名称,
+            'code': 种子编号,
+            'name_length': 种子名称长度，用于排序,
+            'tokens': [种子名称、种子编号（小写）的所有子串，长度不超过MAX_GRAM]
+        }
+
+    说明：
+        1. tokens上有多值索引，长度不超过MAX_GRAM的关键字是一次等值查询；更长的关键字先用前MAX_GRAM个字查询，再用正则过滤。
+        2. 种子的创建/修改/删除、档案导入、育种数据保存时同步更新。
+        3. 数据不一致时（例如直接修改了数据库），执行flask seed-search rebuild重建。
+    """
+    # 子串最大长度。种子名称、编号一般不超过十几个字，子串数量可控
+    MAX_GRAM = 8
+
+    # 关键字匹配的种子超过此数量时，种子列表不使用搜索索引（$in条件过大），改为正则查询
+    MAX_MATCH_IDS = 10000
+
+    # 重建时每批写入的数量
+    BATCH_SIZE = 1000
+
+    # 重建完成的标记
+    BUILT_MARKER_ID = "built"
+
+    # 每个进程已确认重建过的数据库，{db_name}。只缓存已重建的结果，执行重建命令后不需要重启进程
+    _built_dbs = set()
+    _built_lock = threading.Lock()
+
+    def __init__(self, db):
+        super(SeedSearch, self).__init__(db=db)
+        self.collection_name = "seed_search"
+        self.state_collection_name = "seed_search_state"
+        self.seed_collection_name = "seed"
+        self.document_data_collection_name = "document_data"
+
+    @staticmethod
+    def normalize(value):
+        """去掉首尾空白，转为小写（种子编号不区分大小写）"""
+        if value is None:
+            return ""
+        return str(value).strip().lower()
+
+    @classmethod
+    def make_tokens(cls, *values):
+        """
+        生成所有长度不超过MAX_GRAM的子串
+
+        :return: list.
+        """
+        tokens = set()
+        for value in values:
+            value = cls.normalize(value)
+            for start in range(len(value)):
+                for end in range(start + 1, min(len(value), start + cls.MAX_GRAM) + 1):
+                    tokens.add(value[start:end])
+
+        return list(tokens)
+
+    @classmethod
+    def make_entry(cls, seed_id, source, name, code):
+        name = name or ""
+        code = code or ""
+        entry = {
+            "_id": seed_id,
+            "source": source,
+            "name": name,
+            "code": code,
+            "name_length": len(name),
+            "tokens": cls.make_tokens(name, code)
+        }
+        return entry
+
+    def ensure_indexes(self):
+        self.db[self.collection_name].create_index([("tokens", pymongo.ASCENDING), ("name_length", pymongo.ASCENDING)])
+
+    def is_built(self):
+        """搜索索引是否已重建过（旧数据都已写入）"""
+        if self.db.name in self._built_dbs:
+            return True
+
+        if self.db[self.state_collection_name].find_one({"_id": self.BUILT_MARKER_ID}) is None:
+            return False
+
+        with self._built_lock:
+            self._built_dbs.add(self.db.name)
+        return True
+
+    def save(self, seed_id, source, name, code):
+        """创建/修改种子时更新"""
+        entry = self.make_entry(seed_id, source, name, code)
+        self.db[self.collection_name].replace_one({"_id": seed_id}, entry, upsert=True)
+
+    def save_many(self, seeds, source):
+        """
+        批量更新
+
+        :param seeds: iterable. [{'_id': ObjectId, '种子名称': str, '种子编号': str}, ...]
+        :param source: str. 'CREATE'/'DOCUMENT'
+        :return: int. 写入数量
+        """
+        count = 0
+        operations = []
+        for seed in seeds:
+            entry = self.make_entry(seed.get("_id"), source, seed.get("种子名称"), seed.get("种子编号"))
+            operations.append(ReplaceOne({"_id": entry["_id"]}, entry, upsert=True))
+
+            if len(operations) >= self.BATCH_SIZE:
+                self.db[self.collection_name].bulk_write(operations, ordered=False)
+                count += len(operations)
+                operations = []
+
+        if operations:
+            self.db[self.collection_name].bulk_write(operations, ordered=False)
+            count += len(operations)
+
+        return count
+
+    def delete(self, seed_id):
+        self.db[self.collection_name].delete_one({"_id": seed_id})
+
+    def rebuild(self):
+        """
+        根据种子列表和档案种子重建
+
+        重建期间，没有缓存标记的进程改为正则查询；已缓存标记的进程在重建完成前搜索结果不完整。
+
+        :return: int. 种子数量
+        """
+        self.db[self.state_collection_name].delete_one({"_id": self.BUILT_MARKER_ID})
+        self.db[self.collection_name].delete_many({})
+
+        projection = {"种子名称": 1, "种子编号": 1}
+        count = self.save_many(self.db[self.seed_collection_name].find({}, projection), "CREATE")
+        count += self.save_many(self.db[self.document_data_collection_name].find({}, projection), "DOCUMENT")
+        self.ensure_indexes()
+
+        self.db[self.state_collection_name].replace_one(
+            {"_id": self.BUILT_MARKER_ID},
+            {"_id": self.BUILT_MARKER_ID, "count": count, "build_time": DateTime.get_datetime_now_str()},
+            upsert=True
+        )
+        return count
+
+    def _make_condition(self, keyword):
+        keyword = self.normalize(keyword)
+        if len(keyword) <= self.MAX_GRAM:
+            return {"tokens": keyword}
+
+        # 关键字较长，先用前缀子串缩小范围
+        pattern = re.escape(keyword)
+        return {
+            "tokens": keyword[:self.MAX_GRAM],
+            "$or": [{"name": {"$regex": pattern, "$options": "i"}}, {"code": {"$regex": pattern, "$options": "i"}}]
+        }
+
+    def match_ids(self, keyword):
+        """
+        名称或编号包含关键字的种子id
+
+        :return: list or None. [ObjectId, ...]，关键字只有空白、搜索索引还没有重建过、或匹配数量超过MAX_MATCH_IDS时返回None
+        """
+        # 只有空白的关键字规范化后为空，tokens中没有空串，改为正则查询
+        if not self.normalize(keyword) or not self.is_built():
+            return None
+
+        cursor = self.db[self.collection_name].find(self._make_condition(keyword), {"_id": 1})
+        cursor = cursor.limit(self.MAX_MATCH_IDS + 1)
+
+        seed_ids = [item.get("_id") for item in cursor]
+        if len(seed_ids) > self.MAX_MATCH_IDS:
+            return None
+
+        return seed_ids
+
+    def suggest(self, keyword, limit=10):
+        """
+        搜索框自动补全
+
+        按名称长度取前若干个候选，再把名称/编号以关键字开头的排在前面。
+
+        :param keyword: str. 关键字
+        :param limit: int. 返回数量
+        :return: list. [{'id', '种子名称', '种子编号', 'source'}, ...]
+        """
+        normalized = self.normalize(keyword)
+        if not normalized:
+            return []
+
+        projection = {"name": 1, "code": 1, "source": 1, "name_length": 1}
+        candidates = self.db[self.collection_name].find(self._make_condition(keyword), projection)
+        candidates = list(candidates.sort("name_length", pymongo.ASCENDING).limit(limit * 5))
+
+        def rank(item):
+            name = self.normalize(item.get("name"))
+            code = self.normalize(item.get("code"))
+            if normalized in (name, code):
+                return 0
+            if name.startswith(normalized) or code.startswith(normalized):
+                return 1
+            return 2
+
+        candidates.sort(key=lambda item: (rank(item), item.get("name_length")))
+
+        suggestions = [
+            {
+                "id": str(item.get("_id")),
+                "种子名称": item.get("name"),
+                "种子编号": item.get("code"),
+                "source": item.get("source")
+            }
+            for item in candidates[:limit]
+        ]
+        return suggestions
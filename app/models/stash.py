@@ -8,6 +8,8 @@ Description: 仓库模型
 from bson import ObjectId
 
 from .basic import BasicModel
+from .inventory import Inventory
+from .seed_inventory import SeedInventory
 
 
 class Stash(BasicModel):
@@ -32,6 +34,16 @@ class Stash(BasicModel):
         stash_list = [{"id": str(s.get("_id")), "name": s.get("name")} for s in stashes]
         return stash_list
 
+    def get_inventory(self):
+        """库存明细模型（首次使用时创建索引）"""
+        inventory = Inventory(db=self.db)
+        inventory.ensure_ready()
+        return inventory
+
+    def get_inventory_list(self, stash_id):
+        """仓库中的种子列表"""
+        return self.get_inventory().get_inventory_list(stash_id)
+
     def get_inventory_dict(self, stash_id):
         """
         获取某一仓库中的种子和种子信息的映射
@@ -39,10 +51,7 @@ class Stash(BasicModel):
         :param stash_id: str. 仓库id
         :return: dict. {'seed_id': {seed}, ...}
         """
-        condition = {"_id": ObjectId(stash_id)}
-        stash = self.db[self.collection_name].find_one(condition)
-
-        inventory_list = stash.get("inventory_list")
+        inventory_list = self.get_inventory_list(stash_id)
 
         seed_mapping = {}
         for seed_info in inventory_list:
@@ -82,11 +91,13 @@ class Stash(BasicModel):
             "area_code": area_code,
             "detail_address": detail_address,
             "description": description,
-            "inventory_list": inventory_list,
             "status": status
         }
         stash_data.update(self.get_create_meta())
-        self.db[self.collection_name].insert_one(stash_data)
+        result = self.db[self.collection_name].insert_one(stash_data)
+
+        # 库存保存在库存明细中
+        self.get_inventory().replace_stash(result.inserted_id, name, inventory_list)
 
     def update(self, stash_id, data):
         name = data.get("name")
@@ -102,7 +113,7 @@ class Stash(BasicModel):
 
         # 校验'种子列表'
         # 如果前端没传quantity和weight，默认值为0
-        for inventory in inventory_list:
+        for inventory in inventory_list or []:
             if not inventory.get("quantity"):
                 inventory["quantity"] = 0
 
@@ -117,15 +128,32 @@ class Stash(BasicModel):
                 "area_code": area_code,
                 "detail_address": detail_address,
                 "description": description,
-                "inventory_list": inventory_list,
             }
         }
         stash_data['$set'].update(self.get_update_meta())
         self.db[self.collection_name].update_one({"_id": ObjectId(stash_id)}, stash_data)
 
+        # 只写入有变化的库存；未传inventory_list时库存不变
+        if inventory_list is not None:
+            self.get_inventory().replace_stash(stash_id, name, inventory_list)
+        else:
+            SeedInventory(db=self.db).rename_stash(stash_id, name)
+
     def delete(self, stash_id):
         condition = {"_id": ObjectId(stash_id)}
         self.db[self.collection_name].delete_one(condition)
+        self.get_inventory().delete_stash(stash_id)
+
+    def adjust_inventory(self, stash_id, seed_id, quantity=0, weight=0):
+        """
+        入库/出库
+
+        :param quantity: int. 数量变化，入库为正数，出库为负数
+        :param weight: float. 重量变化，入库为正数，出库为负数
+        :return: dict or None. 调整后的库存；库存不足时返回None
+        """
+        stash = self.db[self.collection_name].find_one({"_id": ObjectId(stash_id)}, {"name": 1})
+        return self.get_inventory().adjust(stash_id, stash.get("name"), seed_id, quantity, weight)
 
     def query_list(self, pn, pz, status, region, keyword):
         condition = {}
@@ -156,44 +184,11 @@ class Stash(BasicModel):
         return resp_data
 
     def seed_list(self, pn, pz, stash_id, keyword):
-        """仓库种子列表"""
-        condition = {}
+        """仓库种子列表（分页、关键字搜索在数据库中完成）"""
+        if not stash_id:
+            return {"total": 0, "list": []}
 
-        if stash_id:
-            condition.update({'_id': ObjectId(stash_id)})
-
-        stash = self.db[self.collection_name].find_one(condition)
-        inventory_list = stash.get("inventory_list")
-
-        # 将种子列表中seed_id替换成"种子名称"
-        for seed in inventory_list:
-            seed_id = seed.pop("seed_id")
-            seed_obj = self.db[self.seed_collection_name].find_one({"_id": ObjectId(seed_id)})
-            seed["种子名称"] = seed_obj.get("种子名称")
-            seed["种子编号"] = seed_obj.get("种子编号")
-
-        # 根据keyword筛选
-        if keyword:
-            seed_list = []
-            for seed in inventory_list:
-                if keyword in seed.get("种子名称") or keyword in seed.get("种子编号"):
-                    seed_list.append(seed)
-
-            inventory_list = seed_list
-
-        # 种子数量
-        seed_total = len(inventory_list)
-
-        # 分页返回种子数量
-        start = (pn - 1) * pz
-        end = pn * pz
-        seed_list = inventory_list[start: end]
-
-        resp_data = {
-            "total": seed_total,
-            "list": seed_list
-        }
-        return resp_data
+        return self.get_inventory().query_list(pn, pz, stash_id, keyword)
 
     def change_status(self, stash_id, status):
         condition = {"_id": ObjectId(stash_id)}
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/4
+Last Modified: 2024/12/4
+Description: 性能测试脚本
+"""
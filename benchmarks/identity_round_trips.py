@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/4
+Last Modified: 2024/12/4
+Description: 鉴权时用户身份查询的数据库往返次数对比
+
+用法（需要可访问的MongoDB，默认读取settings.py中dev环境的MONGO_HOST/MONGO_PORT）：
+    python -m benchmarks.identity_round_trips [env] [次数]
+
+对比三种方式：
+    1. sequential: 改造前，user -> admin_user -> enterprise 依次find_one
+    2. aggregate: IdentityResolver，一次聚合查询
+    3. cached: IdentityCache，重复请求不访问数据库
+"""
+import sys
+import time
+import datetime
+import threading
+
+from bson import ObjectId
+from flask import Flask
+from pymongo import monitoring
+
+from settings import ConfigMapping
+from app.extentions import mongo
+from utils.identity import IdentityResolver, IdentityCache
+
+
+BENCHMARK_DB_NAME = "benchmark_identity"
+
+
+class CommandCounter(monitoring.CommandListener):
+    """统计发送到数据库的命令数量"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def sequential_resolve(user_id):
+    """改造前verify_token_decorator中的查询逻辑"""
+    user_obj_id = ObjectId(user_id)
+    user = mongo.db.user.find_one({"_id": user_obj_id})
+    has_company = True
+    if not user:
+        has_company = False
+        user = mongo.db.admin_user.find_one({"_id": user_obj_id})
+
+    if has_company:
+        enterprise = mongo.db.enterprise.find_one({"_id": ObjectId(user.get("enterprise_id"))})
+        datetime.datetime.strptime(enterprise.get("start_date"), "%Y-%m-%d")
+        datetime.datetime.strptime(enterprise.get("end_date"), "%Y-%m-%d")
+
+    return user
+
+
+def prepare_data():
+    enterprise_id = mongo.db.enterprise.insert_one({
+        "name": "benchmark",
+        "status": "ENABLE",
+        "start_date": "2020-01-01",
+        "end_date": "2099-12-31",
+        "db_name": "NZY_benchmark"
+    }).inserted_id
+    user_id = mongo.db.user.insert_one({"user_name": "benchmark", "enterprise_id": str(enterprise_id)}).inserted_id
+    admin_user_id = mongo.db.admin_user.insert_one({"user_name": "benchmark"}).inserted_id
+    return str(user_id), str(admin_user_id)
+
+
+def run(name, func, user_id, times, counter):
+    counter.count = 0
+    start = time.perf_counter()
+    for _ in range(times):
+        func(user_id)
+    cost = time.perf_counter() - start
+    print(f"{name:<30}{counter.count / times:>12.2f}{cost / times * 1000:>12.3f}")
+
+
+def main():
+    env = sys.argv[1] if len(sys.argv) > 1 else "dev"
+    times = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    config = ConfigMapping.get(env)
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config["MONGO_URI"] = f"mongodb://{config.MONGO_HOST}:{config.MONGO_PORT}/{BENCHMARK_DB_NAME}"
+
+    counter = CommandCounter()
+    mongo.init_app(app, event_listeners=[counter])
+    IdentityCache.init_app(app)
+
+    try:
+        user_id, admin_user_id = prepare_data()
+
+        print(f"{'方式':<30}{'往返次数/请求':>12}{'耗时ms/请求':>12}")
+        for label, uid in (("企业用户", user_id), ("系统管理员", admin_user_id)):
+            print(f"-- {label}")
+            run("sequential", sequential_resolve, uid, times, counter)
+            run("aggregate", IdentityResolver.resolve, uid, times, counter)
+            IdentityCache.clear()
+            run("cached", IdentityCache.get, uid, times, counter)
+    finally:
+        mongo.cx.drop_database(BENCHMARK_DB_NAME)
+
+
+if __name__ == '__main__':
+    main()
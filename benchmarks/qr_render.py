@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/14
+Last Modified: 2024/12/14
+Description: 二维码渲染速度对比（单核，每秒生成数量）
+
+用法（不需要数据库）：
+    python -m benchmarks.qr_render [次数]
+
+对比：
+    1. disk: 改造前，渲染后写入data/QR.png再读回
+    2. memory-<格式>: QRRenderer在内存中渲染，各输出格式
+    3. memory-<格式>-m0: 同上，固定掩码（QR_CODE_MASK_PATTERN=0）
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+
+import qrcode
+from bson import ObjectId
+
+from utils.qr import QRRenderer
+
+
+def make_payload():
+    """与档案种子二维码相同的内容"""
+    qr_code_data = {
+        "type": "SEED",
+        "enterprise_id": str(ObjectId()),
+        "seed_id": str(ObjectId())
+    }
+    return json.dumps(qr_code_data)
+
+
+def disk_render(data, img_fp):
+    """改造前QRCode.save中的渲染逻辑"""
+    qr_code = qrcode.QRCode(version=2, error_correction=qrcode.constants.ERROR_CORRECT_Q, box_size=6, border=2)
+    qr_code.add_data(data)
+    qr_code.make(fit=True)
+
+    img = qr_code.make_image()
+    img.save(img_fp)
+
+    with open(img_fp, 'rb') as f:
+        return f.read()
+
+
+def run(name, func, payloads):
+    start = time.perf_counter()
+    total_bytes = 0
+    for payload in payloads:
+        total_bytes += len(func(payload))
+    cost = time.perf_counter() - start
+    print(f"{name:<20}{len(payloads) / cost:>14.1f}{cost / len(payloads) * 1000:>12.3f}"
+          f"{total_bytes / len(payloads):>14.0f}")
+
+
+def main():
+    times = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    payloads = [make_payload() for _ in range(times)]
+
+    print(f"{'方式':<20}{'个/秒/核':>14}{'耗时ms/个':>12}{'平均字节数':>14}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        img_fp = os.path.join(tmp_dir, "QR.png")
+        run("disk", lambda data: disk_render(data, img_fp), payloads)
+
+    for image_format in QRRenderer.FORMATS:
+        run(f"memory-{image_format}", QRRenderer(image_format).render, payloads)
+        run(f"memory-{image_format}-m0", QRRenderer(image_format, mask_pattern=0).render, payloads)
+
+
+if __name__ == '__main__':
+    main()
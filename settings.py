@@ -18,6 +18,85 @@ class BaseConfig:
     JWT_JSON_KEY = "token"
     JWT_REFRESH_JSON_KEY = "token"
 
+    # Mongo连接池（每个worker进程共享一个连接池）
+    MONGO_MAX_POOL_SIZE = 50                    # 最大连接数，不小于uwsgi线程数
+    MONGO_MIN_POOL_SIZE = 0                     # 最小空闲连接数
+    MONGO_MAX_IDLE_TIME_MS = 300000             # 空闲连接最大保留时间，5分钟
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = 5000          # 等待可用连接的超时时间
+    MONGO_CONNECT_TIMEOUT_MS = 5000             # 建立连接超时时间
+    MONGO_SOCKET_TIMEOUT_MS = None              # 读写超时时间，None表示不超时
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = 10000   # 选择服务器超时时间
+
+    # 用户身份缓存（鉴权时的用户+企业信息，每个worker进程一份）
+    IDENTITY_CACHE_ENABLED = True
+    IDENTITY_CACHE_TTL_SECONDS = 30             # 停用企业/删除用户最晚在此时间后生效
+    IDENTITY_CACHE_MAX_SIZE = 10000
+
+    # 请求日志后台批量写入
+    REQUEST_LOG_ASYNC = True                    # False时在请求线程中同步写入
+    REQUEST_LOG_QUEUE_SIZE = 10000              # 队列长度，队列满时丢弃日志
+    REQUEST_LOG_BATCH_SIZE = 200                # 每批最多写入条数
+    REQUEST_LOG_FLUSH_INTERVAL_SECONDS = 1.0    # 最长等待时间，到时间后不足一批也写入
+    REQUEST_LOG_BUSY_RATIO = 0.8                # 队列积压超过此比例时，开始采样
+    REQUEST_LOG_BUSY_SAMPLE_RATE = 0.1          # 积压时成功请求日志的保留比例
+
+    # 请求日志按天分表，超过保留天数的表汇总后删除（flask request-log compact）
+    REQUEST_LOG_RETENTION_DAYS = 30             # 原始日志保留天数
+    REQUEST_LOG_SUMMARY_RETENTION_DAYS = 365    # 汇总数据保留天数
+
+    # 请求日志中返回值的记录策略，失败的请求总是完整记录
+    # mode: FULL完整, TRUNCATE截断, HASH摘要, SAMPLE采样, NONE不记录
+    REQUEST_LOG_CAPTURE_DEFAULT = {"mode": "TRUNCATE", "max_bytes": 4096}
+    REQUEST_LOG_CAPTURE_RULES = [
+        # (url_rule, 策略)，按顺序匹配，支持通配符
+        ("/client_api/v1/document/<document_id>/document_data/list", {"mode": "HASH"}),
+        ("/app_api/v1/document/<document_id>/document_data/list", {"mode": "HASH"}),
+        ("/api/v1/seed/*", {"mode": "SAMPLE", "rate": 0.01, "max_bytes": 4096}),
+    ]
+
+    # 接口性能指标（/admin_api/v1/system/metrics，Prometheus格式）
+    METRICS_ENABLED = True
+    METRICS_DIR = "/tmp/intellifield_metrics"   # 各worker定期写入快照的目录，所有worker需相同
+    METRICS_DUMP_INTERVAL_SECONDS = 5           # 快照写入间隔，其他worker的数据最多延迟此时间
+
+    # 按请求统计Mongo命令，发现慢请求和N+1查询
+    MONGO_PROFILE_ENABLED = True
+    MONGO_PROFILE_ROUND_TRIP_BUDGET = 30        # 单个请求的命令数超过此值时标记
+    MONGO_PROFILE_REPEAT_THRESHOLD = 10         # 同一形状的查询执行次数达到此值时标记（N+1）
+    MONGO_PROFILE_SLOW_MS = 1000                # 请求耗时超过此值时标记
+    SLOW_REQUEST_LOG_ENABLED = True             # 被标记的请求写入主库sys_log_slow_request
+    SLOW_REQUEST_LOG_RETENTION_DAYS = 30
+
+    # 二维码输出格式：png（qrcode生成，与改造前相同）/png1（1位灰度PNG，图像与png相同，速度快）/svg（可缩放）
+    QR_CODE_FORMAT = "png1"
+    QR_CODE_MASK_PATTERN = None                 # 固定掩码（0~7）可减少约一半编码耗时，None为自动选择最优掩码
+    QR_RENDER_PROCESSES = None                  # 批量生成二维码的进程数（每个worker），None为CPU核数，1为不使用进程池
+    QR_RENDER_MIN_BATCH = 50                    # 少于此数量时在当前线程中生成
+    QR_RENDER_CHUNK_SIZE = 200                  # 每批数量，每批生成后写入数据库并更新导入进度
+    QR_RENDER_START_METHOD = "fork"             # 进程池子进程的创建方式，见utils.qr.QRRenderPool
+
+    # 种子二维码按需生成（第一次访问/client_api/v1/qr_code时生成并缓存），False时创建种子时生成并保存到image
+    QR_CODE_LAZY = True
+    QR_CODE_CACHE_MAX_SIZE = 10000              # 每个worker缓存的二维码数量（png1每个约1KB）
+    QR_CODE_CACHE_TTL_SECONDS = 86400
+    QR_CODE_CACHE_PERSIST = False               # 同时保存到主库qr_code_cache，worker之间共享
+    QR_CODE_CACHE_PERSIST_DAYS = 30
+    QR_LABEL_MAX_EXPORTS = 2                    # 每个worker同时导出二维码标签（PDF）的数量，导出期间占用一个线程
+
+    # 档案数据导出（流式输出，内存占用不随数据量增长）
+    EXPORT_BATCH_SIZE = 1000                    # 每次从数据库读取并输出的行数
+
+    # 档案数据导入（excel只读模式分块读取）
+    IMPORT_CHUNK_SIZE = 1000                    # 每块行数，每块一次insert_many
+
+    # 档案数据索引，列配置中标记searchable/sortable的列创建索引，见app.models.document_index.DocumentIndex
+    DOCUMENT_DATA_MAX_INDEXES = 10              # 每个档案最多创建的列索引数，超出的列不创建索引（不能排序）
+
+    # 后台任务（excel导入），任务保存在主库jobs集合，见utils.job.JobWorker
+    JOB_WORKER_THREADS = 1                      # 每个worker进程的任务执行线程数，0为不在本进程执行任务
+    JOB_POLL_INTERVAL_SECONDS = 5               # 没有任务时的检查间隔，其他worker提交的任务最多延迟此时间开始
+    JOB_STALE_SECONDS = 600                     # 执行中的任务超过此时间没有更新进度，视为中断并标记失败
+
 
 class DevConfig(BaseConfig):
     """开发环境配置"""
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/3
+Last Modified: 2024/12/3
+Description: 进程内缓存
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    带过期时间的LRU缓存（线程安全）
+
+    仅在当前进程内有效，uwsgi的多个worker之间不共享。
+    """
+    def __init__(self, ttl, max_size):
+        """
+        :param ttl: float. 过期时间(秒)
+        :param max_size: int. 最大缓存数量，超出时淘汰最久未使用的数据
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._data = OrderedDict()      # {key: (expire_at, value)}
+
+    def get(self, key):
+        """获取缓存，不存在或已过期返回None"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+
+            expire_at, value = item
+            if now >= expire_at:
+                self._data.pop(key, None)
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expire_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+
+        return item[1] if item else None
+
+    def pop_by(self, predicate):
+        """
+        删除所有满足条件的缓存
+
+        :param predicate: function. 参数为缓存值，返回True表示删除
+        :return: int. 删除数量
+        """
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(v)]
+            for k in keys:
+                self._data.pop(k, None)
+
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/18
+Last Modified: 2024/12/18
+Description: excel分块读取（只读模式逐行读取，每块转换为dict列表，内存占用不随行数增长）
+"""
+import tempfile
+
+import requests
+import openpyxl
+import pandas as pd
+
+
+class ExcelColumnError(Exception):
+    """excel列头与档案配置不匹配"""
+    pass
+
+
+def download_excel(excel_url, spool_size=16 * 1024 * 1024, on_chunk=None):
+    """
+    下载excel文件，较大的文件写入临时文件
+
+    :param excel_url: str. 文件URL
+    :param spool_size: int. 超过此大小时写入磁盘
+    :param on_chunk: function. 每下载1MB调用一次，无参数（后台任务更新heartbeat）
+    :return: file. 可seek的文件对象，调用方负责关闭
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    try:
+        with requests.get(excel_url, stream=True, timeout=(10, 60)) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                file.write(chunk)
+                if on_chunk is not None:
+                    on_chunk()
+    except BaseException:
+        file.close()
+        raise
+
+    file.seek(0)
+    return file
+
+
+def count_excel_rows(file):
+    """
+    第一个工作表的数据行数（不含列头），根据工作表记录的范围估算，不逐行读取
+
+    :return: int or None. 工作表没有记录范围时返回None
+    """
+    workbook = openpyxl.load_workbook(file, read_only=True)
+    try:
+        max_row = workbook.worksheets[0].max_row
+    finally:
+        workbook.close()
+
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    if max_row is None:
+        return None
+    return max(max_row - 1, 0)
+
+
+def iter_excel_chunks(file, column_names, chunk_size=1000):
+    """
+    分块读取第一个工作表，第一行为列头
+
+    说明：
+        1. 列头只在开始时与column_names匹配一次，excel中缺少的列报错，多出的列忽略。
+        2. 每块用DataFrame整体转换：只保留档案配置中的列并按其顺序排列，空单元格置为空字符串。
+        3. 整行为空的行跳过（例如只设置了格式的行）。
+
+    :param file: str or file. excel文件
+    :param column_names: list. 档案配置中的列名
+    :param chunk_size: int. 每块行数
+    :return: generator. 每次返回一块，[{列名: 值}, ...]
+    """
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+
+        header = next(rows, None) or ()
+        header = [None if h is None else str(h).strip() for h in header]
+
+        missing_columns = [c for c in column_names if c not in header]
+        if missing_columns:
+            raise ExcelColumnError(f"excel中缺少列：{'，'.join(missing_columns)}")
+
+        # 档案配置中各列在excel中的位置（列名重复时取第一个）
+        positions = [header.index(c) for c in column_names]
+
+        def convert(chunk):
+            df = pd.DataFrame(chunk, dtype=object).reindex(columns=positions)
+            df.columns = column_names
+            df = df.dropna(how="all")
+            df = df.where(df.notna(), "")
+            return df.to_dict("records")
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                records = convert(chunk)
+                if records:
+                    yield records
+                chunk = []
+
+        if chunk:
+            records = convert(chunk)
+            if records:
+                yield records
+    finally:
+        workbook.close()
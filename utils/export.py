@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/17
+Last Modified: 2024/12/17
+Description: 表格导出（xlsx/csv，逐行写入、边生成边输出，内存占用不随行数增长）
+"""
+import io
+import re
+import csv
+import math
+import zipfile
+import datetime
+from xml.sax.saxutils import escape
+
+
+# xml 1.0不允许的控制字符
+_ILLEGAL_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """
+    只能追加写入的缓冲区，每次取出已写入的数据后清空
+
+    不支持seek，zipfile会按流式方式写入（每个文件后附加数据描述符）；tell返回已写入的总长度。
+    """
+    def __init__(self):
+        super(_ChunkBuffer, self).__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _column_letter(index):
+    """列序号（从0开始）转为列名，0 -> A，26 -> AA"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _format_text(value):
+    """日期按文本导出，其他类型（ObjectId、列表等）转为字符串"""
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+    return str(value)
+
+
+class XlsxStreamWriter:
+    """
+    流式xlsx，只有一个工作表
+
+    说明：
+        1. 单元格使用内联字符串（inlineStr），不需要共享字符串表，写完一行即可输出。
+        2. 数字写为数值，布尔写为布尔，空值不写单元格，其他按文本写入。
+        3. xlsx每个工作表最多MAX_ROWS行（含表头），超出的行不写入；调用方应在生成前检查行数，数据量更大时使用csv导出。
+    """
+    MAX_ROWS = 1048576
+
+    def __init__(self, column_names, sheet_name="Sheet1"):
+        self.column_names = list(column_names)
+        self.sheet_name = sheet_name
+        self.column_letters = [_column_letter(i) for i in range(len(self.column_names))]
+        self.row_count = 0
+
+        self.buffer = _ChunkBuffer()
+        self.zip_file = zipfile.ZipFile(self.buffer, "w", compression=zipfile.ZIP_DEFLATED)
+        self.sheet = None
+
+    def _write_file(self, name, content):
+        self.zip_file.writestr(name, content.encode("utf-8"))
+
+    def begin(self):
+        self._write_file("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '</Types>'
+        ))
+        self._write_file("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ))
+        self._write_file("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(self.sheet_name, {chr(34): "&quot;"})}" sheetId="1" r:id="rId1"/>'
+            '</sheets></workbook>'
+        ))
+        self._write_file("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            'Target="worksheets/sheet1.xml"/>'
+            '</Relationships>'
+        ))
+
+        self.sheet = self.zip_file.open("xl/worksheets/sheet1.xml", "w")
+        self.sheet.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        ).encode("utf-8"))
+        # 表头
+        return self.write_rows([self.column_names])
+
+    def _make_cell(self, reference, value):
+        if value is None or value == "":
+            return ""
+
+        if isinstance(value, bool):
+            return f'<c r="{reference}" t="b"><v>{int(value)}</v></c>'
+
+        if isinstance(value, (int, float)) and not (isinstance(value, float) and not math.isfinite(value)):
+            return f'<c r="{reference}"><v>{value!r}</v></c>'
+
+        text = escape(_ILLEGAL_XML_CHARS.sub("", _format_text(value)))
+        return f'<c r="{reference}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+    def write_rows(self, rows):
+        """
+        写入多行
+
+        :param rows: list. 每行为与column_names顺序一致的值列表
+        :return: bytes. 本次可以输出的数据（压缩后不足一个块时可能为空）
+        """
+        parts = []
+        for row in rows:
+            if self.row_count >= self.MAX_ROWS:
+                break
+
+            self.row_count += 1
+            cells = "".join(self._make_cell(f"{letter}{self.row_count}", value)
+                            for letter, value in zip(self.column_letters, row))
+            parts.append(f'<row r="{self.row_count}">{cells}</row>')
+
+        if parts:
+            self.sheet.write("".join(parts).encode("utf-8"))
+        return self.buffer.drain()
+
+    def end(self):
+        self.sheet.write(b"</sheetData></worksheet>")
+        self.sheet.close()
+        self.zip_file.close()
+        return self.buffer.drain()
+
+
+def _iter_row_batches(column_names, datas, batch_size):
+    """按列顺序取值，每batch_size行返回一次"""
+    rows = []
+    for data in datas:
+        rows.append([data.get(column) for column in column_names])
+        if len(rows) >= batch_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def generate_xlsx(column_names, datas, batch_size=1000):
+    """
+    生成xlsx，每次返回一段数据，可直接作为流式响应
+
+    :param column_names: list. 列名，按此顺序输出
+    :param datas: iterable. 每行一个dict，可以是数据库游标
+    :param batch_size: int. 每多少行输出一次
+    :return: generator. bytes
+    """
+    writer = XlsxStreamWriter(column_names)
+    yield writer.begin()
+    for rows in _iter_row_batches(column_names, datas, batch_size):
+        data = writer.write_rows(rows)
+        if data:
+            yield data
+    yield writer.end()
+
+
+def generate_csv(column_names, datas, batch_size=1000):
+    """
+    生成csv（UTF-8带BOM，Excel可直接打开），参数同generate_xlsx
+
+    :return: generator. bytes
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(column_names)
+    yield "\ufeff".encode("utf-8") + buffer.getvalue().encode("utf-8")
+
+    for rows in _iter_row_batches(column_names, datas, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([["" if value is None else _format_text(value) for value in row] for row in rows])
+        yield buffer.getvalue().encode("utf-8")
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/3
+Last Modified: 2024/12/3
+Description: 用户身份（用户+企业）解析与缓存
+"""
+import datetime
+
+from bson import ObjectId
+
+from app.extentions import mongo
+from utils.cache import TTLCache
+
+
+class IdentityResolver:
+    """
+    根据用户id（或手机号）查询用户及其所在企业
+
+    用户、备用的管理员用户、企业通过一次聚合查询取回（$unionWith + $lookup），
+    鉴权装饰器和三个登录接口共用。需要MongoDB 4.4及以上版本。
+    """
+    # 按顺序查找用户的集合，排在前面的优先
+    USER_COLLECTIONS = ("user", "admin_user")
+
+    @staticmethod
+    def _make_enterprise_info(enterprise):
+        """
+        提取鉴权需要的企业字段，授权周期在此处解析为datetime，避免每次请求都解析
+
+        :param enterprise: dict. 企业文档
+        :return: dict.
+        """
+        return {
+            "id": str(enterprise.get("_id")),
+            "db_name": enterprise.get("db_name"),
+            "status": enterprise.get("status"),
+            "is_delete": enterprise.get("is_delete"),
+            "start_dt": datetime.datetime.strptime(enterprise.get("start_date"), "%Y-%m-%d"),
+            "end_dt": datetime.datetime.strptime(enterprise.get("end_date"), "%Y-%m-%d"),
+        }
+
+    @staticmethod
+    def _user_pipeline(condition, priority):
+        """单个用户集合的查询阶段"""
+        return [
+            {"$match": condition},
+            {"$limit": 1},
+            {"$addFields": {"_priority": priority}}
+        ]
+
+    @classmethod
+    def make_pipeline(cls, condition, collections):
+        """
+        构造聚合管道
+
+        :param condition: dict. 用户查询条件
+        :param collections: tuple. 用户集合，第一个集合作为聚合入口
+        :return: list.
+        """
+        pipeline = cls._user_pipeline(condition, 0)
+
+        for priority, collection_name in enumerate(collections[1:], start=1):
+            pipeline.append({
+                "$unionWith": {
+                    "coll": collection_name,
+                    "pipeline": cls._user_pipeline(condition, priority)
+                }
+            })
+
+        pipeline.extend([
+            {"$sort": {"_priority": 1}},
+            {"$limit": 1},
+            # 用户中enterprise_id为字符串，企业_id为ObjectId
+            {"$lookup": {
+                "from": "enterprise",
+                "let": {
+                    "enterprise_id": {
+                        "$convert": {"input": "$enterprise_id", "to": "objectId", "onError": None, "onNull": None}
+                    }
+                },
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$_id", "$$enterprise_id"]}}},
+                    {"$limit": 1}
+                ],
+                "as": "_enterprise"
+            }}
+        ])
+        return pipeline
+
+    @classmethod
+    def find(cls, condition, collections=None):
+        """
+        查询用户及其所在企业（一次数据库往返）
+
+        :param condition: dict. 用户查询条件，例如{'_id': ObjectId}、{'phone_number': str}
+        :param collections: tuple. 在哪些用户集合中查找，默认USER_COLLECTIONS
+        :return: dict or None. 用户不存在返回None
+            {
+                'user': {用户文档},
+                'has_company': bool. 是否为企业用户，False表示系统管理员,
+                'enterprise': {企业信息} or None. 企业不存在时为None
+            }
+        """
+        if collections is None:
+            collections = cls.USER_COLLECTIONS
+
+        pipeline = cls.make_pipeline(condition, collections)
+        result = list(mongo.db[collections[0]].aggregate(pipeline))
+        if not result:
+            return None
+
+        user = result[0]
+        collection_name = collections[user.pop("_priority")]
+        enterprise_list = user.pop("_enterprise")
+
+        enterprise_info = None
+        if enterprise_list:
+            enterprise_info = cls._make_enterprise_info(enterprise_list[0])
+
+        identity = {
+            "user": user,
+            "has_company": collection_name == "user",
+            "enterprise": enterprise_info
+        }
+        return identity
+
+    @classmethod
+    def resolve(cls, user_id):
+        """
+        根据token中的用户id查询用户身份
+
+        :param user_id: str. 用户id
+        :return: dict or None. 同find
+        """
+        identity = cls.find({"_id": ObjectId(user_id)})
+        if identity and identity.get("has_company") and not identity.get("enterprise"):
+            raise Exception("用户所在企业不存在")
+
+        return identity
+
+
+class IdentityCache:
+    """
+    用户身份缓存（每个worker进程一份）
+
+    缓存key为用户id，value为IdentityResolver.resolve的返回值。
+
+    说明：
+        1. 修改/删除用户、修改企业信息/状态时，需要调用invalidate_user/invalidate_enterprise。
+        2. 主动失效只作用于处理该写请求的worker，其他worker依赖TTL过期，
+        所以停用企业最多延迟IDENTITY_CACHE_TTL_SECONDS秒生效。
+        3. 企业授权周期在每次请求时用缓存中的日期重新判断，不受TTL影响。
+    """
+    _cache = TTLCache(ttl=30, max_size=10000)
+    enabled = True
+
+    @classmethod
+    def init_app(cls, app):
+        cls.enabled = app.config.get("IDENTITY_CACHE_ENABLED", True)
+        cls._cache = TTLCache(
+            ttl=app.config.get("IDENTITY_CACHE_TTL_SECONDS", 30),
+            max_size=app.config.get("IDENTITY_CACHE_MAX_SIZE", 10000)
+        )
+
+    @classmethod
+    def get(cls, user_id):
+        """
+        获取用户身份，缓存未命中时查询数据库
+
+        :param user_id: str. 用户id
+        :return: dict or None.
+        """
+        if cls.enabled:
+            identity = cls._cache.get(user_id)
+            if identity is not None:
+                return identity
+
+        identity = IdentityResolver.resolve(user_id)
+        if identity is not None and cls.enabled:
+            cls._cache.set(user_id, identity)
+
+        return identity
+
+    @classmethod
+    def invalidate_user(cls, user_id):
+        """用户信息变更时调用"""
+        cls._cache.pop(str(user_id))
+
+    @classmethod
+    def invalidate_enterprise(cls, enterprise_id):
+        """企业信息变更时调用，删除该企业下所有用户的缓存"""
+        enterprise_id = str(enterprise_id)
+        cls._cache.pop_by(lambda identity: identity.get("enterprise") is not None
+                          and identity["enterprise"].get("id") == enterprise_id)
+
+    @classmethod
+    def clear(cls):
+        cls._cache.clear()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/19
+Last Modified: 2024/12/19
+Description: 后台任务执行（与请求线程分开，耗时操作不占用uwsgi线程）
+"""
+import os
+import time
+import threading
+import traceback
+
+from app.models.job import Job
+
+
+class JobCancelled(Exception):
+    """任务已被取消（执行中检查到cancel_requested时抛出）"""
+    pass
+
+
+class JobContext:
+    """
+    传给任务处理函数的上下文
+
+    - job: dict. 任务
+    - params: dict. 任务参数
+    - result: 处理函数可以设置任务结果
+    - errors: 处理函数可以追加错误信息（任务仍可成功，例如部分行写入失败）
+
+    不更新进度的耗时步骤（例如下载文件）中应定期调用heartbeat，否则超过JOB_STALE_SECONDS会被其他worker标记失败。
+    """
+    # heartbeat最短间隔（秒），频繁调用时只有间隔超过此值才写数据库
+    HEARTBEAT_INTERVAL = 10
+
+    def __init__(self, job):
+        self.job = job
+        self.job_id = str(job.get("_id"))
+        self.params = job.get("params") or {}
+        self.result = None
+        self.errors = []
+        self.last_heartbeat = time.monotonic()
+
+    def update_progress(self, stage, done, total=None):
+        """
+        更新进度，同时检查是否已被取消
+
+        :raise JobCancelled: 已请求取消，或任务已不由本worker执行
+        """
+        self.last_heartbeat = time.monotonic()
+        if Job().update_progress(self.job_id, stage, done, total):
+            raise JobCancelled()
+
+    def heartbeat(self):
+        """
+        表示任务仍在执行（距上次超过HEARTBEAT_INTERVAL时才写数据库），同时检查是否已被取消
+
+        :raise JobCancelled: 同update_progress
+        """
+        if time.monotonic() - self.last_heartbeat < self.HEARTBEAT_INTERVAL:
+            return
+
+        self.last_heartbeat = time.monotonic()
+        if Job().heartbeat(self.job_id):
+            raise JobCancelled()
+
+
+class JobWorker:
+    """
+    后台任务执行线程
+
+    说明：
+        1. 每个worker进程JOB_WORKER_THREADS个执行线程，首次请求时启动（fork之后），进程id变化时重新启动。
+        2. 任务保存在主库jobs集合（见app.models.job.Job），执行线程领取等待中的任务，没有任务时每
+           JOB_POLL_INTERVAL_SECONDS秒检查一次；本进程提交的任务立即唤醒执行线程。
+           任何一个worker都可以执行其他worker提交的任务，worker重启后等待中的任务也不会丢失。
+        3. 使用线程而不是进程：导入主要耗时在下载文件、读取excel和写数据库，二维码渲染已在进程池中执行；
+           线程可以共享worker的数据库连接池和app配置。
+        4. 任务处理函数在app上下文中执行，参数为JobContext，返回后任务为SUCCESS，抛出JobCancelled为CANCELLED，
+           其他异常为FAILED。
+        5. 任务被fail_stale标记失败时调用注册的on_stale（参数为任务），恢复任务修改过的状态（例如档案的导入状态）。
+    """
+    _lock = threading.Lock()
+    _pid = None
+    _threads = []
+    _wakeup = None
+    _stopping = False
+
+    _app = None
+    _handlers = {}          # {job_type: 处理函数}
+    _stale_handlers = {}    # {job_type: 任务被标记失败时调用的函数}
+
+    # 配置，init_app时从settings.py读取
+    threads = 1
+    poll_interval = 5.0
+    stale_seconds = 600
+
+    @classmethod
+    def init_app(cls, app):
+        cls._app = app
+        cls.threads = app.config.get("JOB_WORKER_THREADS", cls.threads)
+        cls.poll_interval = app.config.get("JOB_POLL_INTERVAL_SECONDS", cls.poll_interval)
+        cls.stale_seconds = app.config.get("JOB_STALE_SECONDS", cls.stale_seconds)
+
+        if cls.threads > 0:
+            app.before_request(cls.ensure_started)
+
+    @classmethod
+    def register(cls, job_type, handler, on_stale=None):
+        """
+        注册任务处理函数
+
+        :param job_type: str. 任务类型
+        :param handler: function. 参数为JobContext
+        :param on_stale: function. 任务被fail_stale标记失败后调用，参数为任务dict
+        """
+        cls._handlers[job_type] = handler
+        if on_stale is not None:
+            cls._stale_handlers[job_type] = on_stale
+
+    @classmethod
+    def ensure_started(cls):
+        """启动执行线程（当前进程还没有执行线程时）"""
+        pid = os.getpid()
+        if cls._pid == pid:
+            return
+
+        with cls._lock:
+            if cls._pid == pid:
+                return
+
+            cls._stopping = False
+            cls._wakeup = threading.Event()
+            cls._threads = []
+            for index in range(cls.threads):
+                thread = threading.Thread(target=cls._run, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                cls._threads.append(thread)
+            cls._pid = pid
+
+    @classmethod
+    def submit(cls, job_type, enterprise_id, user_id, params, active_key=None):
+        """
+        提交任务（请求线程调用，不等待执行）
+
+        :param active_key: str. 见Job.create
+        :return: str. 任务id
+        :raise DuplicateKeyError: 已有相同active_key的等待中/执行中任务
+        """
+        job_id = Job().create(job_type, enterprise_id, user_id, params, active_key)
+
+        cls.ensure_started()
+        cls._wakeup.set()
+        return job_id
+
+    @classmethod
+    def _run(cls):
+        last_stale_check = 0
+        while not cls._stopping:
+            # 先清除再领取，领取之后提交的任务会使wait立即返回
+            cls._wakeup.clear()
+            try:
+                if time.monotonic() - last_stale_check >= cls.stale_seconds / 2:
+                    cls._recover_stale(Job().fail_stale(cls.stale_seconds))
+                    last_stale_check = time.monotonic()
+
+                job = Job().claim(list(cls._handlers))
+            except Exception:
+                traceback.print_exc()
+                job = None
+
+            if job is None:
+                cls._wakeup.wait(cls.poll_interval)
+                continue
+
+            try:
+                cls._execute(job)
+            except Exception:
+                # 写入任务结果失败（例如数据库不可用），任务由fail_stale标记失败
+                traceback.print_exc()
+
+    @classmethod
+    def _recover_stale(cls, jobs):
+        for job in jobs:
+            on_stale = cls._stale_handlers.get(job.get("job_type"))
+            if on_stale is None:
+                continue
+
+            try:
+                with cls._app.app_context():
+                    on_stale(job)
+            except Exception:
+                traceback.print_exc()
+
+    @classmethod
+    def _execute(cls, job):
+        context = JobContext(job)
+        handler = cls._handlers[job.get("job_type")]
+
+        try:
+            with cls._app.app_context():
+                handler(context)
+        except JobCancelled:
+            Job().finish(context.job_id, Job.CANCELLED, context.result, context.errors)
+        except Exception as e:
+            traceback.print_exc()
+            Job().finish(context.job_id, Job.FAILED, context.result, context.errors + [str(e)])
+        else:
+            Job().finish(context.job_id, Job.SUCCESS, context.result, context.errors)
+
+    @classmethod
+    def stop(cls, timeout=10):
+        """worker退出时调用：不再领取新任务，等待执行中的任务结束（超时后随进程退出，任务由fail_stale标记失败）"""
+        if cls._pid != os.getpid() or not cls._threads:
+            return
+
+        cls._stopping = True
+        cls._wakeup.set()
+        deadline = time.monotonic() + timeout
+        for thread in cls._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        cls._threads = []
+        cls._pid = None
@@ -6,17 +6,16 @@ Last Modified: 2023/4/24
 Description: 
 """
 import time
-import datetime
+import hashlib
 from functools import wraps
 
 import jwt
 from jwt.exceptions import PyJWTError
-from bson import ObjectId
-from flask import current_app
 
 from utils.response import ResponseMaker
-from app.extentions import mongo
-from utils.mongo import Mongo
+from utils.mongo import MongoRegistry
+from utils.identity import IdentityCache
+from utils.cache import TTLCache
 from utils.dt import DateTime
 
 
@@ -24,6 +23,16 @@ class JWTUtil:
     token_expire_time = 3600 * 12       # token过期时间，12小时
     secret = 'secret'                   # 秘钥
     algorithm = 'HS256'                 # 加密算法
+    verified_cache_size = 4096          # 已校验token缓存数量
+
+    # 已校验通过的token，{token摘要: (用户id, 过期时间)}
+    # 同一token再次请求时，只需比较过期时间，不再解析和校验签名
+    _verified_cache = TTLCache(ttl=token_expire_time, max_size=verified_cache_size)
+
+    @staticmethod
+    def _get_utc_timestamp():
+        """当前UTC时间戳(秒)，与time.mktime(datetime.datetime.utcnow().utctimetuple())等价"""
+        return time.mktime(time.gmtime())
 
     @classmethod
     def create_token(cls, user_id):
@@ -33,7 +42,7 @@ class JWTUtil:
         :param user_id: int. 用户id
         """
         # 当前UTC时间戳
-        utc_timestamp = time.mktime(datetime.datetime.utcnow().utctimetuple())
+        utc_timestamp = cls._get_utc_timestamp()
         # 过期UTC时间戳(秒)
         utc_expire_time = utc_timestamp + cls.token_expire_time
         # 秒转为毫秒
@@ -59,24 +68,56 @@ class JWTUtil:
         """
         try:
             # 如果token中不含有“Bearer”, 报错
-            if "Bearer" not in token:
+            if not token or "Bearer" not in token:
                 return {'result': False, 'msg': "Token格式错误", "code": 1}
 
             # 参数token格式: "Bearer {token}"，所以需要获取原始token
             raw_token = token.split('Bearer ')[1]
 
-            # 解析token
-            payload = jwt.decode(raw_token, cls.secret, algorithms=[cls.algorithm])
+            # 先查已校验缓存，未命中再解析token
+            digest = hashlib.sha256(raw_token.encode()).digest()
+            verified = cls._verified_cache.get(digest)
+            if verified is None:
+                payload = jwt.decode(raw_token, cls.secret, algorithms=[cls.algorithm])
+                verified = (payload.get('id'), payload.get("token_expires"))
+                cls._verified_cache.set(digest, verified)
         except PyJWTError:
             return {'result': False, 'msg': "Token解析失败", "code": 1}
 
         # 校验过期时间
-        token_expires = payload.get("token_expires")
-        current_utc_timestamp = time.mktime(datetime.datetime.utcnow().utctimetuple())
+        user_id, token_expires = verified
+        current_utc_timestamp = cls._get_utc_timestamp()
         if current_utc_timestamp > token_expires:
+            cls._verified_cache.pop(digest)
             return {'result': False, 'msg': "Token过期", 'code': 2}
 
-        return {'result': True, 'msg': "Token合法", 'id': payload.get('id'), 'code': 0}
+        return {'result': True, 'msg': "Token合法", 'id': user_id, 'code': 0}
+
+    @classmethod
+    def get_request_token(cls, request):
+        """从请求头或查询参数中获取token"""
+        token = request.headers.get("Authorization")
+
+        # 如果header中没有，再到查询参数中找
+        if not token:
+            token = request.args.get("Authorization")
+
+        return token
+
+    @classmethod
+    def verify_request(cls, request):
+        """
+        校验请求中的token，结果保存在request.token_result中，同一请求只校验一次
+
+        :param request: flask.request.
+        :return: dict. 同verify_token
+        """
+        result = getattr(request, "token_result", None)
+        if result is None:
+            result = cls.verify_token(cls.get_request_token(request))
+            request.token_result = result
+
+        return result
 
     @classmethod
     def verify_token_decorator(cls, request):
@@ -87,42 +128,33 @@ class JWTUtil:
 
             @wraps(func)
             def wrapper(*args, **kwargs):
-                token = request.headers.get("Authorization")
-
-                # 如果header中没有，再到查询参数中找
-                if not token:
-                    token = request.args.get("Authorization")
+                token = cls.get_request_token(request)
 
                 # 如果查询参数中也没有，报错处理
                 if not token:
                     return ResponseMaker.token_missing()
 
                 try:
-                    result = cls.verify_token(token)
+                    result = cls.verify_request(request)
 
                     if result.get("code") == 1:
                         return ResponseMaker.token_error()
                     elif result.get("code") == 2:
                         return ResponseMaker.token_expire()
                     elif result.get("code") == 0:
-                        # 获取用户信息
-                        user_id = ObjectId(result.get("id"))
-                        user = mongo.db.user.find_one({"_id": user_id})
-                        has_company = True
-                        if not user:
-                            # 如果企业用户查不到，表示是系统用户
-                            has_company = False
-                            user = mongo.db.admin_user.find_one({"_id": user_id})
-
-                        if not user:
-                            # 还是没有用户，说明用户id错误或用户被删除
+                        # 获取用户信息（优先从进程内缓存读取）
+                        identity = IdentityCache.get(result.get("id"))
+
+                        if not identity:
+                            # 没有用户，说明用户id错误或用户被删除
                             raise Exception("用户id错误或用户被删除")
 
+                        # 复制一份，避免请求中修改影响缓存
+                        user = dict(identity.get("user"))
                         request.user = user
 
-                        if has_company:
-                            enterprise_id = user.get("enterprise_id")
-                            enterprise = mongo.db.enterprise.find_one({"_id": ObjectId(enterprise_id)})
+                        if identity.get("has_company"):
+                            enterprise = identity.get("enterprise")
                             db_name = enterprise.get("db_name")
 
                             # 检查企业状态
@@ -135,16 +167,13 @@ class JWTUtil:
 
                             # 检查企业授权周期
                             current_dt = DateTime.get_datetime_now()
-                            start_dt = datetime.datetime.strptime(enterprise.get("start_date"), "%Y-%m-%d")
-                            end_dt = datetime.datetime.strptime(enterprise.get("end_date"), "%Y-%m-%d")
+                            start_dt = enterprise.get("start_dt")
+                            end_dt = enterprise.get("end_dt")
                             if current_dt < start_dt or current_dt > end_dt:
                                 return ResponseMaker.enterprise_authorization_deprecated()
 
-                            # 对应数据库连接
-                            host = current_app.config["MONGO_HOST"]
-                            port = current_app.config["MONGO_PORT"]
-                            db = Mongo(host, port)
-                            request.db = db.get_db_by_name(db_name)
+                            # 对应数据库连接（进程内共享连接池）
+                            request.db = MongoRegistry.get_db(db_name)
 
                     return func(args, kwargs)
                 except jwt.ExpiredSignatureError as e:
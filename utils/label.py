@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/16
+Last Modified: 2024/12/16
+Description: 二维码标签页（PDF，逐页生成、边生成边输出）
+"""
+import zlib
+import threading
+
+
+class LabelExportLimit:
+    """
+    每个worker同时导出标签的数量限制
+
+    标签PDF边渲染边输出，导出期间占用一个uwsgi线程（等待进程池渲染、等待客户端接收）。
+    已生成的文件没有可共享的存储位置（image集合单个文档不能超过16MB），不改为后台任务；
+    限制同时导出的数量（QR_LABEL_MAX_EXPORTS），超出时直接返回，其他请求仍有可用线程。
+    """
+    max_exports = 2
+
+    _semaphore = threading.BoundedSemaphore(max_exports)
+
+    @classmethod
+    def init_app(cls, app):
+        cls.max_exports = app.config.get("QR_LABEL_MAX_EXPORTS", cls.max_exports)
+        cls._semaphore = threading.BoundedSemaphore(cls.max_exports)
+
+    @classmethod
+    def acquire(cls):
+        """
+        占用一个导出名额（不等待）
+
+        :return: bool. False表示已达到上限
+        """
+        return cls._semaphore.acquire(blocking=False)
+
+    @classmethod
+    def release(cls):
+        """导出结束（响应关闭）时释放名额"""
+        cls._semaphore.release()
+
+
+class LabelLayout:
+    """
+    标签排版，单位为pt（1/72英寸），默认A4纸4列6行
+
+    每个标签上方为二维码，下方两行文字：种子名称、种子编号。
+    """
+    def __init__(self, page_width=595, page_height=842, columns=4, rows=6, margin=24,
+                 font_size=9, line_height=12):
+        self.page_width = page_width
+        self.page_height = page_height
+        self.columns = columns
+        self.rows = rows
+        self.margin = margin
+        self.font_size = font_size
+        self.line_height = line_height
+
+        self.cell_width = (page_width - margin * 2) / columns
+        self.cell_height = (page_height - margin * 2) / rows
+        # 二维码边长，留出两行文字和上下间距
+        self.qr_size = min(self.cell_width, self.cell_height - line_height * 2) - 8
+
+    @property
+    def labels_per_page(self):
+        return self.columns * self.rows
+
+    def get_cell_origin(self, index):
+        """第index个标签的左上角坐标（PDF坐标原点在左下角）"""
+        column = index % self.columns
+        row = index // self.columns
+        x = self.margin + column * self.cell_width
+        y = self.page_height - self.margin - row * self.cell_height
+        return x, y
+
+
+def _fit_text(text, max_width, font_size):
+    """按宽度截断文字，中文按1个字宽，ASCII按半个字宽估算"""
+    text = "" if text is None else str(text)
+    width = 0
+    for index, char in enumerate(text):
+        width += font_size * (0.5 if ord(char) < 128 else 1)
+        if width > max_width:
+            return text[:max(index - 1, 0)] + "…"
+
+    return text
+
+
+def _encode_text(text):
+    """UniGB-UCS2-H编码（UCS-2大端），不在基本平面的字符跳过"""
+    return "".join(f"{ord(char):04X}" for char in text if ord(char) <= 0xFFFF)
+
+
+def render_label_page(renderer, layout, labels):
+    """
+    生成一页标签的PDF内容流（在进程池中执行，需要是模块级函数）
+
+    :param renderer: utils.qr.QRRenderer. 二维码渲染配置
+    :param layout: LabelLayout. 排版
+    :param labels: list. [(二维码内容, 种子名称, 种子编号), ...]，不超过layout.labels_per_page
+    :return: bytes. 压缩后的内容流
+    """
+    commands = ["0 g"]
+    for index, (qr_data, name, code) in enumerate(labels):
+        x, y = layout.get_cell_origin(index)
+
+        # 二维码：每行相邻的黑色模块合并为一个矩形
+        qr_code = renderer.make(qr_data)
+        modules = qr_code.modules
+        module_size = layout.qr_size / (len(modules) + renderer.border * 2)
+        qr_left = x + (layout.cell_width - layout.qr_size) / 2 + renderer.border * module_size
+        qr_top = y - 4 - renderer.border * module_size
+
+        for row_index, row in enumerate(modules):
+            top = qr_top - row_index * module_size
+            column_index = 0
+            while column_index < len(row):
+                if not row[column_index]:
+                    column_index += 1
+                    continue
+
+                start = column_index
+                while column_index < len(row) and row[column_index]:
+                    column_index += 1
+                commands.append(f"{qr_left + start * module_size:.2f} {top - module_size:.2f} "
+                                f"{(column_index - start) * module_size:.2f} {module_size:.2f} re")
+        commands.append("f")
+
+        # 文字
+        text_left = x + 6
+        text_top = y - 4 - layout.qr_size - layout.line_height
+        for line_index, text in enumerate((name, code)):
+            text = _fit_text(text, layout.cell_width - 12, layout.font_size)
+            if not text:
+                continue
+            commands.append(f"BT /F1 {layout.font_size} Tf {text_left:.2f} "
+                            f"{text_top - line_index * layout.line_height:.2f} Td <{_encode_text(text)}> Tj ET")
+
+    return zlib.compress("\n".join(commands).encode("ascii"))
+
+
+class PdfStreamWriter:
+    """
+    逐页输出的PDF
+
+    对象编号固定：1目录，2页面树（最后输出），3~5字体，之后为各页的内容流和页面。
+    中文使用阅读器内置的STSong-Light字体（Adobe-GB1），不嵌入字体文件。
+    """
+    def __init__(self, layout):
+        self.layout = layout
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 6
+
+    def _object(self, object_id, body):
+        """输出一个对象，记录偏移量，用于最后的交叉引用表"""
+        self.offsets[object_id] = self.offset
+        data = f"{object_id} 0 obj\n".encode("ascii") + body + b"\nendobj\n"
+        self.offset += len(data)
+        return data
+
+    def begin(self):
+        header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self.offset = len(header)
+        return b"".join([
+            header,
+            self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>"),
+            self._object(3, b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+                            b"/DescendantFonts [4 0 R] >>"),
+            self._object(4, b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+                            b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> "
+                            b"/FontDescriptor 5 0 R /DW 1000 /W [1 95 500] >>"),
+            self._object(5, b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 "
+                            b"/FontBBox [-25 -254 1000 880] /ItalicAngle 0 /Ascent 880 /Descent -120 "
+                            b"/CapHeight 880 /StemV 93 >>"),
+        ])
+
+    def add_page(self, content):
+        """
+        :param content: bytes. render_label_page生成的内容流
+        """
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+
+        content_body = f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode("ascii") \
+            + content + b"\nendstream"
+        page_body = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.layout.page_width} "
+                     f"{self.layout.page_height}] /Resources << /Font << /F1 3 0 R >> >> "
+                     f"/Contents {content_id} 0 R >>").encode("ascii")
+        return self._object(content_id, content_body) + self._object(page_id, page_body)
+
+    def end(self):
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        data = self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode("ascii"))
+
+        xref_offset = self.offset
+        size = self.next_id
+        xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for object_id in range(1, size):
+            xref.append(f"{self.offsets[object_id]:010d} 00000 n \n")
+        xref.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        return data + "".join(xref).encode("ascii")
+
+
+def generate_label_pdf(renderer, layout, labels, map_func=None):
+    """
+    生成标签PDF，每次返回一段数据，可直接作为流式响应
+
+    :param renderer: utils.qr.QRRenderer. 二维码渲染配置
+    :param layout: LabelLayout. 排版
+    :param labels: iterable. [(二维码内容, 种子名称, 种子编号), ...]，可以是生成器（例如数据库游标）
+    :param map_func: function. 按顺序执行各页渲染的函数，参数为(func, 参数列表)，默认在当前线程中执行，
+                     传入QRRenderPool.map时在进程池中并行
+    :return: generator. bytes
+    """
+    def iter_pages():
+        page = []
+        for label in labels:
+            page.append(label)
+            if len(page) == layout.labels_per_page:
+                yield renderer, layout, page
+                page = []
+        if page:
+            yield renderer, layout, page
+
+    if map_func is None:
+        contents = (render_label_page(*args) for args in iter_pages())
+    else:
+        contents = map_func(render_label_page, iter_pages())
+
+    writer = PdfStreamWriter(layout)
+    yield writer.begin()
+    for content in contents:
+        yield writer.add_page(content)
+
+    # 没有数据时输出一个空白页，保证是有效的PDF
+    if not writer.page_ids:
+        yield writer.add_page(zlib.compress(b""))
+    yield writer.end()
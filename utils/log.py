@@ -5,10 +5,20 @@ Created Date: 2023/12/11
 Last Modified: 2023/12/11
 Description: 日志工具类
 """
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import queue
+import random
+import threading
 import traceback
 from functools import wraps
 from enum import Enum
 
+from bson import ObjectId
+
 from utils.jwt import JWTUtil
 from app.models.log import RequestLogModel
 from utils.dt import DateTime
@@ -66,6 +76,7 @@ class RequestLogUtil:
             - ip_address: str. 发起请求IP地址
             - user_id: str. 用户id
             - url: str. 完整请求地址
+            - url_rule: str. 路由规则，例如"/client_api/v1/document/<id>"
             - http_method: str. HTTP方法
             - header: dict. 请求头
             - params: dict. 查询参数
@@ -90,6 +101,10 @@ class RequestLogUtil:
         if "url" in kwargs:
             log_data['url'] = kwargs.get("url")
 
+        # 路由规则
+        if "url_rule" in kwargs:
+            log_data['url_rule'] = kwargs.get("url_rule")
+
         # http方法
         if "http_method" in kwargs:
             log_data['http_method'] = kwargs.get("http_method")
@@ -152,70 +167,367 @@ class RequestLogUtil:
     def log(cls, request):
         """
         记录日志（装饰器调用）
+
+        请求结束后组装完整的日志，交给RequestLogWriter在后台批量写入，不阻塞请求线程。
         """
         def decorated(func):
 
             @wraps(func)
             def wrapper(*args, **kwargs):
-                try:
-                    # client_type
-                    client_type = cls.__get_client_type(request.url)
-                    # IP地址
-                    ip_address = request.remote_addr
-                    # 用户id
-                    token = request.headers.environ.get('HTTP_AUTHORIZATION')
-                    check_reuslt= JWTUtil.verify_token(token)
-                    user_id = check_reuslt.get("id")
-                    # url
-                    url = request.url
-                    # http方法
-                    http_method = request.method
-                    # header
-                    header = {
-                        "Authorization": token
-                    }
-                    # params
-                    params = dict(request.args)
-                    # body
-                    if request.mimetype == "application/json":
-                        body = request.get_json() if request.data else {}
-                    else:
-                        body = {}
-                    # 请求收到时间
-                    start_time = DateTime.get_datetime_now_str()
-
-                    log_data = cls.__make_log_data(client_type=client_type, ip_address=ip_address,
-                                                   user_id=user_id, url=url, http_method=http_method,
-                                                   header=header, params=params, body=body,
-                                                   start_time=start_time)
-
-                    # request中记录日志id
-                    request.log_id = RequestLogModel(req=request).create(log_data)
+                # client_type
+                client_type = cls.__get_client_type(request.url)
+                # IP地址
+                ip_address = request.remote_addr
+                # 用户id（鉴权装饰器已校验过token，直接复用校验结果）
+                token = request.headers.environ.get('HTTP_AUTHORIZATION')
+                check_reuslt = JWTUtil.verify_request(request)
+                user_id = check_reuslt.get("id")
+                # url
+                url = request.url
+                url_rule = request.url_rule.rule if request.url_rule is not None else None
+                # http方法
+                http_method = request.method
+                # header
+                header = {
+                    "Authorization": token
+                }
+                # params
+                params = dict(request.args)
+                # body
+                if request.mimetype == "application/json":
+                    body = request.get_json() if request.data else {}
+                else:
+                    body = {}
+                # 请求收到时间
+                start_time = DateTime.get_datetime_now_str()
+
+                log_data = cls.__make_log_data(client_type=client_type, ip_address=ip_address,
+                                               user_id=user_id, url=url, url_rule=url_rule, http_method=http_method,
+                                               header=header, params=params, body=body,
+                                               start_time=start_time)
 
+                # request中记录日志id（id在本地生成，日志写入在请求结束后）
+                log_data["_id"] = ObjectId()
+                request.log_id = str(log_data["_id"])
 
+                result = None
+                try:
                     result = func(args, kwargs)
                 except Exception as e:
                     is_success = False
                     msg = "未知异常"
-                    traceback_msg = traceback.print_exc()
+                    traceback_msg = traceback.format_exc()
                     raise e
                 else:
                     is_success = True
                     msg = "成功"
                     traceback_msg = None
                 finally:
-                    # 请求返回值
-                    return_data = result[0] if result else None
+                    # 请求返回值，按记录策略截断/摘要/采样
+                    return_data = result[0] if isinstance(result, tuple) else None
+                    status_code = result[1] if isinstance(result, tuple) and len(result) > 1 else None
+                    return_data, capture_mode = ResponseCapture.capture(request, return_data, is_success, status_code)
 
                     # 请求结束时间
                     end_time = DateTime.get_datetime_now_str()
 
                     update_log_data = cls.__make_update_log_data(end_time=end_time, is_success=is_success, msg=msg,
                                                                  traceback=traceback_msg, return_data=return_data)
+                    update_log_data["return_data_capture"] = capture_mode
+                    log_data.update(update_log_data)
+
+                    RequestLogWriter.write(RequestLogModel(req=request).db, log_data)
 
-                    RequestLogModel(request).update(request.log_id, update_log_data)
-                    return result
+                return result
 
             return wrapper
 
         return decorated
+
+
+class CaptureModeEnum(Enum):
+    """请求返回值记录方式"""
+    FULL = "FULL"           # 完整记录
+    TRUNCATE = "TRUNCATE"   # 截断为前max_bytes字节
+    HASH = "HASH"           # 只记录sha256和大小
+    SAMPLE = "SAMPLE"       # 按rate采样，采中的按max_bytes截断（未配置max_bytes则完整记录）
+    NONE = "NONE"           # 不记录
+
+
+class ResponseCapture:
+    """
+    请求日志中返回值的记录策略
+
+    settings.py中配置：
+        REQUEST_LOG_CAPTURE_DEFAULT: dict. 默认策略
+        REQUEST_LOG_CAPTURE_RULES: list. [(路由规则, 策略), ...]，按顺序匹配，第一个匹配的生效。
+            路由规则为flask的url_rule（如"/client_api/v1/document/<document_id>/document_data/list"），
+            支持通配符，例如"/api/v1/seed/*"匹配整个命名空间。
+        策略格式：{"mode": CaptureModeEnum值, "max_bytes": int, "rate": float}
+
+    失败的请求（异常、HTTP状态码>=400、业务code不为200）总是完整记录。
+    """
+    default_policy = {"mode": CaptureModeEnum.TRUNCATE.value, "max_bytes": 4096}
+    rules = []
+
+    @classmethod
+    def init_app(cls, app):
+        cls.default_policy = app.config.get("REQUEST_LOG_CAPTURE_DEFAULT", cls.default_policy)
+        cls.rules = app.config.get("REQUEST_LOG_CAPTURE_RULES", [])
+
+    @classmethod
+    def get_policy(cls, request):
+        """根据请求的路由规则获取记录策略"""
+        url_rule = request.url_rule.rule if request.url_rule is not None else request.path
+        for pattern, policy in cls.rules:
+            if fnmatch.fnmatchcase(url_rule, pattern):
+                return policy
+
+        return cls.default_policy
+
+    @staticmethod
+    def is_error(is_success, status_code, return_data):
+        if not is_success:
+            return True
+
+        if status_code is not None and status_code >= 400:
+            return True
+
+        if isinstance(return_data, dict) and return_data.get("code") not in (None, 200):
+            return True
+
+        return False
+
+    @staticmethod
+    def _dumps(return_data):
+        return json.dumps(return_data, ensure_ascii=False, default=str).encode("utf-8")
+
+    @classmethod
+    def _truncate(cls, return_data, max_bytes):
+        """超过max_bytes时，记录截断后的文本和原始大小"""
+        data_bytes = cls._dumps(return_data)
+        if len(data_bytes) <= max_bytes:
+            return return_data
+
+        return {
+            "truncated": True,
+            "size": len(data_bytes),
+            "preview": data_bytes[:max_bytes].decode("utf-8", errors="ignore")
+        }
+
+    @classmethod
+    def capture(cls, request, return_data, is_success, status_code=None):
+        """
+        按策略处理返回值
+
+        :return: tuple. (记录到日志中的返回值, 实际使用的记录方式)
+        """
+        if return_data is None:
+            return None, CaptureModeEnum.NONE.value
+
+        if cls.is_error(is_success, status_code, return_data):
+            return return_data, CaptureModeEnum.FULL.value
+
+        policy = cls.get_policy(request)
+        mode = policy.get("mode", CaptureModeEnum.FULL.value)
+        max_bytes = policy.get("max_bytes")
+
+        if mode == CaptureModeEnum.NONE.value:
+            return None, mode
+
+        if mode == CaptureModeEnum.SAMPLE.value:
+            if random.random() >= policy.get("rate", 1.0):
+                return None, CaptureModeEnum.NONE.value
+
+            if max_bytes is None:
+                return return_data, mode
+
+            return cls._truncate(return_data, max_bytes), mode
+
+        if mode == CaptureModeEnum.TRUNCATE.value:
+            return cls._truncate(return_data, max_bytes or 4096), mode
+
+        if mode == CaptureModeEnum.HASH.value:
+            data_bytes = cls._dumps(return_data)
+            digest = {
+                "sha256": hashlib.sha256(data_bytes).hexdigest(),
+                "size": len(data_bytes)
+            }
+            return digest, mode
+
+        return return_data, CaptureModeEnum.FULL.value
+
+
+class RequestLogWriter:
+    """
+    请求日志后台写入
+
+    请求线程只把日志放入有界队列，由后台线程按数量/时间阈值批量insert_many。
+
+    说明：
+        1. 每个worker进程一个写入线程，首次写日志时启动（fork之后），进程id变化时重新启动。
+        2. 队列积压超过REQUEST_LOG_BUSY_RATIO时，成功请求的日志按REQUEST_LOG_BUSY_SAMPLE_RATE采样，
+        失败请求的日志不采样；队列满时直接丢弃。丢弃和采样数量记录在统计中。
+        3. worker退出时调用stop，写完队列中剩余的日志。
+    """
+    _lock = threading.Lock()
+    _pid = None
+    _queue = None
+    _thread = None
+    _stopping = False
+
+    # 配置，init_app时从settings.py读取
+    enabled = True
+    queue_size = 10000
+    batch_size = 200
+    flush_interval = 1.0
+    busy_ratio = 0.8
+    busy_sample_rate = 0.1
+
+    _stats = {
+        "enqueued": 0,          # 放入队列的日志数
+        "written": 0,           # 写入成功的日志数
+        "dropped": 0,           # 队列满丢弃的日志数
+        "sampled_out": 0,       # 队列积压时被采样跳过的日志数
+        "write_errors": 0,      # 写入失败的日志数
+        "batches": 0,           # 批量写入次数
+    }
+
+    @classmethod
+    def init_app(cls, app):
+        cls.enabled = app.config.get("REQUEST_LOG_ASYNC", True)
+        cls.queue_size = app.config.get("REQUEST_LOG_QUEUE_SIZE", cls.queue_size)
+        cls.batch_size = app.config.get("REQUEST_LOG_BATCH_SIZE", cls.batch_size)
+        cls.flush_interval = app.config.get("REQUEST_LOG_FLUSH_INTERVAL_SECONDS", cls.flush_interval)
+        cls.busy_ratio = app.config.get("REQUEST_LOG_BUSY_RATIO", cls.busy_ratio)
+        cls.busy_sample_rate = app.config.get("REQUEST_LOG_BUSY_SAMPLE_RATE", cls.busy_sample_rate)
+
+    @classmethod
+    def _incr(cls, name, value=1):
+        with cls._lock:
+            cls._stats[name] += value
+
+    @classmethod
+    def _ensure_started(cls):
+        """启动写入线程（当前进程还没有写入线程时）"""
+        pid = os.getpid()
+        if cls._pid == pid and cls._thread is not None:
+            return
+
+        with cls._lock:
+            if cls._pid == pid and cls._thread is not None:
+                return
+
+            if cls._pid != pid:
+                # fork出的子进程，统计从0开始
+                cls._stats = dict.fromkeys(cls._stats, 0)
+
+            cls._queue = queue.Queue(maxsize=cls.queue_size)
+            cls._stopping = False
+            cls._thread = threading.Thread(target=cls._run, name="request-log-writer", daemon=True)
+            cls._thread.start()
+            cls._pid = pid
+
+    @classmethod
+    def write(cls, db, log_data, model=RequestLogModel):
+        """
+        写入一条日志（请求线程调用，不阻塞）
+
+        :param db: pymongo.database.Database. 日志所在数据库
+        :param log_data: dict. 完整的日志
+        :param model: class. 日志模型，需要实现create、create_many，默认为请求日志
+        """
+        if not cls.enabled or cls._stopping:
+            model(db=db).create(log_data)
+            return
+
+        cls._ensure_started()
+
+        # 队列积压时，成功请求的日志采样写入
+        if log_data.get("is_success") and cls._queue.qsize() >= cls.queue_size * cls.busy_ratio:
+            if random.random() >= cls.busy_sample_rate:
+                cls._incr("sampled_out")
+                return
+
+        try:
+            cls._queue.put_nowait((db, model, log_data))
+        except queue.Full:
+            cls._incr("dropped")
+        else:
+            cls._incr("enqueued")
+
+    @classmethod
+    def _run(cls):
+        """写入线程：攒够batch_size条或等待flush_interval秒后批量写入"""
+        q = cls._queue
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.monotonic() + cls.flush_interval
+            while len(batch) < cls.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+                try:
+                    item = q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+                if item is None:
+                    # 收到停止信号，写完当前批次后退出
+                    stop = True
+                    break
+
+                batch.append(item)
+
+            if batch:
+                cls._flush(batch)
+
+    @classmethod
+    def _flush(cls, batch):
+        """按日志模型、数据库分组批量写入"""
+        groups = {}
+        for db, model, log_data in batch:
+            key = (model, id(db.client), db.name)
+            groups.setdefault(key, (db, model, []))[2].append(log_data)
+
+        for db, model, log_list in groups.values():
+            try:
+                model(db=db).create_many(log_list)
+            except Exception:
+                cls._incr("write_errors", len(log_list))
+                traceback.print_exc()
+            else:
+                cls._incr("written", len(log_list))
+                cls._incr("batches")
+
+    @classmethod
+    def stop(cls, timeout=10):
+        """
+        停止写入线程，并写完队列中剩余的日志（worker退出时调用）
+
+        最多等待timeout秒：队列已满且写入线程阻塞（例如数据库不可达）时不再等待，剩余日志随进程退出丢弃。
+        """
+        if cls._thread is None or cls._pid != os.getpid():
+            return
+
+        cls._stopping = True
+        deadline = time.monotonic() + timeout
+        try:
+            cls._queue.put(None, timeout=timeout)
+        except queue.Full:
+            print(f"请求日志写入线程阻塞，丢弃队列中的{cls._queue.qsize()}条日志")
+        else:
+            cls._thread.join(max(deadline - time.monotonic(), 0))
+        cls._thread = None
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            stats = dict(cls._stats)
+
+        stats["pid"] = os.getpid()
+        stats["queue_length"] = cls._queue.qsize() if cls._queue is not None and cls._pid == os.getpid() else 0
+        stats["queue_size"] = cls.queue_size
+        return stats
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/7
+Last Modified: 2024/12/7
+Description: 接口性能指标（延迟直方图、状态码、响应字节数；Mongo命令统计见utils/profiler.py）
+"""
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+
+from flask import request
+
+
+# 延迟直方图的桶边界（秒）：1ms ~ 65s，每翻一倍分4个桶，相对误差不超过19%
+LATENCY_BOUNDS = tuple(round(0.001 * 2 ** (i / 4), 6) for i in range(0, 4 * 16 + 1))
+
+# 指标说明，{指标名: (类型, 说明)}
+METRIC_DEFINITIONS = {
+    "http_requests_total": ("counter", "请求数"),
+    "http_request_duration_seconds": ("histogram", "请求耗时"),
+    "http_response_bytes_total": ("counter", "响应字节数"),
+    "mongo_commands_total": ("counter", "Mongo命令数（数据库往返次数）"),
+    "mongo_command_seconds_total": ("counter", "Mongo命令耗时"),
+    "mongo_documents_returned_total": ("counter", "Mongo查询返回的文档数"),
+    "flagged_requests_total": ("counter", "被标记的请求数（slow耗时过长, round_trips往返次数超出预算, repeated_query重复查询）"),
+}
+
+
+class Histogram:
+    """固定桶边界的直方图，多个worker的同名直方图可以直接按桶相加"""
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # 最后一个桶为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts, total, count):
+        for i, c in enumerate(counts):
+            self.counts[i] += c
+        self.sum += total
+        self.count += count
+
+
+class Metrics:
+    """
+    进程内指标注册表
+
+    说明：
+        1. 每个worker进程单独统计，每隔METRICS_DUMP_INTERVAL_SECONDS秒把快照写入METRICS_DIR/{pid}.json，
+        指标接口读取所有存活worker的快照并合并，输出Prometheus文本格式。
+        2. 延迟直方图按路由统计，计数类指标按路由+企业统计。
+    """
+    _lock = threading.Lock()
+    _pid = None
+    _counters = {}          # {(name, labels): value}
+    _histograms = {}        # {(name, labels): Histogram}
+    _last_dump = 0.0
+
+    enabled = True
+    metrics_dir = os.path.join(tempfile.gettempdir(), "intellifield_metrics")
+    dump_interval = 5
+
+    @classmethod
+    def init_app(cls, app):
+        """注册请求钩子"""
+        cls.enabled = app.config.get("METRICS_ENABLED", True)
+        cls.metrics_dir = app.config.get("METRICS_DIR", cls.metrics_dir)
+        cls.dump_interval = app.config.get("METRICS_DUMP_INTERVAL_SECONDS", cls.dump_interval)
+        if not cls.enabled:
+            return
+
+        app.before_request(cls.before_request)
+        app.after_request(cls.after_request)
+
+    @classmethod
+    def _check_fork(cls):
+        """fork出的子进程从0开始统计"""
+        pid = os.getpid()
+        if cls._pid != pid:
+            cls._counters = {}
+            cls._histograms = {}
+            cls._last_dump = 0.0
+            cls._pid = pid
+
+    @classmethod
+    def inc(cls, name, labels, value=1):
+        """
+        :param name: str. 指标名
+        :param labels: tuple. ((标签名, 标签值), ...)
+        :param value: int. 增加值
+        """
+        with cls._lock:
+            cls._check_fork()
+            key = (name, labels)
+            cls._counters[key] = cls._counters.get(key, 0) + value
+
+    @classmethod
+    def observe(cls, name, labels, value):
+        with cls._lock:
+            cls._check_fork()
+            key = (name, labels)
+            histogram = cls._histograms.get(key)
+            if histogram is None:
+                histogram = cls._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @staticmethod
+    def get_request_labels():
+        """
+        当前请求的路由规则和企业id
+
+        :return: tuple. (endpoint, tenant)，未匹配到路由为"unmatched"，未登录为"-"
+        """
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        user = getattr(request, "user", None) or {}
+        tenant = user.get("enterprise_id") or "-"
+        return endpoint, tenant
+
+    @staticmethod
+    def before_request():
+        request.metrics_start = time.perf_counter()
+
+    @classmethod
+    def after_request(cls, response):
+        start = getattr(request, "metrics_start", None)
+        if start is None:
+            return response
+
+        duration = time.perf_counter() - start
+        endpoint, tenant = cls.get_request_labels()
+        method = request.method
+
+        cls.observe("http_request_duration_seconds", (("endpoint", endpoint), ("method", method)), duration)
+        cls.inc("http_requests_total", (("endpoint", endpoint), ("method", method),
+                                        ("status", str(response.status_code)), ("tenant", tenant)))
+        cls.inc("http_response_bytes_total", (("endpoint", endpoint), ("tenant", tenant)),
+                response.content_length or 0)
+
+        if time.monotonic() - cls._last_dump >= cls.dump_interval:
+            cls.dump()
+
+        return response
+
+    @classmethod
+    def snapshot(cls):
+        with cls._lock:
+            cls._check_fork()
+            return {
+                "pid": cls._pid,
+                "counters": [[name, list(labels), value] for (name, labels), value in cls._counters.items()],
+                "histograms": [[name, list(labels), h.counts, h.sum, h.count]
+                               for (name, labels), h in cls._histograms.items()]
+            }
+
+    @classmethod
+    def dump(cls):
+        """把当前进程的快照写入文件，供其他worker合并"""
+        cls._last_dump = time.monotonic()
+        data = cls.snapshot()
+
+        try:
+            os.makedirs(cls.metrics_dir, exist_ok=True)
+            fp = os.path.join(cls.metrics_dir, f"{data['pid']}.json")
+            tmp_fp = f"{fp}.tmp"
+            with open(tmp_fp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_fp, fp)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+        return True
+
+    @classmethod
+    def _load_snapshots(cls):
+        """读取所有存活worker的快照，当前进程使用实时数据；已退出worker的快照文件删除"""
+        snapshots = [cls.snapshot()]
+        own_pid = snapshots[0]["pid"]
+
+        if not os.path.isdir(cls.metrics_dir):
+            return snapshots
+
+        for file_name in os.listdir(cls.metrics_dir):
+            # 只读取"进程id.json"，目录中的其他文件忽略
+            name, ext = os.path.splitext(file_name)
+            if ext != ".json" or not (name.isascii() and name.isdigit()):
+                continue
+
+            fp = os.path.join(cls.metrics_dir, file_name)
+            pid = int(name)
+            if pid == own_pid:
+                continue
+
+            if not cls._is_alive(pid):
+                try:
+                    os.remove(fp)
+                except OSError:
+                    pass
+                continue
+
+            try:
+                with open(fp) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        return snapshots
+
+    @classmethod
+    def collect(cls):
+        """
+        合并所有worker的指标
+
+        :return: tuple. (counters, histograms)
+            counters: {(name, labels): value}
+            histograms: {(name, labels): Histogram}
+        """
+        counters = {}
+        histograms = {}
+        for snapshot in cls._load_snapshots():
+            for name, labels, value in snapshot.get("counters", []):
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+
+            for name, labels, counts, total, count in snapshot.get("histograms", []):
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histogram = histograms[key] = Histogram()
+                histogram.merge(counts, total, count)
+
+        return counters, histograms
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+
+        items = []
+        for k, v in labels:
+            v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            items.append(f'{k}="{v}"')
+        return "{" + ",".join(items) + "}"
+
+    @staticmethod
+    def _format_value(value):
+        if isinstance(value, float) and not value.is_integer():
+            return repr(value)
+        return str(int(value))
+
+    @classmethod
+    def render_prometheus(cls):
+        """输出Prometheus文本格式（text/plain; version=0.0.4）"""
+        counters, histograms = cls.collect()
+
+        lines = []
+        for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+            if metric_type == "histogram":
+                for (metric_name, labels), histogram in sorted(histograms.items()):
+                    if metric_name != name:
+                        continue
+
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds, histogram.counts):
+                        cumulative += count
+                        bucket_labels = labels + (("le", repr(bound)),)
+                        lines.append(f"{name}_bucket{cls._format_labels(bucket_labels)} {cumulative}")
+                    bucket_labels = labels + (("le", "+Inf"),)
+                    lines.append(f"{name}_bucket{cls._format_labels(bucket_labels)} {histogram.count}")
+                    lines.append(f"{name}_sum{cls._format_labels(labels)} {repr(histogram.sum)}")
+                    lines.append(f"{name}_count{cls._format_labels(labels)} {histogram.count}")
+            else:
+                for (metric_name, labels), value in sorted(counters.items()):
+                    if metric_name != name:
+                        continue
+                    lines.append(f"{name}{cls._format_labels(labels)} {cls._format_value(value)}")
+
+        return "\n".join(lines) + "\n"
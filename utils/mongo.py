@@ -5,7 +5,211 @@ Created Date: 2023/12/8
 Last Modified: 2023/12/8
 Description: 封装pymongo
 """
+import os
+import threading
+
 from pymongo import MongoClient
+from pymongo import monitoring
+
+
+# settings.py中连接池配置项与MongoClient参数的映射
+POOL_OPTION_MAPPING = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+}
+
+
+def get_pool_options(config):
+    """
+    从配置中读取连接池参数
+
+    :param config: dict. flask app.config
+    :return: dict. MongoClient关键字参数，未配置的项不返回
+    """
+    options = {}
+    for config_key, option_name in POOL_OPTION_MAPPING.items():
+        value = config.get(config_key)
+        if value is not None:
+            options[option_name] = value
+
+    return options
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    连接池事件监听器，统计连接池使用情况
+
+    pymongo没有公开连接池的实时状态，通过监听连接池事件自行累计。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0            # 累计创建连接数
+        self.closed = 0             # 累计关闭连接数
+        self.checked_out = 0        # 累计借出次数
+        self.checked_in = 0         # 累计归还次数
+        self.checkout_failed = 0    # 借出失败次数（等待超时、连接失败等）
+        self.pool_cleared = 0       # 连接池被清空次数
+
+    def _incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._incr("pool_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._incr("created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._incr("closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._incr("checkout_failed")
+
+    def connection_checked_out(self, event):
+        self._incr("checked_out")
+
+    def connection_checked_in(self, event):
+        self._incr("checked_in")
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "open_connections": self.created - self.closed,
+                "in_use_connections": self.checked_out - self.checked_in,
+                "created": self.created,
+                "closed": self.closed,
+                "checked_out": self.checked_out,
+                "checkout_failed": self.checkout_failed,
+                "pool_cleared": self.pool_cleared,
+            }
+
+
+class MongoRegistry:
+    """
+    进程级Mongo连接注册表
+
+    每个进程内，同一个(host, port)只创建一个MongoClient，所有企业数据库共享此连接池。
+
+    说明：
+        1. MongoClient不是fork安全的。uwsgi先加载应用再fork出worker，
+        所以连接在首次使用时才创建（fork之后），并记录创建时的进程id，
+        如果发现进程id变化，丢弃父进程的连接重新创建。
+        2. 连接池大小、超时时间在settings.py中配置，见POOL_OPTION_MAPPING。
+    """
+    _lock = threading.Lock()
+    _pid = None
+    _clients = {}           # {(host, port): MongoClient}
+    _listeners = {}         # {(host, port): PoolStatsListener}
+    _config = {}
+
+    @classmethod
+    def init_app(cls, app):
+        """记录连接配置，不在此处创建连接"""
+        cls._config = {
+            "host": app.config.get("MONGO_HOST"),
+            "port": app.config.get("MONGO_PORT"),
+            "options": get_pool_options(app.config),
+        }
+
+    @classmethod
+    def _check_fork(cls):
+        """如果当前进程是fork出的子进程，丢弃从父进程继承的连接"""
+        pid = os.getpid()
+        if cls._pid != pid:
+            cls._clients = {}
+            cls._listeners = {}
+            cls._pid = pid
+
+    @classmethod
+    def get_client(cls, host=None, port=None):
+        """
+        获取共享的MongoClient
+
+        :param host: str. 默认使用配置中的MONGO_HOST
+        :param port: int. 默认使用配置中的MONGO_PORT
+        :return: MongoClient.
+        """
+        host = host or cls._config.get("host")
+        port = port or cls._config.get("port")
+        key = (host, port)
+
+        with cls._lock:
+            cls._check_fork()
+
+            client = cls._clients.get(key)
+            if client is None:
+                listener = PoolStatsListener()
+                options = cls._config.get("options", {})
+                client = MongoClient(host=host, port=port, event_listeners=[listener], **options)
+                cls._clients[key] = client
+                cls._listeners[key] = listener
+
+        return client
+
+    @classmethod
+    def get_db(cls, db_name):
+        """根据数据库名称获取企业数据库"""
+        return cls.get_client()[db_name]
+
+    @classmethod
+    def get_pool_stats(cls):
+        """
+        获取当前进程所有连接池的统计信息
+
+        :return: list. [{'host': str, 'port': int, 'pid': int, 'max_pool_size': int, ...}, ...]
+        """
+        with cls._lock:
+            cls._check_fork()
+            items = list(cls._listeners.items())
+            clients = dict(cls._clients)
+
+        stats_list = []
+        for (host, port), listener in items:
+            client = clients.get((host, port))
+            pool_options = client.options.pool_options
+            stats = {
+                "host": host,
+                "port": port,
+                "pid": cls._pid,
+                "max_pool_size": pool_options.max_pool_size,
+                "min_pool_size": pool_options.min_pool_size,
+            }
+            stats.update(listener.get_stats())
+            stats_list.append(stats)
+
+        return stats_list
+
+    @classmethod
+    def close(cls):
+        """关闭当前进程的所有连接（worker退出时调用）"""
+        with cls._lock:
+            if cls._pid == os.getpid():
+                for client in cls._clients.values():
+                    client.close()
+
+            cls._clients = {}
+            cls._listeners = {}
 
 
 class Mongo:
@@ -13,15 +217,17 @@ class Mongo:
         self.host = host
         self.port = port
 
-        try:
-            self.client = MongoClient(host=host, port=port)
-        except Exception as e:
-            raise e
+        # 使用进程内共享的连接，避免每次实例化都创建新的连接池
+        self.client = MongoRegistry.get_client(host, port)
 
     def get_db_by_name(self, db_name):
         """根据名称获取数据库连接"""
         return self.client[db_name]
 
+    def get_db(self, db_name):
+        """同get_db_by_name"""
+        return self.get_db_by_name(db_name)
+
     def get_db_by_request(self, request):
         """根据请求中的user.enterprise_id获取对应数据库连接"""
         enterprise_id = request.user.get("enterprise_id")
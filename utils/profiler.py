@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/8
+Last Modified: 2024/12/8
+Description: 按请求统计Mongo命令（次数、耗时、返回文档数），发现N+1查询
+"""
+import json
+import time
+import datetime
+import threading
+import traceback
+
+from flask import request
+from pymongo import monitoring
+
+from app.extentions import mongo
+from app.models.log import SlowRequestLogModel
+from utils.dt import DateTime
+from utils.log import RequestLogWriter
+from utils.metrics import Metrics
+
+
+# 不计入查询形状的命令（游标续取、会话管理等）
+IGNORED_SHAPE_COMMANDS = {"getMore", "killCursors", "endSessions", "abortTransaction", "commitTransaction"}
+
+
+def _get_filter(command_name, command):
+    """取出命令中的查询条件"""
+    if command_name == "find":
+        return command.get("filter")
+
+    if command_name == "aggregate":
+        # 第一个$match的条件，阶段名在get_query_shape中加入
+        pipeline = command.get("pipeline") or []
+        return next((stage["$match"] for stage in pipeline if "$match" in stage), None)
+
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query")
+
+    if command_name == "update":
+        updates = command.get("updates") or [{}]
+        return updates[0].get("q")
+
+    if command_name == "delete":
+        deletes = command.get("deletes") or [{}]
+        return deletes[0].get("q")
+
+    return None
+
+
+def _normalize(value):
+    """保留字段名和操作符，值统一替换为"?"，得到查询形状"""
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(v, dict) for v in value):
+            return [_normalize(v) for v in value]
+        # $in等值列表，不区分长度
+        return ["?"]
+
+    return "?"
+
+
+def get_query_shape(command_name, database_name, command):
+    """
+    获取命令的查询形状，值不同、结构相同的查询形状相同
+
+    :return: str or None. 例如'find NZY_xxx.land {"_id": "?"}'，不需要统计的命令返回None
+    """
+    if command_name in IGNORED_SHAPE_COMMANDS:
+        return None
+
+    collection_name = command.get(command_name)
+    if not isinstance(collection_name, str):
+        collection_name = ""
+
+    command_label = command_name
+    if command_name == "aggregate":
+        stages = ",".join(list(stage)[0] for stage in command.get("pipeline") or [] if stage)
+        command_label = f"aggregate[{stages}]"
+
+    query_filter = _get_filter(command_name, command)
+    shape = json.dumps(_normalize(query_filter), sort_keys=True, ensure_ascii=False) if query_filter else ""
+    return f"{command_label} {database_name}.{collection_name} {shape}".strip()
+
+
+class RequestProfile:
+    """一次请求中的Mongo命令统计"""
+    def __init__(self):
+        self.commands = 0               # 命令数（数据库往返次数）
+        self.duration_micros = 0        # 命令总耗时(微秒)
+        self.documents = 0              # 查询返回的文档数
+        self.shapes = {}                # {查询形状: [次数, 耗时(微秒)]}
+        self._pending = {}              # {request_id: 查询形状}，命令开始到结束之间
+
+    def on_started(self, event):
+        self.commands += 1
+
+        shape = get_query_shape(event.command_name, event.database_name, event.command)
+        if shape is None:
+            return
+
+        self.shapes.setdefault(shape, [0, 0])[0] += 1
+        self._pending[event.request_id] = shape
+
+    def on_finished(self, event, reply=None):
+        self.duration_micros += event.duration_micros
+
+        shape = self._pending.pop(event.request_id, None)
+        if shape is not None:
+            self.shapes[shape][1] += event.duration_micros
+
+        cursor = reply.get("cursor") if isinstance(reply, dict) else None
+        if isinstance(cursor, dict):
+            self.documents += len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+
+    def get_repeated_shapes(self, threshold):
+        """
+        重复次数不少于threshold的查询形状，按次数降序
+
+        :return: list. [{'shape': str, 'count': int, 'duration_ms': float}, ...]
+        """
+        repeated = [
+            {"shape": shape, "count": count, "duration_ms": round(micros / 1000, 3)}
+            for shape, (count, micros) in self.shapes.items() if count >= threshold
+        ]
+        repeated.sort(key=lambda item: item["count"], reverse=True)
+        return repeated
+
+
+class ProfileCommandListener(monitoring.CommandListener):
+    """
+    把Mongo命令事件记到当前请求的RequestProfile上
+
+    pymongo在执行命令的线程中同步回调，通过线程变量找到当前请求；请求之外（如后台线程）的命令不统计。
+    """
+    def started(self, event):
+        profile = MongoProfiler.current()
+        if profile is not None:
+            profile.on_started(event)
+
+    def succeeded(self, event):
+        profile = MongoProfiler.current()
+        if profile is not None:
+            profile.on_finished(event, event.reply)
+
+    def failed(self, event):
+        profile = MongoProfiler.current()
+        if profile is not None:
+            profile.on_finished(event)
+
+
+class MongoProfiler:
+    """
+    请求级Mongo命令统计
+
+    说明：
+        1. 每个请求统计命令数、耗时、返回文档数，写入指标（/admin_api/v1/system/metrics）。
+        2. 满足以下任一条件的请求记为问题请求，计入flagged_requests_total，并写入慢请求日志（主库sys_log_slow_request）：
+            - slow: 请求耗时超过MONGO_PROFILE_SLOW_MS
+            - round_trips: 命令数超过MONGO_PROFILE_ROUND_TRIP_BUDGET
+            - repeated_query: 同一形状的查询执行次数不少于MONGO_PROFILE_REPEAT_THRESHOLD，通常是逐行查询（N+1）
+        3. 命令监听需要在创建MongoClient之前注册。
+    """
+    _local = threading.local()
+
+    enabled = True
+    round_trip_budget = 30
+    repeat_threshold = 10
+    slow_ms = 1000
+    slow_log_enabled = True
+
+    @classmethod
+    def init_app(cls, app):
+        cls.enabled = app.config.get("MONGO_PROFILE_ENABLED", True)
+        cls.round_trip_budget = app.config.get("MONGO_PROFILE_ROUND_TRIP_BUDGET", cls.round_trip_budget)
+        cls.repeat_threshold = app.config.get("MONGO_PROFILE_REPEAT_THRESHOLD", cls.repeat_threshold)
+        cls.slow_ms = app.config.get("MONGO_PROFILE_SLOW_MS", cls.slow_ms)
+        cls.slow_log_enabled = app.config.get("SLOW_REQUEST_LOG_ENABLED", True)
+        SlowRequestLogModel.retention_days = app.config.get("SLOW_REQUEST_LOG_RETENTION_DAYS",
+                                                            SlowRequestLogModel.retention_days)
+        if not cls.enabled:
+            return
+
+        monitoring.register(ProfileCommandListener())
+        app.before_request(cls.before_request)
+        app.after_request(cls.after_request)
+
+    @classmethod
+    def current(cls):
+        """当前线程正在处理的请求的统计，不在请求中返回None"""
+        return getattr(cls._local, "profile", None)
+
+    @classmethod
+    def before_request(cls):
+        profile = RequestProfile()
+        cls._local.profile = profile
+        request.mongo_profile = profile
+        request.profile_start = time.perf_counter()
+
+    @classmethod
+    def after_request(cls, response):
+        profile = cls.current()
+        cls._local.profile = None
+        if profile is None:
+            return response
+
+        try:
+            cls.report(profile, response)
+        except Exception:
+            # 统计失败不影响请求
+            traceback.print_exc()
+
+        return response
+
+    @classmethod
+    def get_reasons(cls, profile, duration_ms):
+        reasons = []
+        if duration_ms >= cls.slow_ms:
+            reasons.append("slow")
+
+        if profile.commands > cls.round_trip_budget:
+            reasons.append("round_trips")
+
+        if profile.get_repeated_shapes(cls.repeat_threshold):
+            reasons.append("repeated_query")
+
+        return reasons
+
+    @classmethod
+    def report(cls, profile, response):
+        """写入指标，问题请求写入慢请求日志"""
+        duration_ms = (time.perf_counter() - request.profile_start) * 1000
+        endpoint, tenant = Metrics.get_request_labels()
+        labels = (("endpoint", endpoint), ("tenant", tenant))
+
+        Metrics.inc("mongo_commands_total", labels, profile.commands)
+        Metrics.inc("mongo_command_seconds_total", labels, profile.duration_micros / 1000000)
+        Metrics.inc("mongo_documents_returned_total", labels, profile.documents)
+
+        reasons = cls.get_reasons(profile, duration_ms)
+        for reason in reasons:
+            Metrics.inc("flagged_requests_total", (("endpoint", endpoint), ("reason", reason)))
+
+        if reasons and cls.slow_log_enabled:
+            cls.write_slow_log(profile, response, duration_ms, reasons, endpoint, tenant)
+
+    @classmethod
+    def write_slow_log(cls, profile, response, duration_ms, reasons, endpoint, tenant):
+        user = getattr(request, "user", None) or {}
+        log_data = {
+            "created_at": datetime.datetime.utcnow(),
+            "start_time": DateTime.get_datetime_now_str(),
+            "url": request.url,
+            "url_rule": endpoint,
+            "http_method": request.method,
+            "status_code": response.status_code,
+            "user_id": str(user.get("_id")) if user.get("_id") else None,
+            "enterprise_id": tenant if tenant != "-" else None,
+            "request_log_id": getattr(request, "log_id", None),
+            "duration_ms": round(duration_ms, 3),
+            "reasons": reasons,
+            "mongo": {
+                "commands": profile.commands,
+                "duration_ms": round(profile.duration_micros / 1000, 3),
+                "documents": profile.documents,
+                "repeated_shapes": profile.get_repeated_shapes(cls.repeat_threshold)[:10]
+            }
+        }
+        RequestLogWriter.write(mongo.db, log_data, model=SlowRequestLogModel)
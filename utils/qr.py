@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Author: niziheng
+Created Date: 2024/12/14
+Last Modified: 2024/12/14
+Description: 二维码渲染（内存中生成，不写本地文件）
+"""
+import io
+import os
+import zlib
+import hashlib
+import struct
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import qrcode
+
+
+class QRRenderer:
+    """
+    二维码渲染配置，创建一次后重复使用
+
+    输出格式：
+        - png: 默认，与改造前一致（qrcode生成图片，安装了Pillow时用Pillow，否则用PyPNG）
+        - png1: 1位灰度PNG，直接由二维码矩阵编码，不依赖Pillow，速度快
+        - svg: 每行相邻的黑色模块合并为一个矩形，打印时可任意缩放
+
+    说明：
+        1. qrcode.QRCode在make(fit=True)时会修改自身的version，不能跨线程共享，每次渲染新建；
+           QRRenderer本身只保存配置，线程安全，也可以传给子进程。
+        2. mask_pattern为None时，qrcode会尝试全部8种掩码并选择最优的一种，约占编码耗时的一半；
+           指定掩码（0~7）生成的二维码同样符合标准，可以正常识别。
+    """
+    # {格式: (文件后缀, Content-Type)}
+    FORMATS = {
+        "png": (".png", "image/png"),
+        "png1": (".png", "image/png"),
+        "svg": (".svg", "image/svg+xml"),
+    }
+
+    def __init__(self, image_format="png", version=2, box_size=6, border=2,
+                 error_correction=qrcode.constants.ERROR_CORRECT_Q, mask_pattern=None):
+        if image_format not in self.FORMATS:
+            raise ValueError(f"不支持的二维码格式：{image_format}")
+
+        self.image_format = image_format
+        self.version = version
+        self.box_size = box_size
+        self.border = border
+        self.error_correction = error_correction
+        self.mask_pattern = mask_pattern
+        self.extension, self.content_type = self.FORMATS[image_format]
+
+    def get_cache_key(self, data):
+        """
+        二维码内容+渲染配置的哈希，内容和配置都相同时图片相同
+
+        :param data: str. 二维码内容
+        :return: str.
+        """
+        config = f"{self.image_format}|{self.version}|{self.box_size}|{self.border}|" \
+                 f"{self.error_correction}|{self.mask_pattern}"
+        return hashlib.sha256(f"{config}|{data}".encode("utf-8")).hexdigest()
+
+    def make(self, data):
+        """
+        编码
+
+        :param data: str. 二维码内容
+        :return: qrcode.QRCode
+        """
+        qr_code = qrcode.QRCode(
+            version=self.version,
+            error_correction=self.error_correction,
+            box_size=self.box_size,
+            border=self.border,
+            mask_pattern=self.mask_pattern
+        )
+        qr_code.add_data(data)
+        qr_code.make(fit=True)
+        return qr_code
+
+    def render(self, data):
+        """
+        生成二维码图片
+
+        :param data: str. 二维码内容
+        :return: bytes. 图片数据
+        """
+        qr_code = self.make(data)
+
+        if self.image_format == "png1":
+            return self.encode_png1(qr_code.modules)
+
+        if self.image_format == "svg":
+            return self.encode_svg(qr_code.modules)
+
+        stream = io.BytesIO()
+        qr_code.make_image().save(stream)
+        return stream.getvalue()
+
+    def _get_matrix(self, modules):
+        """加上边框的模块矩阵，True为黑色"""
+        size = len(modules) + self.border * 2
+        blank_row = [False] * size
+        side = [False] * self.border
+
+        matrix = [blank_row] * self.border
+        matrix.extend(side + list(row) + side for row in modules)
+        matrix.extend([blank_row] * self.border)
+        return matrix
+
+    def encode_png1(self, modules):
+        """1位灰度PNG（0为黑色，1为白色）"""
+        matrix = self._get_matrix(modules)
+        width = len(matrix) * self.box_size
+        padding = "1" * (-width % 8)
+
+        scanlines = []
+        for row in matrix:
+            bits = "".join("0" * self.box_size if dark else "1" * self.box_size for dark in row) + padding
+            # 每行以过滤类型0开头，每个模块占box_size行
+            scanline = b"\x00" + int(bits, 2).to_bytes(len(bits) // 8, "big")
+            scanlines.append(scanline * self.box_size)
+
+        def chunk(chunk_type, chunk_data):
+            body = chunk_type + chunk_data
+            return struct.pack(">I", len(chunk_data)) + body + struct.pack(">I", zlib.crc32(body))
+
+        header = struct.pack(">IIBBBBB", width, width, 1, 0, 0, 0, 0)
+        return b"".join([
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", header),
+            chunk(b"IDAT", zlib.compress(b"".join(scanlines), 9)),
+            chunk(b"IEND", b"")
+        ])
+
+    def encode_svg(self, modules):
+        """SVG，坐标单位为模块，显示尺寸为box_size像素/模块"""
+        matrix = self._get_matrix(modules)
+        size = len(matrix)
+
+        paths = []
+        for y, row in enumerate(matrix):
+            x = 0
+            while x < size:
+                if not row[x]:
+                    x += 1
+                    continue
+
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                paths.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+
+        pixels = size * self.box_size
+        svg = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+            f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/>'
+            f'<path d="{"".join(paths)}" fill="#000"/></svg>'
+        )
+        return svg.encode("utf-8")
+
+
+def render_batch(renderer, data_list):
+    """在子进程中渲染一批二维码（需要是模块级函数，才能传给进程池）"""
+    return [renderer.render(data) for data in data_list]
+
+
+class QRRenderPool:
+    """
+    批量渲染二维码的进程池
+
+    说明：
+        1. 二维码编码是纯Python计算，受GIL限制，多线程不能提速，批量生成时分批交给子进程渲染。
+        2. 每个worker一个进程池。子进程默认用fork创建（QR_RENDER_START_METHOD），
+           只做渲染计算，不使用继承的数据库连接；spawn/forkserver会在子进程中重新导入run.py（导入时即创建app），
+           并且在uwsgi中sys.executable不是python解释器，不适合本项目。
+        3. 在多线程的进程中fork，其他线程持有的锁（日志、数据库连接池等）在子进程中永远不会释放，子进程可能死锁。
+           uwsgi的worker在fork之后、请求线程和后台线程（RequestLogWriter、JobWorker）启动之前调用start创建进程池
+           （见app.register_postfork）；没有预先创建（例如未使用uwsgi、进程池异常退出后重建）且当前进程已有其他线程时，
+           不创建进程池，在当前线程中渲染。
+        4. 数量少于QR_RENDER_MIN_BATCH，或QR_RENDER_PROCESSES<=1时，在当前线程中渲染。
+        5. map可执行其他渲染任务（例如二维码标签页，见utils.label）。
+    """
+    processes = os.cpu_count() or 1
+    min_batch = 50
+    chunk_size = 200
+    start_method = "fork"
+
+    _executor = None
+    _pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def init_app(cls, app):
+        cls.processes = app.config.get("QR_RENDER_PROCESSES") or cls.processes
+        cls.min_batch = app.config.get("QR_RENDER_MIN_BATCH", cls.min_batch)
+        cls.chunk_size = app.config.get("QR_RENDER_CHUNK_SIZE", cls.chunk_size)
+        cls.start_method = app.config.get("QR_RENDER_START_METHOD", cls.start_method)
+
+    @classmethod
+    def _create_executor(cls):
+        context = multiprocessing.get_context(cls.start_method)
+        cls._executor = ProcessPoolExecutor(max_workers=cls.processes, mp_context=context)
+        cls._pid = os.getpid()
+
+    @classmethod
+    def start(cls):
+        """
+        创建进程池并立即创建全部子进程（fork方式在第一次提交任务时创建全部子进程）
+
+        在当前进程还没有其他线程时调用（uwsgi的postfork）。
+        """
+        if cls.processes <= 1:
+            return
+
+        with cls._lock:
+            cls._create_executor()
+            executor = cls._executor
+
+        executor.submit(os.getpid).result()
+
+    @classmethod
+    def _get_executor(cls):
+        """
+        当前进程的进程池
+
+        :return: ProcessPoolExecutor or None. 需要新建进程池、但当前进程已有其他线程（fork不安全）时返回None
+        """
+        pid = os.getpid()
+        if cls._executor is not None and cls._pid == pid:
+            return cls._executor
+
+        with cls._lock:
+            if cls._executor is None or cls._pid != pid:
+                if cls.start_method == "fork" and threading.active_count() > 1:
+                    return None
+                cls._create_executor()
+
+        return cls._executor
+
+    @classmethod
+    def map(cls, func, args_iter, parallel=True):
+        """
+        在进程池中执行func(*args)，按参数的顺序返回结果
+
+        同时提交的任务不超过进程数的2倍，参数可以是生成器（例如从数据库游标逐页读取），内存占用不随总数增长。
+
+        :param func: function. 模块级函数
+        :param args_iter: iterable. 每个任务的参数(tuple)
+        :param parallel: bool. False时在当前线程中执行
+        :return: generator.
+        """
+        if not parallel or cls.processes <= 1:
+            for args in args_iter:
+                yield func(*args)
+            return
+
+        executor = cls._get_executor()
+        if executor is None:
+            for args in args_iter:
+                yield func(*args)
+            return
+
+        pending = collections.deque()
+        try:
+            for args in args_iter:
+                pending.append(executor.submit(func, *args))
+                if len(pending) >= cls.processes * 2:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        except BrokenProcessPool:
+            # 子进程异常退出，下次使用时重新创建进程池
+            with cls._lock:
+                if cls._executor is executor:
+                    cls._executor = None
+            raise
+        finally:
+            # 调用方中途退出（例如写入数据库失败、客户端断开）时，取消还没开始的任务
+            for future in pending:
+                future.cancel()
+
+    @classmethod
+    def render_chunks(cls, renderer, data_list):
+        """
+        分批渲染，按顺序逐批返回，调用方可以每批写入数据库，不需要等全部渲染完成
+
+        :param renderer: QRRenderer. 渲染配置
+        :param data_list: list. 二维码内容
+        :return: generator. 每次返回一批图片数据，list of bytes，与data_list顺序一致
+        """
+        chunks = ((renderer, data_list[i:i + cls.chunk_size]) for i in range(0, len(data_list), cls.chunk_size))
+        return cls.map(render_batch, chunks, parallel=len(data_list) >= cls.min_batch)
+
+    @classmethod
+    def shutdown(cls):
+        """worker退出时关闭进程池"""
+        with cls._lock:
+            if cls._executor is not None and cls._pid == os.getpid():
+                cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+            cls._pid = None
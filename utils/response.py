@@ -188,13 +188,33 @@ class ResponseMaker:
     @staticmethod
     def document_import_type_error():
         """档案名称重复"""
-        return make_response(10031, "参数import_type枚举值错误。可选值为: APPEND, COVER"), 200
+        return make_response(10031, "参数import_type枚举值错误。可选值为: APPEND, COVER, MERGE"), 200
 
     @staticmethod
     def document_data_import_failed(msg):
         """档案导入失败"""
         return make_response(10032, f"档案数据导入失败。原因：{msg}"), 200
 
+    @staticmethod
+    def inventory_insufficient():
+        """出库时库存不足"""
+        return make_response(10033, "库存不足"), 200
+
+    @staticmethod
+    def document_data_importing():
+        """档案已有等待中/执行中的导入任务"""
+        return make_response(10034, "档案正在导入，请等待当前导入完成"), 200
+
+    @staticmethod
+    def job_finished():
+        """任务已结束，无法取消"""
+        return make_response(10035, "任务已结束，无法取消"), 200
+
+    @staticmethod
+    def qr_label_exporting():
+        """同时导出二维码标签的数量已达到上限"""
+        return make_response(10036, "正在导出的二维码标签较多，请稍后再试"), 200
+
     # 2xxxx，系统返回值
     @staticmethod
     def token_missing():